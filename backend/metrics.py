@@ -0,0 +1,115 @@
+"""Prometheus instrumentation for the Lucky Wheel API.
+
+Request metrics are recorded by MetricsRoute, a FastAPI route class, so the
+route template and its label children are resolved once per route rather
+than per request. Mongo timings come from a pymongo CommandListener
+attached to the Motor client.
+"""
+import time
+from typing import Callable
+
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+REQUESTS = Counter(
+    "lucky_wheel_http_requests_total", "HTTP requests by route, method and status",
+    ["route", "method", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "lucky_wheel_http_request_duration_seconds", "HTTP request latency by route",
+    ["route", "method"], buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge(
+    "lucky_wheel_http_requests_in_flight", "Requests currently being handled by route",
+    ["route", "method"],
+)
+SPIN_OUTCOMES = Counter(
+    "lucky_wheel_spin_outcomes_total", "Successful spins by campaign and prize label", ["campaign", "prize"],
+)
+SPIN_REPLAYS = Counter(
+    "lucky_wheel_spin_replays_total", "Spin retries answered with the stored outcome of their idempotency key",
+    ["source"],
+)
+HISTORY_QUEUE_DEPTH = Gauge(
+    "lucky_wheel_history_queue_depth", "Draw records buffered for the next draw_history flush",
+)
+HISTORY_FLUSH_SIZE = Histogram(
+    "lucky_wheel_history_flush_records", "Draw records written per draw_history flush",
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000),
+)
+STARTUP_SECONDS = Gauge(
+    "lucky_wheel_startup_seconds", "Seconds from loading server.py to the end of each startup phase", ["phase"],
+)
+READY = Gauge("lucky_wheel_ready", "1 while this worker passes /readyz")
+MONGO_LATENCY = Histogram(
+    "lucky_wheel_mongo_command_duration_seconds", "MongoDB command latency by collection and command",
+    ["collection", "command"], buckets=LATENCY_BUCKETS,
+)
+MONGO_FAILURES = Counter(
+    "lucky_wheel_mongo_command_failures_total", "Failed MongoDB commands by collection and command",
+    ["collection", "command"],
+)
+
+# Handshake and session bookkeeping commands are not interesting per collection
+_IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "buildInfo", "saslStart", "saslContinue"}
+
+
+class MetricsRoute(APIRoute):
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+        method = next(iter(sorted(self.methods or {"GET"})))
+        latency = REQUEST_LATENCY.labels(self.path, method)
+        in_flight = IN_FLIGHT.labels(self.path, method)
+        route = self.path
+
+        async def timed_handler(request: Request) -> Response:
+            started = time.perf_counter()
+            in_flight.inc()
+            status = 500
+            try:
+                response = await handler(request)
+                status = response.status_code
+                return response
+            except Exception as e:
+                status = getattr(e, "status_code", 500)
+                raise
+            finally:
+                in_flight.dec()
+                latency.observe(time.perf_counter() - started)
+                REQUESTS.labels(route, method, str(status)).inc()
+
+        return timed_handler
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command on the client it is registered with."""
+
+    def __init__(self):
+        # request_id -> (collection, command); started/finished pair up by id
+        self._pending = {}
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "")
+        self._pending[event.request_id] = (collection or "-", event.command_name)
+
+    def succeeded(self, event):
+        labels = self._pending.pop(event.request_id, None)
+        if labels:
+            MONGO_LATENCY.labels(*labels).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = self._pending.pop(event.request_id, None)
+        if labels:
+            MONGO_LATENCY.labels(*labels).observe(event.duration_micros / 1e6)
+            MONGO_FAILURES.labels(*labels).inc()
+
+
+def metrics_response() -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -1,45 +1,191 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Header, Query, Request, UploadFile, File
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
+import math
 import random
+import re
 import string
 import jwt
 import hashlib
+import hmac
+import secrets
+import orjson
+import numpy as np
+import asyncio
+import json
+import time
+import shutil
+import tempfile
+import base64
+import csv
+import io
+import zlib
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional, Set, Tuple
 from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from metrics import (
+    HISTORY_FLUSH_SIZE, HISTORY_QUEUE_DEPTH, READY, STARTUP_SECONDS, MetricsRoute, MongoCommandMetrics,
+    SPIN_OUTCOMES, SPIN_REPLAYS, metrics_response,
+)
+from storage import DEFAULT_CAMPAIGN, Storage, create_storage
 
+BOOT_STARTED = time.monotonic()
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-mongo_url = os.environ.get('MONGO_URL')
-if not mongo_url:
-    raise ValueError("MONGO_URL environment variable is required")
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'naga1001')]
-
 JWT_SECRET = os.environ.get('JWT_SECRET', 'lucky-wheel-secret-key-2024')
+STATS_RECONCILE_INTERVAL = float(os.environ.get('STATS_RECONCILE_INTERVAL', '3600'))
+DRAW_REPLAY_SIZE = int(os.environ.get('DRAW_REPLAY_SIZE', '50'))
+DRAW_SUBSCRIBER_QUEUE = int(os.environ.get('DRAW_SUBSCRIBER_QUEUE', '100'))
+HISTORY_BATCH_SIZE = int(os.environ.get('HISTORY_BATCH_SIZE', '500'))
+HISTORY_FLUSH_INTERVAL = float(os.environ.get('HISTORY_FLUSH_INTERVAL', '0.05'))
+HISTORY_QUEUE_SIZE = int(os.environ.get('HISTORY_QUEUE_SIZE', '10000'))  # per campaign
+HISTORY_RECOVERY_GRACE = float(os.environ.get('HISTORY_RECOVERY_GRACE', '60'))
+HISTORY_RECOVERY_INTERVAL = float(os.environ.get('HISTORY_RECOVERY_INTERVAL', '60'))
+HISTORY_DRAIN_TIMEOUT = float(os.environ.get('HISTORY_DRAIN_TIMEOUT', '10'))
+HISTORY_RETENTION_DAYS = float(os.environ.get('HISTORY_RETENTION_DAYS', '30'))
+HOURLY_ROLLUP_RETENTION_DAYS = float(os.environ.get('HOURLY_ROLLUP_RETENTION_DAYS', '90'))
+ARCHIVE_INTERVAL = float(os.environ.get('ARCHIVE_INTERVAL', '3600'))
+ARCHIVE_BATCH_SIZE = 1000
+SSE_HEARTBEAT_SECONDS = 15
+PRIZES_CACHE_CONTROL = "public, max-age=5"
+HISTORY_CACHE_CONTROL = "public, max-age=0, must-revalidate"
+HISTORY_PAGE_SIZE = 50  # default /api/history page, primed at startup
+BATCH_DRAW_CHUNK_SIZE = 1000
+SIMULATION_MAX_SPINS = 20_000_000
+SIMULATION_CHUNK_SIZE = 1_000_000
+FAIRNESS_Z = 1.96  # 95% intervals
+FAIRNESS_ALPHA = 0.05
+INDEX_PLAN_CHECK = os.environ.get('INDEX_PLAN_CHECK', '').lower() in ('1', 'true', 'yes')
 MASTER_ADMIN_USER = os.environ.get('MASTER_ADMIN_USER', 'master')
 MASTER_ADMIN_PASS = os.environ.get('MASTER_ADMIN_PASS', 'dragonmaster2024!')
+PASSWORD_SCRYPT_N = int(os.environ.get('PASSWORD_SCRYPT_N', str(2 ** 14)))
+PASSWORD_SCRYPT_R = int(os.environ.get('PASSWORD_SCRYPT_R', '8'))
+PASSWORD_SCRYPT_P = int(os.environ.get('PASSWORD_SCRYPT_P', '1'))
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', '100000'))
+# Reverse proxies in front of the app that append to X-Forwarded-For (the
+# ingress is one). Clients are keyed on the entry the outermost of them
+# added; 0 keys on the socket peer and ignores the header.
+RATE_LIMIT_PROXY_HOPS = int(os.environ.get('RATE_LIMIT_PROXY_HOPS', '1'))
+
+def rate_limit_env(name: str, default: str):
+    """"<tokens per second>,<burst>" from the environment."""
+    rate, burst = os.environ.get(name, default).split(',')
+    return float(rate), int(burst)
+
+SPIN_LIMIT_PER_IP = rate_limit_env('SPIN_LIMIT_PER_IP', '5,20')
+SPIN_LIMIT_PER_USER = rate_limit_env('SPIN_LIMIT_PER_USER', '1,5')
+LOGIN_LIMIT_PER_IP = rate_limit_env('LOGIN_LIMIT_PER_IP', '0.2,10')
+LOGIN_LIMIT_PER_USER = rate_limit_env('LOGIN_LIMIT_PER_USER', '0.1,5')
+# Several workers (uvicorn --workers / WEB_CONCURRENCY) share one database; each
+# keeps its own caches and refreshes them when the shared version document moves
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', '1'))
+MULTI_WORKER = os.environ.get('MULTI_WORKER', str(WEB_CONCURRENCY > 1)).lower() in ('1', 'true', 'yes')
+VERSION_POLL_INTERVAL = float(os.environ.get('VERSION_POLL_INTERVAL', '1.0'))
+REPLAY_REFRESH_DELAY = 1.0
+# Size pools per worker so N workers together stay near the server's budget
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', str(max(10, 100 // WEB_CONCURRENCY))))
+# Connections opened before /readyz passes, and kept open afterwards
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', str(min(5, MONGO_MAX_POOL_SIZE))))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '0'))  # 0 = no timeout
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')  # e.g. "zstd,snappy,zlib"; empty = off
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', '300'))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '1024'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+# Campaigns seeded with DEFAULT_PRIZES on startup; more can be added at /api/admin/campaigns
+CAMPAIGNS = list(dict.fromkeys(
+    [DEFAULT_CAMPAIGN] + [c.strip() for c in os.environ.get('CAMPAIGNS', '').split(',') if c.strip()]
+))
 
-app = FastAPI()
-api_router = APIRouter(prefix="/api")
+# Built in the lifespan, so a bad configuration is reported by the probes
+# instead of failing the import
+storage: Optional[Storage] = None
+
+def build_storage() -> Storage:
+    # Motor connects lazily, so building the client does no I/O
+    return create_storage(
+        event_listeners=[MongoCommandMetrics()],
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS or None,
+        **({"compressors": MONGO_COMPRESSORS} if MONGO_COMPRESSORS else {}),
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # See the Startup & readiness section
+    global storage, startup_error, warm_up_task
+    try:
+        storage = build_storage()
+        await seed_data()
+    except Exception as e:
+        startup_error = f"{type(e).__name__}: {e}"
+        logger.exception("Startup failed; /healthz and /readyz will report it")
+    else:
+        warm_up_task = asyncio.create_task(warm_up())
+    try:
+        yield
+    finally:
+        await shutdown()
+
+app = FastAPI(lifespan=lifespan)
+api_router = APIRouter(prefix="/api", route_class=MetricsRoute)
 security = HTTPBearer()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # --- Helpers ---
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+# Passwords use salted scrypt, stored as scrypt$n$r$p$salt$hash. The KDF runs
+# on a small dedicated thread pool (hashlib releases the GIL) behind a
+# semaphore, so a login burst cannot stall the event loop or starve spins.
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="kdf")
+password_slots = asyncio.Semaphore(PASSWORD_HASH_WORKERS)
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * n * r * p + 1024 * 1024, dklen=32)
+
+def _hash_password_sync(password: str) -> str:
+    salt = secrets.token_bytes(16)
+    n, r, p = PASSWORD_SCRYPT_N, PASSWORD_SCRYPT_R, PASSWORD_SCRYPT_P
+    digest = _scrypt(password, salt, n, r, p)
+    return f"scrypt${n}${r}${p}${base64.b64encode(salt).decode()}${base64.b64encode(digest).decode()}"
+
+def _verify_password_sync(password: str, hashed: str) -> bool:
+    if not hashed.startswith("scrypt$"):
+        # Legacy unsalted SHA-256 hex digest
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), hashed)
+    _, n, r, p, salt, digest = hashed.split("$")
+    candidate = _scrypt(password, base64.b64decode(salt), int(n), int(r), int(p))
+    return hmac.compare_digest(candidate, base64.b64decode(digest))
+
+async def _run_kdf(func, *args):
+    async with password_slots:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+
+async def hash_password(password: str) -> str:
+    return await _run_kdf(_hash_password_sync, password)
 
-def verify_password(password: str, hashed: str) -> bool:
-    return hash_password(password) == hashed
+async def verify_password(password: str, hashed: str) -> bool:
+    return await _run_kdf(_verify_password_sync, password, hashed)
+
+def password_needs_rehash(hashed: str) -> bool:
+    return hashed.split("$")[:4] != ["scrypt", str(PASSWORD_SCRYPT_N), str(PASSWORD_SCRYPT_R), str(PASSWORD_SCRYPT_P)]
 
 # --- Models ---
 class AdminLoginRequest(BaseModel):
@@ -53,18 +199,37 @@ class CreateAdminRequest(BaseModel):
 class GenerateCodesRequest(BaseModel):
     usernames: List[str]
 
+class CreateCampaignRequest(BaseModel):
+    campaign: str
+
 class PrizeItem(BaseModel):
     label: str
     image_url: str = ""
     color: str
     probability: float = 50.0
+    stock: Optional[int] = Field(None, ge=0)  # lifetime cap on wins; None = unlimited
 
 class UpdatePrizesRequest(BaseModel):
     prizes: List[PrizeItem]
 
+class SimulatePrizesRequest(BaseModel):
+    prizes: Optional[List[PrizeItem]] = None  # draft pool; defaults to the live one
+    spins: int = Field(1_000_000, ge=1, le=SIMULATION_MAX_SPINS)
+    seed: Optional[int] = None
+
 class SpinRequest(BaseModel):
     username: str
     redeem_code: str
+    campaign: str = DEFAULT_CAMPAIGN
+
+class BatchDrawEntry(BaseModel):
+    username: str
+    redeem_code: str
+
+class BatchDrawRequest(BaseModel):
+    entries: List[BatchDrawEntry] = []
+    all_unused: bool = False
+    limit: Optional[int] = None
 
 class ChangePasswordRequest(BaseModel):
     current_password: str
@@ -75,27 +240,994 @@ def create_token(data: dict):
     payload = {**data, "exp": datetime.now(timezone.utc) + timedelta(hours=24)}
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
-async def verify_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=["HS256"])
-        if payload.get("role") not in ("admin", "master"):
-            raise HTTPException(status_code=403, detail="Not authorized")
+# Decoded tokens are cached by their raw string, so dashboard polling skips
+# jwt.decode. Revocation is checked against admin_token_versions, an
+# in-memory copy of every admin's token_version: a password change bumps it
+# and a deleted admin drops out, which rejects their older tokens. Accounts
+# start at a random version, so recreating a deleted username does not
+# bring its old tokens back. The copy is
+# reloaded on local admin changes and, across workers, through the shared
+# "admins" version.
+class PrincipalCache:
+    """Bounded LRU of decoded token payloads; entries expire after ttl or at the token's own exp."""
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()  # token -> (payload, expires_at monotonic)
+
+    def get(self, token: str) -> Optional[dict]:
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self.entries[token]
+            return None
+        self.entries.move_to_end(token)
+        return entry[0]
+
+    def put(self, token: str, payload: dict):
+        lifetime = min(self.ttl, payload.get("exp", 0) - time.time())
+        if lifetime <= 0:
+            return
+        self.entries[token] = (payload, time.monotonic() + lifetime)
+        self.entries.move_to_end(token)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_SIZE)
+admin_token_versions: Dict[str, Optional[int]] = {}  # None marks an account that no longer exists
+
+async def load_admin_token_versions():
+    global admin_token_versions
+    admin_token_versions = await storage.token_versions()
+
+async def admins_changed():
+    await load_admin_token_versions()
+    await publish_change("admins")
+
+async def current_token_version(username: str) -> Optional[int]:
+    if username not in admin_token_versions:
+        # Admin created on another worker since our last reload
+        account = await storage.get_admin(username)
+        admin_token_versions[username] = account.get("token_version", 0) if account else None
+    return admin_token_versions[username]
+
+async def admin_principal(credentials: HTTPAuthorizationCredentials) -> dict:
+    token = credentials.credentials
+    payload = principal_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        except jwt.ExpiredSignatureError:
+            raise HTTPException(status_code=401, detail="Token expired")
+        except jwt.InvalidTokenError:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        principal_cache.put(token, payload)
+    if await current_token_version(payload.get("username", "")) != payload.get("tv", 0):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return payload
+
+def require_role(*roles: str, detail: str = "Not authorized"):
+    async def dependency(credentials: HTTPAuthorizationCredentials = Depends(security)):
+        payload = await admin_principal(credentials)
+        if payload.get("role") not in roles:
+            raise HTTPException(status_code=403, detail=detail)
         return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    return dependency
+
+verify_admin = require_role("admin", "master")
+verify_master = require_role("master", detail="Only master admin can perform this action")
+
+# --- Rate limiting ---
+class TokenBucketLimiter:
+    """Token buckets per key, kept in an LRU of at most max_keys entries.
+
+    Memory stays fixed however many keys a bot cycles through; evicting an
+    idle key only forgets a bucket that would have refilled anyway.
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets: OrderedDict = OrderedDict()  # key -> [tokens, last refill]
+
+    def acquire(self, key: str) -> float:
+        """Take a token; returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(self.burst), now]
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+def client_ip(request: Request) -> str:
+    """The client address as seen by the outermost trusted proxy.
+
+    Entries left of that one come from the client itself and can be forged,
+    so they are never used. A request carrying fewer entries than there are
+    proxies did not come through them; it is keyed on its socket peer.
+    """
+    if RATE_LIMIT_PROXY_HOPS > 0:
+        forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if len(forwarded) >= RATE_LIMIT_PROXY_HOPS:
+            return forwarded[-RATE_LIMIT_PROXY_HOPS]
+    return request.client.host if request.client else "unknown"
+
+def enforce_limits(*checks):
+    """Raise 429 unless every (limiter, key) pair has a token; runs before any storage call."""
+    if not RATE_LIMIT_ENABLED:
+        return
+    for limiter, key in checks:
+        wait = limiter.acquire(key)
+        if wait:
+            raise HTTPException(
+                status_code=429, detail="Too many requests", headers={"Retry-After": str(math.ceil(wait))}
+            )
+
+spin_ip_limiter = TokenBucketLimiter(*SPIN_LIMIT_PER_IP, RATE_LIMIT_MAX_KEYS)
+spin_user_limiter = TokenBucketLimiter(*SPIN_LIMIT_PER_USER, RATE_LIMIT_MAX_KEYS)
+login_ip_limiter = TokenBucketLimiter(*LOGIN_LIMIT_PER_IP, RATE_LIMIT_MAX_KEYS)
+login_user_limiter = TokenBucketLimiter(*LOGIN_LIMIT_PER_USER, RATE_LIMIT_MAX_KEYS)
+
+class SingleFlight:
+    """Identical concurrent calls share one in-flight execution and its outcome."""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, func):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        # A caller that disconnects must not cancel the call for everyone else
+        return await asyncio.shield(task)
+
+spin_flights = SingleFlight()
+
+# --- Spin idempotency ---
+# Clients send an Idempotency-Key header with a spin and reuse it on retries.
+# The key is stored with the claimed code, so a retry is answered with the
+# original prize from this LRU or, on a miss (another worker, a restart),
+# from one indexed read once its claim fails on the already-used code. First
+# attempts go straight to the claim and never pay for that lookup.
+class SpinReplayCache:
+    """Bounded LRU of spin outcomes by (campaign, idempotency key)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict = OrderedDict()  # key -> (username, redeem_code, response)
+
+    def get(self, key) -> Optional[tuple]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry: tuple):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+spin_replays = SpinReplayCache(IDEMPOTENCY_CACHE_SIZE)
+
+# --- Campaigns ---
+# Each campaign is an independent wheel with its own prize pool, stock, codes,
+# history, stats, response-cache entries and live feed. Storage keys every
+# row by campaign and the in-process state below is per campaign too, so a
+# busy wheel never holds a lock or invalidates a cache another one reads.
+# Public routes take ?campaign= (spins name it in the body) and fall back to
+# DEFAULT_CAMPAIGN, so single-wheel clients keep working unchanged.
+CAMPAIGN_ID_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,39}$")
+
+class Campaign:
+    """In-process state of one campaign."""
+
+    def __init__(self, campaign_id: str):
+        self.id = campaign_id
+        self.pool = PrizePool([])
+        self.pool_lock = asyncio.Lock()
+        self.history_version = 0
+        self.broadcaster = DrawBroadcaster(DRAW_REPLAY_SIZE, DRAW_SUBSCRIBER_QUEUE)
+        self.replay_refresh_task: Optional[asyncio.Task] = None
+
+campaigns: Dict[str, Campaign] = {}
+
+def get_campaign(campaign_id: str) -> Campaign:
+    campaign = campaigns.get(campaign_id)
+    if campaign is None:
+        raise HTTPException(status_code=404, detail="Unknown campaign")
+    return campaign
+
+async def campaign_param(campaign: str = Query(DEFAULT_CAMPAIGN)) -> Campaign:
+    return get_campaign(campaign)
+
+async def open_campaign(campaign_id: str) -> Campaign:
+    """Load a campaign's prize pool, live-feed replay and stats into this worker."""
+    campaign = Campaign(campaign_id)
+    _, _, stats = await asyncio.gather(
+        load_prize_pool(campaign), load_draw_replay(campaign), storage.read_stats(campaign_id)
+    )
+    if stats is None:
+        await reconcile_stats(campaign_id)
+    campaigns[campaign_id] = campaign
+    return campaign
+
+async def load_campaigns():
+    await asyncio.gather(*(
+        open_campaign(campaign_id) for campaign_id in await storage.list_campaigns() if campaign_id not in campaigns
+    ))
+
+# --- Prize pool snapshot ---
+class PrizePool:
+    """Immutable, versioned view of the prize pool.
+
+    Draws use a Vose alias table so picking a prize is O(1) regardless of
+    how many segments the wheel has. Out-of-stock prizes are left out of the
+    table, which renormalizes the remaining weights.
+    """
+    __slots__ = ("version", "prizes", "exhausted", "eligible", "_prob", "_alias", "_prob_arr", "_alias_arr")
+
+    def __init__(self, prizes: List[dict], version: int = 0, exhausted: frozenset = frozenset()):
+        self.version = version
+        self.prizes = prizes
+        self.exhausted = exhausted
+        self.eligible = [p for p in prizes if p.get("probability", 0) > 0 and p["label"] not in exhausted]
+        self._prob, self._alias = self._build_alias([p["probability"] for p in self.eligible])
+        self._prob_arr = np.asarray(self._prob, dtype=np.float64)
+        self._alias_arr = np.asarray(self._alias, dtype=np.intp)
+
+    @staticmethod
+    def _build_alias(weights: List[float]):
+        n = len(weights)
+        if n == 0:
+            return [], []
+        total = float(sum(weights))
+        scaled = [w * n / total for w in weights]
+        prob = [0.0] * n
+        alias = [0] * n
+        small = [i for i, w in enumerate(scaled) if w < 1.0]
+        large = [i for i, w in enumerate(scaled) if w >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] = (scaled[l] + scaled[s]) - 1.0
+            (small if scaled[l] < 1.0 else large).append(l)
+        # Leftovers are 1.0 up to float rounding
+        for i in large + small:
+            prob[i] = 1.0
+            alias[i] = i
+        return prob, alias
+
+    def draw(self, rng: random.Random = random) -> dict:
+        i = int(rng.random() * len(self.eligible))
+        return self.eligible[i] if rng.random() < self._prob[i] else self.eligible[self._alias[i]]
+
+    def draw_indices(self, k: int, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+        """Sample k outcomes in one vectorized pass; returns indices into eligible."""
+        rng = rng or np.random.default_rng()
+        columns = rng.integers(0, len(self.eligible), size=k)
+        keep = rng.random(k) < self._prob_arr[columns]
+        return np.where(keep, columns, self._alias_arr[columns])
+
+def swap_prize_pool(campaign: Campaign, prizes: List[dict], exhausted: frozenset = frozenset()) -> PrizePool:
+    campaign.pool = PrizePool(prizes, version=campaign.pool.version + 1, exhausted=exhausted)
+    return campaign.pool
+
+def exhausted_labels(prizes: List[dict], remaining: Dict[str, int]) -> frozenset:
+    return frozenset(p["label"] for p in prizes if p.get("stock") is not None and remaining.get(p["label"], 0) <= 0)
+
+async def load_prize_pool(campaign: Campaign) -> PrizePool:
+    prizes = await storage.list_prizes(campaign.id)
+    pool = swap_prize_pool(campaign, prizes, exhausted_labels(prizes, await storage.stock_remaining(campaign.id)))
+    logger.info(f"Loaded {campaign.id} prize pool v{pool.version} ({len(pool.eligible)} eligible prizes)")
+    return pool
+
+# --- Prize stock ---
+# Capped prizes are reserved from the striped stock counters before a code is
+# claimed. A prize whose counters come back empty is swapped out of the pool
+# at once; units reserved for draws that fail are handed back.
+async def mark_exhausted(campaign: Campaign, label: str, version: int):
+    async with campaign.pool_lock:
+        # A newer pool (e.g. an admin restock) already reflects current stock
+        pool = campaign.pool
+        if pool.version == version and label not in pool.exhausted:
+            swap_prize_pool(campaign, pool.prizes, pool.exhausted | {label})
+            await publish_change(f"prizes:{campaign.id}")
+            logger.info(f"Prize {label!r} is out of stock in {campaign.id}")
+
+async def allocate_prizes(
+    campaign: Campaign, k: int, before_reserve: Optional[Callable[[], Awaitable[None]]] = None
+) -> List[dict]:
+    """Draw k prizes, reserving stock for capped ones; fewer come back once every prize runs out.
+
+    before_reserve is awaited once, ahead of the first stock reservation, and
+    may raise to abort the draw; draws of uncapped prizes never call it.
+    """
+    outcomes = []
+    while len(outcomes) < k:
+        pool = campaign.pool
+        if not pool.eligible:
+            break
+        need = k - len(outcomes)
+        drawn = [pool.draw()] if need == 1 else [pool.eligible[i] for i in pool.draw_indices(need)]
+        wanted = Counter(p["label"] for p in drawn if p.get("stock") is not None)
+        if wanted and before_reserve is not None:
+            await before_reserve()
+            before_reserve = None
+        granted = {}
+        for label, n in wanted.items():
+            granted[label] = await storage.take_stock(campaign.id, label, n)
+            if granted[label] < n:
+                await mark_exhausted(campaign, label, pool.version)
+        for prize in drawn:
+            label = prize["label"]
+            if label in granted:
+                if not granted[label]:
+                    continue  # redrawn from the renormalized pool next round
+                granted[label] -= 1
+            outcomes.append(prize)
+    return outcomes
+
+async def shift_stock(campaign_id: str, label: str, delta: int):
+    """Move a capped prize's live stock by delta.
+
+    Units reserved by in-flight draws are not in the counters, so a cut
+    deeper than what is left leaves a debt that their releases repay.
+    """
+    if delta < 0:
+        delta += await storage.take_stock(campaign_id, label, -delta)
+    if delta:
+        await storage.release_stock(campaign_id, label, delta)
+
+async def release_prizes(campaign: Campaign, prizes: List[dict]):
+    returned = Counter(p["label"] for p in prizes if p.get("stock") is not None)
+    for label, n in returned.items():
+        await storage.release_stock(campaign.id, label, n)
+    back_in_stock = campaign.pool.exhausted & returned.keys()
+    if back_in_stock:
+        async with campaign.pool_lock:
+            swap_prize_pool(campaign, campaign.pool.prizes, campaign.pool.exhausted - back_in_stock)
+            await publish_change(f"prizes:{campaign.id}")
+
+# --- Prize simulation & fairness ---
+# Simulations run PrizePool.draw_indices, the sampler batch draws use and the
+# vectorized twin of the alias draw behind /api/spin, in numpy-sized chunks.
+def simulate_pool(pool: PrizePool, spins: int, seed: Optional[int] = None) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(len(pool.eligible), dtype=np.int64)
+    for start in range(0, spins, SIMULATION_CHUNK_SIZE):
+        drawn = pool.draw_indices(min(SIMULATION_CHUNK_SIZE, spins - start), rng)
+        counts += np.bincount(drawn, minlength=len(pool.eligible))
+    return counts
+
+def chi_square_sf(statistic: float, df: int) -> float:
+    """P(X >= statistic) for a chi-square distribution: the regularized upper incomplete gamma Q(df/2, x/2)."""
+    if statistic <= 0:
+        return 1.0
+    a, x = df / 2.0, statistic / 2.0
+    log_prefix = -x + a * math.log(x) - math.lgamma(a)
+    if x < a + 1:
+        # Series for the lower function converges fast here
+        term = total = 1.0 / a
+        n = a
+        for _ in range(1000):
+            n += 1
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(log_prefix))
+    # Lentz's continued fraction for the upper function
+    tiny = 1e-300
+    b = x + 1.0 - a
+    c, d = 1.0 / tiny, 1.0 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2.0
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1.0 / d
+        h *= d * c
+        if abs(d * c - 1.0) < 1e-15:
+            break
+    return min(1.0, h * math.exp(log_prefix))
+
+def outcome_report(prizes: List[dict], observed: List[int]) -> dict:
+    """Expected counts, confidence intervals and a chi-square goodness-of-fit test for observed outcomes."""
+    n = sum(observed)
+    total_weight = sum(p["probability"] for p in prizes)
+    rows, statistic = [], 0.0
+    for prize, count in zip(prizes, observed):
+        share = prize["probability"] / total_weight
+        expected = n * share
+        margin = FAIRNESS_Z * math.sqrt(n * share * (1 - share))
+        if expected > 0:
+            statistic += (count - expected) ** 2 / expected
+        rows.append({
+            "label": prize["label"],
+            "probability": prize["probability"],
+            "share": round(share, 6),
+            "expected": round(expected, 2),
+            "observed": int(count),
+            "ci_low": round(max(0.0, expected - margin), 2),
+            "ci_high": round(expected + margin, 2),
+            "within_ci": abs(count - expected) <= margin,
+        })
+    df = len(prizes) - 1
+    p_value = chi_square_sf(statistic, df) if df > 0 and n else None
+    return {
+        "total": n,
+        "confidence": 0.95,
+        "prizes": rows,
+        "chi_square": {
+            "statistic": round(statistic, 4),
+            "df": df,
+            "p_value": p_value,
+            "alpha": FAIRNESS_ALPHA,
+            "consistent": p_value is None or p_value >= FAIRNESS_ALPHA,
+        },
+    }
+
+# --- Materialized stats ---
+# Counters are kept current with atomic increments by the storage engine so
+# the dashboard never scans raw collections; reconcile_stats rebuilds them.
+stats_reconcile_task: Optional[asyncio.Task] = None
+
+async def record_codes_stats(campaign_id: str, count: int):
+    if count:
+        await storage.incr_code_stats(campaign_id, count)
+
+async def record_draw_stats(campaign_id: str, counts: Dict[str, int]):
+    await storage.incr_draw_stats(campaign_id, counts)
+
+async def reconcile_stats(campaign_id: str):
+    stats = await storage.reconcile_stats(campaign_id)
+    logger.info(f"Reconciled {campaign_id} stats: {stats['total_codes']} codes, {stats['total_draws']} draws")
+
+async def reconcile_stats_periodically():
+    while True:
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+        for campaign_id in list(campaigns):
+            try:
+                await reconcile_stats(campaign_id)
+            except Exception:
+                logger.exception(f"Stats reconcile of {campaign_id} failed")
+
+async def read_stats(campaign_id: str) -> dict:
+    stats = await storage.read_stats(campaign_id) or {"total_codes": 0, "used_codes": 0, "total_draws": 0, "prize_counts": {}}
+    distribution = sorted(
+        ({"_id": label, "count": count} for label, count in stats["prize_counts"].items()),
+        key=lambda d: d["count"], reverse=True,
+    )
+    return {
+        "total_codes": stats["total_codes"],
+        "used_codes": stats["used_codes"],
+        "unused_codes": stats["total_codes"] - stats["used_codes"],
+        "total_draws": stats["total_draws"],
+        "prize_distribution": distribution,
+    }
+
+# --- Live draw feed ---
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+class DrawBroadcaster:
+    """In-process fan-out of new draws to Server-Sent Events subscribers.
+
+    Each draw is encoded once and pushed onto every subscriber's bounded
+    queue. A subscriber whose queue is full is dropped; its client
+    reconnects and catches up from the replay buffer.
+    """
+
+    def __init__(self, replay_size: int, queue_size: int):
+        self.recent = deque(maxlen=replay_size)
+        self.queue_size = queue_size
+        self.subscribers: Set[asyncio.Queue] = set()
+
+    def prime(self, history: List[dict]):
+        self.recent.clear()
+        self.recent.extend(history)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def replay_event(self) -> bytes:
+        return sse_event("replay", list(self.recent))
+
+    def publish(self, record: dict):
+        self.recent.appendleft(record)
+        self._send(sse_event("draw", record))
+
+    def publish_many(self, records: List[dict]):
+        """Batch draws refresh the replay buffer and go out as one replay event."""
+        self.recent.extendleft(records[-self.recent.maxlen:])
+        self.send_replay()
+
+    def send_replay(self):
+        self._send(self.replay_event())
+
+    def _send(self, event: bytes):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.subscribers.discard(queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)  # tells the stream to close
+
+async def load_draw_replay(campaign: Campaign):
+    history = await storage.page_history(campaign.id, DRAW_REPLAY_SIZE)
+    campaign.broadcaster.prime([{k: v for k, v in d.items() if k != "_id"} for d in history])
+
+# --- Response cache ---
+class ResponseCache:
+    """Pre-encoded JSON bodies for public read endpoints, valid for one data version."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key, version: int):
+        entry = self.entries.get(key)
+        return entry if entry and entry[0] == version else None
+
+    def put(self, key, version: int, payload: dict):
+        body = orjson.dumps(payload)
+        etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        entry = (version, body, etag)
+        self.entries[key] = entry
+        return entry
+
+response_cache = ResponseCache()
+
+def bump_history_version(campaign: Campaign):
+    campaign.history_version += 1
+
+def prizes_entry(campaign: Campaign):
+    pool = campaign.pool
+    key = ("prizes", campaign.id)
+    return response_cache.get(key, pool.version) or response_cache.put(key, pool.version, {"prizes": pool.prizes})
+
+async def history_entry(campaign: Campaign, limit: int):
+    version = campaign.history_version
+    key = ("history", campaign.id, limit)
+    entry = response_cache.get(key, version)
+    if not entry:
+        async def fetch(page_limit, after):
+            return await storage.page_history(campaign.id, page_limit, after)
+
+        history, next_cursor = await keyset_page(fetch, "drawn_at", limit)
+        entry = response_cache.put(key, version, {"history": history, "next_cursor": next_cursor})
+    return entry
+
+def cached_json(request: Request, entry, cache_control: str) -> Response:
+    _, body, etag = entry
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match == "*" or etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+# --- Draw history write-behind ---
+class HistoryWriter:
+    """Coalesces spin records into draw_history batches.
+
+    A spin's claim is durable (and flagged history_pending) before its record
+    is queued, so the row can be written a moment later. Batches flush when
+    they reach batch_size or flush_interval after their first record. Each
+    campaign may have max_pending records waiting; past that its spins wait
+    instead of buffering without limit while the database is slow, and a hot
+    campaign never holds up the others' spins. A failed flush is retried
+    until it lands, which is safe because flush_draws skips rows an earlier
+    attempt already wrote.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.slots: Dict[str, asyncio.Semaphore] = {}
+        self.task: Optional[asyncio.Task] = None
 
-async def verify_master(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def submit(self, record: dict):
+        slots = self.slots.get(record["campaign"])
+        if slots is None:
+            slots = self.slots[record["campaign"]] = asyncio.Semaphore(self.max_pending)
+        await slots.acquire()
+        self.queue.put_nowait(record)
+
+    async def close(self, timeout: float):
+        """Flush everything queued so far and stop, giving up after timeout seconds.
+
+        Records still queued then are not lost: their claims stay
+        history_pending and recovery writes them later.
+        """
+        if self.task and not self.task.done():
+            self.queue.put_nowait(None)
+            try:
+                await asyncio.wait_for(self.task, timeout)
+            except asyncio.TimeoutError:
+                self.task.cancel()
+                logger.warning(f"History drain timed out; {self.queue.qsize()} records left to recovery")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            first = await self.queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        record = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if record is None:
+                    closing = True
+                    break
+                batch.append(record)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[dict]):
+        delay = 0.1
+        while True:
+            try:
+                await storage.flush_draws(batch)
+                break
+            except Exception:
+                logger.exception(f"History flush of {len(batch)} records failed; retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 5.0)
+        for record in batch:
+            self.slots[record["campaign"]].release()
+        # Cached history pages are only invalidated once the rows are readable
+        for campaign_id in {r["campaign"] for r in batch}:
+            if campaign_id in campaigns:
+                bump_history_version(campaigns[campaign_id])
+            await publish_change(f"history:{campaign_id}")
+        HISTORY_FLUSH_SIZE.observe(len(batch))
+        HISTORY_QUEUE_DEPTH.set(self.queue.qsize())
+
+history_writer = HistoryWriter(HISTORY_BATCH_SIZE, HISTORY_FLUSH_INTERVAL, HISTORY_QUEUE_SIZE)
+
+# Claims younger than HISTORY_RECOVERY_GRACE are left alone: their record may
+# still be buffered in a live worker. Racing it is harmless anyway, since
+# flush_draws writes each claim's row once.
+recover_task: Optional[asyncio.Task] = None
+
+async def recover_pending_draws():
+    """Write history rows for claims whose buffered record was lost (e.g. in a crash)."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=HISTORY_RECOVERY_GRACE)).isoformat()
+    pending = await storage.pending_draws(cutoff)
+    if not pending:
+        return
+    prizes = {}
+    for campaign_id in {claim["campaign"] for claim in pending}:
+        prizes[campaign_id] = {p["label"]: p for p in await storage.list_prizes(campaign_id)}
+    records = []
+    for claim in pending:
+        prize = prizes[claim["campaign"]].get(claim["prize_label"], {})
+        records.append({
+            "campaign": claim["campaign"],
+            "username": claim["username"],
+            "prize_label": claim["prize_label"],
+            "prize_image_url": prize.get("image_url", ""),
+            "prize_color": prize.get("color", ""),
+            "drawn_at": claim["used_at"],
+        })
+    for i in range(0, len(records), HISTORY_BATCH_SIZE):
+        await storage.flush_draws(records[i:i + HISTORY_BATCH_SIZE])
+    for campaign_id in prizes:
+        if campaign_id in campaigns:
+            bump_history_version(campaigns[campaign_id])
+        await publish_change(f"history:{campaign_id}")
+    logger.warning(f"Recovered {len(records)} draw history records from pending claims")
+
+async def recover_pending_draws_periodically():
+    while True:
+        await asyncio.sleep(HISTORY_RECOVERY_INTERVAL)
+        try:
+            await recover_pending_draws()
+        except Exception:
+            logger.exception("Draw history recovery failed")
+
+# --- History archival ---
+# draw_history only keeps HISTORY_RETENTION_DAYS of raw rows; older ones move
+# to the archive in small batches. Stats come from the rollups, which keep
+# every draw (hourly buckets are pruned after HOURLY_ROLLUP_RETENTION_DAYS).
+archive_task: Optional[asyncio.Task] = None
+
+async def archive_history(campaign: Campaign) -> int:
+    now = datetime.now(timezone.utc)
+    cutoff = (now - timedelta(days=HISTORY_RETENTION_DAYS)).isoformat()
+    moved = 0
+    while True:
+        batch = await storage.archive_draws(campaign.id, cutoff, ARCHIVE_BATCH_SIZE)
+        moved += batch
+        if batch < ARCHIVE_BATCH_SIZE:
+            break
+    await storage.prune_rollups(campaign.id, "hour", (now - timedelta(days=HOURLY_ROLLUP_RETENTION_DAYS)).isoformat())
+    if moved:
+        bump_history_version(campaign)
+        await publish_change(f"history:{campaign.id}")
+        logger.info(f"Archived {moved} {campaign.id} draw history records older than {cutoff}")
+    return moved
+
+async def archive_history_periodically():
+    while True:
+        for campaign in list(campaigns.values()):
+            try:
+                await archive_history(campaign)
+            except Exception:
+                logger.exception(f"History archival of {campaign.id} failed")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+# --- Cross-worker sync ---
+# Every worker keeps its own prize pool, response cache and SSE replay. When
+# one of them changes shared data it bumps a named counter in the storage
+# engine's version document; the others follow it through a change stream
+# (Mongo replica sets) or by polling it every VERSION_POLL_INTERVAL. Names
+# are "admins", "campaigns", and "prizes:<campaign>" / "history:<campaign>".
+known_versions: Dict[str, int] = {}
+version_watch_task: Optional[asyncio.Task] = None
+
+async def publish_change(name: str):
+    if not MULTI_WORKER:
+        return
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=["HS256"])
-        if payload.get("role") != "master":
-            raise HTTPException(status_code=403, detail="Only master admin can perform this action")
-        return payload
-    except jwt.ExpiredSignatureError:
-        raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.InvalidTokenError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        known_versions[name] = await storage.bump_version(name)
+    except Exception:
+        # Peers still converge on the next change or reconcile; never fail the write itself
+        logger.exception(f"Could not publish {name} change")
+
+async def refresh_replay_later(campaign: Campaign):
+    await asyncio.sleep(REPLAY_REFRESH_DELAY)
+    campaign.replay_refresh_task = None
+    await load_draw_replay(campaign)
+    campaign.broadcaster.send_replay()
+
+async def apply_versions(versions: Dict[str, int]):
+    changed = {name for name, v in versions.items() if known_versions.get(name) != v}
+    known_versions.update(versions)
+    if "campaigns" in changed:
+        await load_campaigns()
+    if "admins" in changed:
+        await load_admin_token_versions()
+    for name in changed:
+        kind, _, campaign_id = name.partition(":")
+        campaign = campaigns.get(campaign_id)
+        if campaign is None:
+            continue
+        if kind == "prizes":
+            async with campaign.pool_lock:
+                await load_prize_pool(campaign)
+        elif kind == "history":
+            bump_history_version(campaign)
+            # Draws from other workers reach local SSE clients as a (debounced) replay
+            if campaign.broadcaster.subscribers and campaign.replay_refresh_task is None:
+                campaign.replay_refresh_task = asyncio.create_task(refresh_replay_later(campaign))
+
+async def follow_change_stream() -> bool:
+    """Apply versions as the change stream delivers them; False if the engine cannot stream."""
+    if not storage.supports_watch:
+        return False
+    received = False
+    try:
+        # Catch up on anything that changed before the stream opened
+        await apply_versions(await storage.read_versions())
+        async for versions in storage.watch_versions():
+            received = True
+            await apply_versions(versions)
+    except Exception as e:
+        if not received:
+            logger.info(f"Change streams unavailable ({type(e).__name__})")
+            return False
+        logger.warning(f"Version change stream failed ({e}); reopening")
+    return True
+
+async def watch_versions():
+    while await follow_change_stream():
+        await asyncio.sleep(VERSION_POLL_INTERVAL)
+    logger.info(f"Polling shared versions every {VERSION_POLL_INTERVAL}s")
+    while True:
+        try:
+            await apply_versions(await storage.read_versions())
+        except Exception:
+            logger.exception("Version poll failed")
+        await asyncio.sleep(VERSION_POLL_INTERVAL)
+
+# --- Code generation ---
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+CODE_CHUNK_SIZE = 1000
+CODE_MAX_RETRIES = 5
+UPLOAD_ERROR_SAMPLE = 20  # rejected upload lines echoed back in the summary
+
+def new_redeem_code() -> str:
+    return ''.join(random.choices(CODE_ALPHABET, k=8))
+
+async def insert_code_chunk(campaign_id: str, usernames: List[str]) -> List[dict]:
+    """Create codes for one chunk of names: one bulk lookup plus one bulk insert.
+
+    Names that already have a code are skipped; redeem-code collisions are
+    retried with fresh codes.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    taken = await storage.existing_usernames(campaign_id, usernames)
+    pending = [u for u in usernames if u not in taken]
+    created = []
+    for _ in range(CODE_MAX_RETRIES):
+        if not pending:
+            break
+        now = datetime.now(timezone.utc).isoformat()
+        docs = [
+            {"username": u, "redeem_code": new_redeem_code(), "is_used": False, "created_at": now}
+            for u in pending
+        ]
+        inserted, pending = await storage.insert_codes(campaign_id, docs)
+        created.extend({"username": d["username"], "redeem_code": d["redeem_code"]} for d in inserted)
+    if pending:
+        logger.warning(f"Gave up generating codes for {len(pending)} username(s) after repeated collisions")
+    await record_codes_stats(campaign_id, len(created))
+    return created
+
+async def generate_code_chunks(campaign_id: str, usernames: AsyncIterator[str]) -> AsyncIterator[List[dict]]:
+    chunk = []
+    async for uname in usernames:
+        uname = uname.strip()
+        if not uname:
+            continue
+        chunk.append(uname)
+        if len(chunk) >= CODE_CHUNK_SIZE:
+            yield await insert_code_chunk(campaign_id, chunk)
+            chunk = []
+    if chunk:
+        yield await insert_code_chunk(campaign_id, chunk)
+
+async def iter_list(items: List[str]) -> AsyncIterator[str]:
+    for item in items:
+        yield item
+
+async def iter_upload_usernames(stream: BinaryIO, ndjson: bool, rejected: List[dict]) -> AsyncIterator[str]:
+    """Yield usernames from a spooled CSV (first column) or NDJSON upload.
+
+    The file is read back in blocks, so large lists never sit in memory as a
+    whole. Lines that cannot be parsed are skipped and appended to rejected
+    as {"line", "error"}: the response has already started streaming, so
+    raising would abort it and lose the codes generated so far.
+    """
+    buffer = b""
+    first = True
+    line_no = 0
+
+    def parse(line: bytes) -> str:
+        nonlocal first
+        text = line.decode("utf-8").strip()
+        if not text:
+            return ""
+        if ndjson:
+            item = json.loads(text)
+            uname = item.get("username", "") if isinstance(item, dict) else item
+            if not isinstance(uname, str):
+                raise ValueError("username must be a string")
+            return uname
+        uname = text.split(",", 1)[0].strip().strip('"')
+        # Skip a CSV header row
+        if first:
+            first = False
+            if uname.lower() == "username":
+                return ""
+        return uname
+
+    def parse_line(line: bytes) -> str:
+        nonlocal line_no
+        line_no += 1
+        try:
+            return parse(line)
+        except ValueError as e:  # includes JSONDecodeError and UnicodeDecodeError
+            rejected.append({"line": line_no, "error": str(e)})
+            return ""
+
+    try:
+        while data := await asyncio.to_thread(stream.read, 64 * 1024):
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if uname := parse_line(line):
+                    yield uname
+        if uname := parse_line(buffer):
+            yield uname
+    finally:
+        stream.close()
+
+# --- Pagination & export ---
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FIELDS = {
+    "codes": ["username", "redeem_code", "is_used", "created_at", "used_at", "prize_label"],
+    "history": ["username", "prize_label", "prize_image_url", "prize_color", "drawn_at"],
+    "archive": ["username", "prize_label", "prize_image_url", "prize_color", "drawn_at"],
+}
+
+def encode_cursor(doc: dict, field: str) -> str:
+    raw = json.dumps([doc[field], str(doc["_id"])]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token: str):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key, row_id = json.loads(raw)
+        return str(key), str(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def keyset_page(fetch, field: str, limit: int, cursor: Optional[str] = None):
+    """Return one page sorted newest first on (field, id) plus the token for the next page.
+
+    fetch(limit, after) is one of the storage page_* methods.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    try:
+        docs = await fetch(limit + 1, after)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    next_cursor = encode_cursor(docs[limit - 1], field) if len(docs) > limit else None
+    return [{k: v for k, v in d.items() if k != "_id"} for d in docs[:limit]], next_cursor
+
+async def iter_export(batches: AsyncIterator[List[dict]], fields: List[str], fmt: str, compress: bool):
+    """Stream storage batches as CSV or NDJSON, gzipped on the fly."""
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def encode(rows: List[dict], header: bool = False) -> bytes:
+        buf = io.StringIO()
+        if fmt == "csv":
+            writer = csv.DictWriter(buf, fieldnames=fields, extrasaction="ignore")
+            if header:
+                writer.writeheader()
+            writer.writerows(rows)
+        else:
+            for row in rows:
+                buf.write(json.dumps(row) + "\n")
+        data = buf.getvalue().encode()
+        return gzip.compress(data) if gzip else data
+
+    yield encode([], header=True)
+    async for batch in batches:
+        yield encode(batch)
+    if gzip:
+        yield gzip.flush()
 
 # --- Seed defaults ---
 DEFAULT_PRIZES = [
@@ -109,173 +1241,445 @@ DEFAULT_PRIZES = [
     {"label": "Dragon Scale", "image_url": "", "color": "#C5943A", "probability": 10},
 ]
 
-@app.on_event("startup")
-async def seed_data():
-    # Seed prizes
-    prize_count = await db.prizes.count_documents({})
-    if prize_count == 0:
-        for i, prize in enumerate(DEFAULT_PRIZES):
-            prize["id"] = f"prize_{i}"
-            prize["created_at"] = datetime.now(timezone.utc).isoformat()
-        await db.prizes.insert_many(DEFAULT_PRIZES)
-        logger.info("Seeded default prizes")
-
-    # Seed master admin
-    master = await db.admins.find_one({"username": MASTER_ADMIN_USER})
-    if not master:
-        await db.admins.insert_one({
-            "username": MASTER_ADMIN_USER,
-            "password_hash": hash_password(MASTER_ADMIN_PASS),
-            "role": "master",
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        })
+async def seed_campaigns(campaign_ids: List[str]) -> List[str]:
+    """Register campaigns, giving new ones the default prize pool; returns those newly registered."""
+    for campaign_id in campaign_ids:
+        if not CAMPAIGN_ID_PATTERN.match(campaign_id):
+            raise ValueError(f"Invalid campaign id: {campaign_id!r}")
+    now = datetime.now(timezone.utc).isoformat()
+    seeded = [{**prize, "id": f"prize_{i}", "created_at": now} for i, prize in enumerate(DEFAULT_PRIZES)]
+    return await storage.seed_campaigns({campaign_id: seeded for campaign_id in campaign_ids})
+
+async def seed_master_admin():
+    if await storage.get_admin(MASTER_ADMIN_USER):
+        return
+    # Concurrently starting workers race here; only one insert wins
+    if await storage.insert_admin({
+        "username": MASTER_ADMIN_USER,
+        "password_hash": await hash_password(MASTER_ADMIN_PASS),
+        "role": "master",
+        "created_at": datetime.now(timezone.utc).isoformat(),
+    }):
         logger.info(f"Seeded master admin: {MASTER_ADMIN_USER}")
 
+# --- Startup & readiness ---
+# The app lifespan runs seed_data before uvicorn accepts connections, so
+# every route finds its campaigns loaded. warm_up then opens the Mongo pool
+# and primes the public response caches in the background. /healthz passes
+# as soon as the process serves HTTP, /readyz only once warm_up is done, so
+# the load balancer only routes to warm workers; shutdown fails /readyz
+# again before draining. If startup fails (bad config, unreachable
+# database) the worker stays up and both probes fail with the error.
+ready = False
+startup_error: Optional[str] = None
+warm_up_task: Optional[asyncio.Task] = None
+
+def startup_phase(phase: str) -> float:
+    elapsed = time.monotonic() - BOOT_STARTED
+    STARTUP_SECONDS.labels(phase).set(elapsed)
+    return elapsed
+
+async def seed_data():
+    await storage.init()
+    if INDEX_PLAN_CHECK:
+        await storage.verify_query_plans()
+    startup_phase("storage")
+
+    seeded, _ = await asyncio.gather(seed_campaigns(CAMPAIGNS), seed_master_admin())
+    if seeded:
+        logger.info(f"Registered campaigns: {', '.join(seeded)}")
+    await asyncio.gather(load_admin_token_versions(), recover_pending_draws())
+    startup_phase("seed")
+
+    history_writer.start()
+    await load_campaigns()
+    startup_phase("campaigns")
+
+    global stats_reconcile_task, archive_task, version_watch_task, recover_task
+    if MULTI_WORKER:
+        if getattr(storage, "path", None) == ":memory:":
+            logger.warning("MULTI_WORKER is on but the in-memory engine is not shared between workers")
+        known_versions.update(await storage.read_versions())
+        version_watch_task = asyncio.create_task(watch_versions())
+    if STATS_RECONCILE_INTERVAL > 0:
+        stats_reconcile_task = asyncio.create_task(reconcile_stats_periodically())
+    if HISTORY_RETENTION_DAYS > 0 and ARCHIVE_INTERVAL > 0:
+        archive_task = asyncio.create_task(archive_history_periodically())
+    if HISTORY_RECOVERY_INTERVAL > 0:
+        recover_task = asyncio.create_task(recover_pending_draws_periodically())
+
+async def warm_up():
+    global ready
+    try:
+        await storage.warm_up(MONGO_MIN_POOL_SIZE)
+        for campaign in list(campaigns.values()):
+            prizes_entry(campaign)
+        await asyncio.gather(*(history_entry(campaign, HISTORY_PAGE_SIZE) for campaign in list(campaigns.values())))
+    except Exception:
+        # Cold caches are slower, not wrong; don't hold the worker out of rotation for them
+        logger.exception("Warm-up failed")
+    ready = True
+    READY.set(1)
+    logger.info(f"Ready {startup_phase('ready'):.2f}s after start")
+
+async def shutdown():
+    global ready
+    ready = False
+    READY.set(0)
+    for task in (warm_up_task, stats_reconcile_task, archive_task, version_watch_task, recover_task):
+        if task:
+            task.cancel()
+    password_executor.shutdown(wait=False)
+    await history_writer.close(HISTORY_DRAIN_TIMEOUT)
+    if storage is not None:
+        await storage.close()
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    if startup_error:
+        raise HTTPException(status_code=503, detail=f"Startup failed: {startup_error}")
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    if startup_error:
+        raise HTTPException(status_code=503, detail=f"Startup failed: {startup_error}")
+    if not ready:
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"status": "ready"}
+
 # --- Public Routes ---
 @api_router.get("/")
 async def root():
     return {"message": "Lucky Wheel API"}
 
 @api_router.get("/prizes")
-async def get_prizes():
-    prizes = await db.prizes.find({}, {"_id": 0}).to_list(100)
-    return {"prizes": prizes}
+async def get_prizes(request: Request, campaign: Campaign = Depends(campaign_param)):
+    return cached_json(request, prizes_entry(campaign), PRIZES_CACHE_CONTROL)
 
 @api_router.get("/history")
-async def get_history():
-    history = await db.draw_history.find({}, {"_id": 0}).sort("drawn_at", -1).to_list(50)
-    return {"history": history}
+async def get_history(
+    request: Request,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=200),
+    cursor: Optional[str] = Query(None),
+    campaign: Campaign = Depends(campaign_param),
+):
+    if cursor:
+        async def fetch(page_limit, after):
+            return await storage.page_history(campaign.id, page_limit, after)
 
-@api_router.post("/spin")
-async def spin_wheel(req: SpinRequest):
-    user = await db.users.find_one(
-        {"username": req.username, "redeem_code": req.redeem_code},
-        {"_id": 0}
+        history, next_cursor = await keyset_page(fetch, "drawn_at", limit, cursor)
+        return {"history": history, "next_cursor": next_cursor}
+    # First pages are cached per campaign and limit, and invalidated by every new draw
+    return cached_json(request, await history_entry(campaign, limit), HISTORY_CACHE_CONTROL)
+
+@api_router.get("/history/stream")
+async def stream_history(campaign: Campaign = Depends(campaign_param)):
+    """Server-Sent Events: a replay of recent draws, then each new draw as it lands."""
+    broadcaster = campaign.broadcaster
+
+    async def events():
+        queue = broadcaster.subscribe()
+        try:
+            yield broadcaster.replay_event()
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if event is None:
+                    break
+                yield event
+        finally:
+            broadcaster.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    if not user:
-        raise HTTPException(status_code=400, detail="Invalid username or redeem code")
-    if user.get("is_used"):
-        raise HTTPException(status_code=400, detail="This redeem code has already been used")
 
-    prizes = await db.prizes.find({}, {"_id": 0}).to_list(100)
-    if not prizes:
-        raise HTTPException(status_code=500, detail="No prizes configured")
+CODE_USED = "This redeem code has already been used"
+
+def spin_response(prize: dict) -> dict:
+    return {"prize": prize, "message": f"Congratulations! You won {prize['label']}!"}
 
-    # Filter out prizes with 0 probability
-    eligible = [p for p in prizes if p.get("probability", 0) > 0]
-    if not eligible:
+def replay_spin(entry: tuple, req: SpinRequest, response: Response, source: str) -> dict:
+    username, redeem_code, result = entry
+    if (username, redeem_code) != (req.username, req.redeem_code):
+        raise HTTPException(status_code=422, detail="Idempotency key was already used for a different spin")
+    SPIN_REPLAYS.labels(source).inc()
+    response.headers["Idempotent-Replayed"] = "true"
+    return result
+
+async def stored_spin(campaign: Campaign, idempotency_key: str) -> Optional[tuple]:
+    claim = await storage.find_claim(campaign.id, idempotency_key)
+    if claim is None:
+        return None
+    label = claim["prize_label"]
+    # The claim keeps the label; the rest of the prize comes from the current pool
+    prize = next((p for p in campaign.pool.prizes if p["label"] == label), {"label": label, "image_url": "", "color": ""})
+    return claim["username"], claim["redeem_code"], spin_response(prize)
+
+@api_router.post("/spin")
+async def spin_wheel(
+    req: SpinRequest, request: Request, response: Response,
+    idempotency_key: Optional[str] = Header(None, min_length=1, max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
+):
+    campaign = get_campaign(req.campaign)
+    replay_key = (campaign.id, idempotency_key)
+    if idempotency_key:
+        # Retries answered from memory don't spend rate-limit tokens either
+        entry = spin_replays.get(replay_key)
+        if entry:
+            return replay_spin(entry, req, response, "cache")
+    enforce_limits((spin_ip_limiter, client_ip(request)), (spin_user_limiter, (campaign.id, req.username)))
+    try:
+        # Double submits of the same code ride along with the first one
+        return await spin_flights.do(
+            (campaign.id, req.username, req.redeem_code), lambda: spin(campaign, req, idempotency_key)
+        )
+    except HTTPException as e:
+        # Only a spin that could not claim its code may be a retry of one that
+        # did (answered by another worker, or before a restart); first
+        # attempts never pay for the key lookup
+        if not idempotency_key or not (e.status_code in (409, 422) or e.detail == CODE_USED):
+            raise
+        entry = await stored_spin(campaign, idempotency_key)
+        if entry is None:
+            raise
+        spin_replays.put(replay_key, entry)
+        return replay_spin(entry, req, response, "storage")
+
+async def spin(campaign: Campaign, req: SpinRequest, idempotency_key: Optional[str] = None) -> dict:
+    pool = campaign.pool
+    if not pool.prizes:
+        raise HTTPException(status_code=500, detail="No prizes configured")
+    if not pool.eligible and not pool.exhausted:
         raise HTTPException(status_code=500, detail="No eligible prizes")
 
-    weights = [p.get("probability", 0) for p in eligible]
-    chosen = random.choices(eligible, weights=weights, k=1)[0]
+    async def check_code():
+        # Unknown and used codes (guessing traffic, mostly) must not reserve
+        # stock or flip the pool's exhaustion; uncapped draws skip this read
+        code = await storage.find_code(campaign.id, req.username, req.redeem_code)
+        if not code:
+            raise HTTPException(status_code=400, detail="Invalid username or redeem code")
+        if code.get("is_used"):
+            raise HTTPException(status_code=400, detail=CODE_USED)
 
+    outcomes = await allocate_prizes(campaign, 1, check_code)
+    if not outcomes:
+        raise HTTPException(status_code=409, detail="All prizes are out of stock")
+    chosen = outcomes[0]
     now = datetime.now(timezone.utc).isoformat()
+
+    if not await storage.claim_code(
+        campaign.id, req.username, req.redeem_code, now, chosen["label"], idempotency_key
+    ):
+        await release_prizes(campaign, outcomes)
+        # Bad or used code (or a race lost since check_code); re-read to pick the right error message
+        code = await storage.find_code(campaign.id, req.username, req.redeem_code)
+        if not code:
+            raise HTTPException(status_code=400, detail="Invalid username or redeem code")
+        if not code.get("is_used"):
+            # Unused code, so the idempotency key was taken by a concurrent spin of another code
+            raise HTTPException(status_code=422, detail="Idempotency key was already used for a different spin")
+        raise HTTPException(status_code=400, detail=CODE_USED)
+
     record = {
+        "campaign": campaign.id,
         "username": req.username,
         "prize_label": chosen["label"],
         "prize_image_url": chosen.get("image_url", ""),
         "prize_color": chosen["color"],
         "drawn_at": now,
     }
-    await db.draw_history.insert_one({**record})
-
-    await db.users.update_one(
-        {"username": req.username, "redeem_code": req.redeem_code},
-        {"$set": {"is_used": True, "used_at": now}}
+    await asyncio.gather(
+        history_writer.submit(record),
+        record_draw_stats(campaign.id, {chosen["label"]: 1}),
     )
+    campaign.broadcaster.publish(record)
+    SPIN_OUTCOMES.labels(campaign.id, chosen["label"]).inc()
 
-    return {"prize": chosen, "message": f"Congratulations! You won {chosen['label']}!"}
+    result = spin_response(chosen)
+    if idempotency_key:
+        spin_replays.put((campaign.id, idempotency_key), (req.username, req.redeem_code, result))
+    return result
 
 # --- Admin Routes ---
 @api_router.post("/admin/login")
-async def admin_login(req: AdminLoginRequest):
-    admin = await db.admins.find_one({"username": req.username}, {"_id": 0})
-    if not admin or not verify_password(req.password, admin["password_hash"]):
+async def admin_login(req: AdminLoginRequest, request: Request):
+    enforce_limits((login_ip_limiter, client_ip(request)), (login_user_limiter, req.username))
+    admin = await storage.get_admin(req.username)
+    if not admin or not await verify_password(req.password, admin["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid username or password")
-    token = create_token({"role": admin["role"], "username": req.username})
+    if password_needs_rehash(admin["password_hash"]):
+        # Transparently upgrade legacy SHA-256 or outdated-cost hashes
+        await storage.set_admin_password(
+            req.username, await hash_password(req.password), expected_hash=admin["password_hash"]
+        )
+    admin_token_versions[req.username] = admin.get("token_version", 0)
+    token = create_token({"role": admin["role"], "username": req.username, "tv": admin.get("token_version", 0)})
     return {"token": token, "role": admin["role"], "message": "Login successful"}
 
 @api_router.post("/admin/change-password")
 async def change_password(req: ChangePasswordRequest, admin=Depends(verify_admin)):
     username = admin.get("username")
-    account = await db.admins.find_one({"username": username})
-    if not account or not verify_password(req.current_password, account["password_hash"]):
+    account = await storage.get_admin(username)
+    if not account or not await verify_password(req.current_password, account["password_hash"]):
         raise HTTPException(status_code=400, detail="Current password is incorrect")
     if len(req.new_password) < 6:
         raise HTTPException(status_code=400, detail="New password must be at least 6 characters")
-    await db.admins.update_one(
-        {"username": username},
-        {"$set": {"password_hash": hash_password(req.new_password)}}
-    )
-    return {"message": "Password changed successfully"}
+    await storage.set_admin_password(username, await hash_password(req.new_password), revoke_tokens=True)
+    await admins_changed()
+    # Every earlier token, this request's included, is now revoked; hand back a fresh one
+    token = create_token({"role": admin["role"], "username": username, "tv": admin_token_versions[username]})
+    return {"message": "Password changed successfully", "token": token}
 
 
 @api_router.post("/admin/create-admin")
 async def create_admin(req: CreateAdminRequest, master=Depends(verify_master)):
-    existing = await db.admins.find_one({"username": req.username})
+    existing = await storage.get_admin(req.username)
     if existing:
         raise HTTPException(status_code=400, detail="Username already exists")
-    await db.admins.insert_one({
+    created = await storage.insert_admin({
         "username": req.username,
-        "password_hash": hash_password(req.password),
+        "password_hash": await hash_password(req.password),
         "role": "admin",
         "created_at": datetime.now(timezone.utc).isoformat(),
     })
+    if not created:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    await admins_changed()
     return {"message": f"Admin '{req.username}' created successfully"}
 
 @api_router.get("/admin/admins")
 async def list_admins(master=Depends(verify_master)):
-    admins = await db.admins.find({}, {"_id": 0, "password_hash": 0}).to_list(100)
+    admins = await storage.list_admins()
     return {"admins": admins}
 
 @api_router.delete("/admin/admins/{username}")
 async def delete_admin(username: str, master=Depends(verify_master)):
     if username == MASTER_ADMIN_USER:
         raise HTTPException(status_code=400, detail="Cannot delete master admin")
-    result = await db.admins.delete_one({"username": username, "role": "admin"})
-    if result.deleted_count == 0:
+    if not await storage.delete_admin(username):
         raise HTTPException(status_code=404, detail="Admin not found")
+    await admins_changed()
     return {"message": f"Admin '{username}' deleted"}
 
+@api_router.get("/admin/campaigns")
+async def list_campaigns(admin=Depends(verify_admin)):
+    return {"campaigns": sorted(campaigns)}
+
+@api_router.post("/admin/campaigns")
+async def create_campaign(req: CreateCampaignRequest, admin=Depends(verify_admin)):
+    if not CAMPAIGN_ID_PATTERN.match(req.campaign):
+        raise HTTPException(
+            status_code=400, detail="Campaign id must be 1-40 lowercase letters, digits, '-' or '_'"
+        )
+    if not await seed_campaigns([req.campaign]):
+        raise HTTPException(status_code=400, detail="Campaign already exists")
+    await open_campaign(req.campaign)
+    await publish_change("campaigns")
+    return {"message": f"Campaign '{req.campaign}' created", "prizes": campaigns[req.campaign].pool.prizes}
+
 @api_router.post("/admin/generate-codes")
-async def generate_codes(req: GenerateCodesRequest, admin=Depends(verify_admin)):
+async def generate_codes(
+    req: GenerateCodesRequest, campaign: Campaign = Depends(campaign_param), admin=Depends(verify_admin)
+):
+    started = time.perf_counter()
     codes = []
-    for uname in req.usernames:
-        uname = uname.strip()
-        if not uname:
-            continue
-        existing = await db.users.find_one({"username": uname})
-        if existing:
-            continue  # skip duplicates
-        redeem_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
-        doc = {
-            "username": uname,
-            "redeem_code": redeem_code,
-            "is_used": False,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-        }
-        await db.users.insert_one(doc)
-        codes.append({"username": uname, "redeem_code": redeem_code})
-    return {"codes": codes, "message": f"Generated {len(codes)} code(s)"}
+    async for chunk in generate_code_chunks(campaign.id, iter_list(req.usernames)):
+        codes.extend(chunk)
+    rate = len(codes) / max(time.perf_counter() - started, 1e-9)
+    logger.info(f"Generated {len(codes)} code(s) at {rate:.0f} codes/s")
+    return {"codes": codes, "message": f"Generated {len(codes)} code(s)", "codes_per_second": round(rate, 1)}
+
+@api_router.post("/admin/generate-codes/stream")
+async def generate_codes_stream(
+    file: UploadFile = File(...), campaign: Campaign = Depends(campaign_param), admin=Depends(verify_admin)
+):
+    """Bulk variant: upload a CSV or NDJSON username list, codes stream back as NDJSON."""
+    ndjson = (file.filename or "").endswith((".ndjson", ".jsonl")) or "json" in (file.content_type or "")
+    # FastAPI closes the upload when the handler returns, before the response streams
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    await asyncio.to_thread(shutil.copyfileobj, file.file, spool)
+    spool.seek(0)
+
+    async def body():
+        started = time.perf_counter()
+        total = 0
+        rejected: List[dict] = []
+        async for chunk in generate_code_chunks(campaign.id, iter_upload_usernames(spool, ndjson, rejected)):
+            total += len(chunk)
+            yield "".join(json.dumps(c) + "\n" for c in chunk)
+        rate = total / max(time.perf_counter() - started, 1e-9)
+        logger.info(f"Streamed {total} code(s) at {rate:.0f} codes/s, skipped {len(rejected)} bad line(s)")
+        yield json.dumps({
+            "generated": total,
+            "skipped": len(rejected),
+            "errors": rejected[:UPLOAD_ERROR_SAMPLE],
+            "codes_per_second": round(rate, 1),
+        }) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
 
 @api_router.get("/admin/codes")
-async def get_codes(status: Optional[str] = Query(None), admin=Depends(verify_admin)):
-    query = {}
-    if status == "used":
-        query["is_used"] = True
-    elif status == "unused":
-        query["is_used"] = False
-    codes = await db.users.find(query, {"_id": 0}).sort("created_at", -1).to_list(500)
-    return {"codes": codes}
+async def get_codes(
+    status: Optional[str] = Query(None),
+    limit: int = Query(500, ge=1, le=1000),
+    cursor: Optional[str] = Query(None),
+    campaign: Campaign = Depends(campaign_param),
+    admin=Depends(verify_admin),
+):
+    is_used = {"used": True, "unused": False}.get(status)
+
+    async def fetch(page_limit, after):
+        return await storage.page_codes(campaign.id, is_used, page_limit, after)
+
+    codes, next_cursor = await keyset_page(fetch, "created_at", limit, cursor)
+    return {"codes": codes, "next_cursor": next_cursor}
+
+@api_router.get("/admin/export/{dataset}")
+async def export_data(
+    dataset: str,
+    format: str = Query("csv"),
+    compress: bool = Query(True),
+    status: Optional[str] = Query(None),
+    campaign: Campaign = Depends(campaign_param),
+    admin=Depends(verify_admin),
+):
+    if dataset not in EXPORT_FIELDS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format must be csv or ndjson")
+    if dataset == "codes":
+        batches = storage.iter_codes(campaign.id, {"used": True, "unused": False}.get(status), EXPORT_BATCH_SIZE)
+    else:
+        batches = storage.iter_history(campaign.id, EXPORT_BATCH_SIZE, archived=dataset == "archive")
+
+    filename = f"{campaign.id}-{dataset}.{format}" + (".gz" if compress else "")
+    media_type = "application/gzip" if compress else ("text/csv" if format == "csv" else "application/x-ndjson")
+    return StreamingResponse(
+        iter_export(batches, EXPORT_FIELDS[dataset], format, compress),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 @api_router.get("/admin/prizes")
-async def admin_get_prizes(admin=Depends(verify_admin)):
-    prizes = await db.prizes.find({}, {"_id": 0}).to_list(100)
+async def admin_get_prizes(campaign: Campaign = Depends(campaign_param), admin=Depends(verify_admin)):
+    prizes = await storage.list_prizes(campaign.id)
+    remaining = await storage.stock_remaining(campaign.id)
+    for prize in prizes:
+        if prize.get("stock") is not None:
+            prize["remaining"] = max(0, remaining.get(prize["label"], 0))
     return {"prizes": prizes}
 
 @api_router.put("/admin/prizes")
-async def update_prizes(req: UpdatePrizesRequest, admin=Depends(verify_admin)):
-    await db.prizes.delete_many({})
+async def update_prizes(
+    req: UpdatePrizesRequest, campaign: Campaign = Depends(campaign_param), admin=Depends(verify_admin)
+):
     new_prizes = []
     for i, prize in enumerate(req.prizes):
         doc = {
@@ -284,38 +1688,215 @@ async def update_prizes(req: UpdatePrizesRequest, admin=Depends(verify_admin)):
             "image_url": prize.image_url,
             "color": prize.color,
             "probability": prize.probability,
+            "stock": prize.stock,
             "created_at": datetime.now(timezone.utc).isoformat(),
         }
         new_prizes.append(doc)
-    if new_prizes:
-        await db.prizes.insert_many(new_prizes)
-    return {"message": "Prize pool updated", "prizes": [{k: v for k, v in p.items() if k != "_id"} for p in new_prizes]}
+    async with campaign.pool_lock:
+        old_caps = {p["label"]: p["stock"] for p in await storage.list_prizes(campaign.id) if p.get("stock") is not None}
+        live = await storage.stock_remaining(campaign.id)
+        # A prize that stays capped keeps its live counters, shifted by the change
+        # in its cap: rebuilding them from the stats would hand back the units
+        # in-flight spins hold. Newly capped prizes count wins so far against it.
+        shifts = {p["label"]: p["stock"] - old_caps[p["label"]] for p in new_prizes
+                  if p["stock"] is not None and p["label"] in old_caps and p["label"] in live}
+        won = {d["_id"]: d["count"] for d in (await read_stats(campaign.id))["prize_distribution"]}
+        fresh = {p["label"]: max(0, p["stock"] - won.get(p["label"], 0)) for p in new_prizes
+                 if p["stock"] is not None and p["label"] not in shifts}
+        await storage.replace_prizes(campaign.id, new_prizes)
+        await storage.reset_stock(campaign.id, fresh, keep=shifts)
+        for label, delta in shifts.items():
+            await shift_stock(campaign.id, label, delta)
+        remaining = await storage.stock_remaining(campaign.id)
+        swap_prize_pool(campaign, new_prizes, exhausted_labels(new_prizes, remaining))
+        await publish_change(f"prizes:{campaign.id}")
+    return {"message": "Prize pool updated", "prizes": new_prizes}
+
+@api_router.post("/admin/prizes/simulate")
+async def simulate_prizes(
+    req: SimulatePrizesRequest, campaign: Campaign = Depends(campaign_param), admin=Depends(verify_admin)
+):
+    """Monte Carlo preview of a prize pool (stock caps are not applied)."""
+    prizes = [p.model_dump() for p in req.prizes] if req.prizes is not None else campaign.pool.prizes
+    pool = PrizePool(prizes)
+    if not pool.eligible:
+        raise HTTPException(status_code=400, detail="No eligible prizes")
+    started = time.perf_counter()
+    counts = await asyncio.to_thread(simulate_pool, pool, req.spins, req.seed)
+    elapsed = time.perf_counter() - started
+    return {"spins": req.spins, "seed": req.seed, "elapsed_seconds": round(elapsed, 4),
+            **outcome_report(pool.eligible, counts.tolist())}
+
+@api_router.get("/admin/prizes/fairness")
+async def prize_fairness(campaign: Campaign = Depends(campaign_param), admin=Depends(verify_admin)):
+    """Chi-square test of the recorded draw distribution against the configured probabilities."""
+    pool = PrizePool(campaign.pool.prizes)  # all weighted prizes, including exhausted ones
+    if not pool.eligible:
+        raise HTTPException(status_code=400, detail="No eligible prizes")
+    observed = {d["_id"]: d["count"] for d in (await read_stats(campaign.id))["prize_distribution"]}
+    labels = {p["label"] for p in pool.eligible}
+    report = outcome_report(pool.eligible, [observed.get(p["label"], 0) for p in pool.eligible])
+    for row, prize in zip(report["prizes"], pool.eligible):
+        row["stock_limited"] = prize.get("stock") is not None
+    # Draws of prizes since removed or renamed cannot be tested against the current pool
+    report["excluded"] = {label: count for label, count in observed.items() if label not in labels}
+    return report
+
+@api_router.post("/admin/batch-draw")
+async def batch_draw(
+    req: BatchDrawRequest, campaign: Campaign = Depends(campaign_param), admin=Depends(verify_admin)
+):
+    """Draw prizes for many code holders at once.
+
+    Streams one NDJSON line per winner, one with a status of "invalid" or
+    "used" per listed entry that could not be drawn, then a summary.
+    """
+    if not campaign.pool.eligible and not campaign.pool.exhausted:
+        raise HTTPException(status_code=500, detail="No eligible prizes")
+    if not req.all_unused and not req.entries:
+        raise HTTPException(status_code=400, detail="Provide entries or set all_unused")
+    batch_id = secrets.token_hex(8)
+    pairs = None
+    if not req.all_unused:
+        pairs = list(dict.fromkeys((e.username, e.redeem_code) for e in req.entries))
+        if req.limit is not None:
+            pairs = pairs[:req.limit]
+
+    async def draw_chunk(chunk: Optional[List[Tuple[str, str]]], k: int):
+        """Reserve prizes for a chunk, claim its codes and write the draws; returns (outcomes, records)."""
+        # Prizes (and their stock) are reserved first and claimed with the codes, so a
+        # crash before the history write leaves history_pending claims to recover
+        outcomes = await allocate_prizes(campaign, k)
+        if not outcomes:
+            return outcomes, []
+        now = datetime.now(timezone.utc).isoformat()
+        claimed = await storage.claim_batch(campaign.id, chunk, [p["label"] for p in outcomes], now, batch_id)
+        counts = Counter(user["prize_label"] for user in claimed)
+        prizes = {p["label"]: p for p in outcomes}
+        # Outcomes meant for codes a concurrent spin won go back
+        unclaimed = Counter(p["label"] for p in outcomes) - counts
+        await release_prizes(campaign, [prizes[label] for label in unclaimed.elements()])
+        records = [{
+            "campaign": campaign.id,
+            "username": user["username"],
+            "prize_label": user["prize_label"],
+            "prize_image_url": prizes[user["prize_label"]].get("image_url", ""),
+            "prize_color": prizes[user["prize_label"]]["color"],
+            "drawn_at": now,
+        } for user in claimed]
+        if records:
+            await asyncio.gather(storage.flush_draws(records), record_draw_stats(campaign.id, counts))
+            for label, n in counts.items():
+                SPIN_OUTCOMES.labels(campaign.id, label).inc(n)
+            bump_history_version(campaign)
+            await publish_change(f"history:{campaign.id}")
+            campaign.broadcaster.publish_many(records)
+        return outcomes, records
+
+    async def rejected_lines(chunk: List[Tuple[str, str]], records: List[dict]) -> str:
+        """One status line per entry whose code is unknown or was already used."""
+        drawn = {r["username"] for r in records}
+        left = [(u, c) for u, c in chunk if u not in drawn]
+        codes = await asyncio.gather(*(storage.find_code(campaign.id, u, c) for u, c in left))
+        return "".join(
+            json.dumps({"username": u, "status": "invalid" if code is None else "used"}) + "\n"
+            for (u, _), code in zip(left, codes) if code is None or code.get("is_used")
+        )
+
+    async def body():
+        started = time.perf_counter()
+        totals: Dict[str, int] = {}
+        drawn = 0
+        out_of_stock = False
+        remaining = len(pairs) if pairs is not None else (req.limit if req.limit is not None else float("inf"))
+        position = 0
+        while remaining > 0:
+            if pairs is not None:
+                chunk = pairs[position:position + BATCH_DRAW_CHUNK_SIZE]
+                if not chunk:
+                    break
+                position += len(chunk)
+                k = len(chunk)
+            else:
+                chunk, k = None, int(min(BATCH_DRAW_CHUNK_SIZE, remaining))
+            # A client disconnect cancels this generator; the shield lets the chunk finish
+            # so stock it reserved is either claimed or released, never stranded
+            outcomes, records = await asyncio.shield(asyncio.ensure_future(draw_chunk(chunk, k)))
+            if not outcomes:
+                out_of_stock = True
+                break
+            remaining -= len(records)
+            drawn += len(records)
+            for r in records:
+                totals[r["prize_label"]] = totals.get(r["prize_label"], 0) + 1
+            lines = "".join(json.dumps({"username": r["username"], "prize_label": r["prize_label"]}) + "\n" for r in records)
+            if chunk is not None:
+                lines += await rejected_lines(chunk, records)
+            if lines:
+                yield lines
+            if not records and chunk is None:
+                break
+        elapsed = time.perf_counter() - started
+        skipped = len(pairs) - drawn if pairs is not None else 0
+        logger.info(f"Batch draw {batch_id} ({campaign.id}): {drawn} drawn, {skipped} skipped in {elapsed:.2f}s")
+        yield json.dumps({
+            "batch_id": batch_id,
+            "drawn": drawn,
+            "skipped": skipped,
+            "out_of_stock": out_of_stock,
+            "prize_counts": totals,
+            "elapsed_seconds": round(elapsed, 3),
+        }) + "\n"
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
 
 @api_router.get("/admin/stats")
-async def get_stats(admin=Depends(verify_admin)):
-    total_codes = await db.users.count_documents({})
-    used_codes = await db.users.count_documents({"is_used": True})
-    unused_codes = total_codes - used_codes
-    total_draws = await db.draw_history.count_documents({})
-
-    pipeline = [
-        {"$group": {"_id": "$prize_label", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]
-    prize_distribution = await db.draw_history.aggregate(pipeline).to_list(100)
-    history = await db.draw_history.find({}, {"_id": 0}).sort("drawn_at", -1).to_list(200)
+async def get_stats(
+    history_limit: int = Query(200, ge=1, le=1000),
+    history_cursor: Optional[str] = Query(None),
+    campaign: Campaign = Depends(campaign_param),
+    admin=Depends(verify_admin),
+):
+    async def fetch(page_limit, after):
+        return await storage.page_history(campaign.id, page_limit, after)
+
+    stats = await read_stats(campaign.id)
+    history, history_next_cursor = await keyset_page(fetch, "drawn_at", history_limit, history_cursor)
 
     return {
-        "total_codes": total_codes,
-        "used_codes": used_codes,
-        "unused_codes": unused_codes,
-        "total_draws": total_draws,
-        "prize_distribution": prize_distribution,
+        **stats,
         "history": history,
+        "history_next_cursor": history_next_cursor,
     }
 
+@api_router.get("/admin/stats/timeline")
+async def get_stats_timeline(
+    period: str = Query("day"),
+    since: Optional[str] = Query(None),
+    campaign: Campaign = Depends(campaign_param),
+    admin=Depends(verify_admin),
+):
+    """Draws per prize per hour or day, straight from the rollups."""
+    if period not in ("hour", "day"):
+        raise HTTPException(status_code=400, detail="Period must be hour or day")
+    buckets = {}
+    for row in await storage.rollups(campaign.id, period, since):
+        bucket = buckets.setdefault(row["start"], {"start": row["start"], "total": 0, "prizes": {}})
+        bucket["total"] += row["count"]
+        bucket["prizes"][row["label"]] = row["count"]
+    return {"period": period, "buckets": list(buckets.values())}
+
+@api_router.post("/admin/stats/reconcile")
+async def reconcile_stats_now(campaign: Campaign = Depends(campaign_param), admin=Depends(verify_admin)):
+    await reconcile_stats(campaign.id)
+    return {"message": "Stats reconciled", **await read_stats(campaign.id)}
+
 app.include_router(api_router)
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return metrics_response()
+
 # CORS configuration
 allowed_origins = [
     "https://lucky-naga.pages.dev",
@@ -332,6 +1913,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+if __name__ == "__main__":
+    import sys
+
+    if "--check-indexes" in sys.argv:
+        async def check_indexes():
+            storage = build_storage()
+            await storage.init()
+            await storage.verify_query_plans()
+
+        asyncio.run(check_indexes())
@@ -0,0 +1,1639 @@
+"""Storage engines for the Lucky Wheel API.
+
+Handlers talk to a Storage instead of a Motor database, so the app can run
+against MongoDB (MongoStorage) or an embedded SQLite database
+(SQLiteStorage) - on disk in WAL mode for small single-node events, or in
+memory for tests and benchmarks. Pick one with STORAGE_ENGINE
+(mongo | sqlite | memory).
+
+Keyset pages are ordered newest first on (created_at | drawn_at, id); the
+`after` argument is the (key, id) pair of the last row of the previous
+page, with the id as the string the engine handed out. Engines raise
+ValueError for ids they cannot parse.
+
+Prize stock is held in STOCK_STRIPES counters per capped prize, so
+concurrent spins decrement different rows instead of queueing on one.
+
+draw_history is the hot tier: rows past the retention window move to
+draw_history_archive, while hourly and daily per-prize rollups (updated in
+the same write path as the rows) answer stats without touching raw draws.
+Timestamps are UTC ISO strings, so buckets are plain string prefixes.
+
+Codes, prizes, stock, draws, rollups and stats each belong to one campaign
+(an independent wheel). Every index leads with the campaign key, so a
+campaign's queries only ever walk its own slice; admins and the version
+document are shared. Rows written before campaigns existed are adopted by
+DEFAULT_CAMPAIGN the first time init runs. Campaigns themselves are kept in
+their own registry, so one whose prize pool is emptied still exists.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import secrets
+import sqlite3
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from bson import ObjectId
+from bson.errors import InvalidId
+
+logger = logging.getLogger(__name__)
+
+Cursor = Optional[Tuple[str, str]]
+
+STOCK_STRIPES = int(os.environ.get("STOCK_STRIPES", "8"))
+DEFAULT_CAMPAIGN = os.environ.get("DEFAULT_CAMPAIGN", "default")
+
+
+# period -> (length of the drawn_at prefix, suffix completing the bucket start)
+ROLLUP_PERIODS = {"hour": (13, ":00:00+00:00"), "day": (10, "T00:00:00+00:00")}
+
+
+def rollup_counts(records: Iterable[dict]) -> Dict[Tuple[str, str, str, str], int]:
+    """Count draws per (campaign, period, bucket start, prize label)."""
+    counts: Dict[Tuple[str, str, str, str], int] = {}
+    for record in records:
+        for period, (width, suffix) in ROLLUP_PERIODS.items():
+            key = (record["campaign"], period, record["drawn_at"][:width] + suffix, record["prize_label"])
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def first_token_version() -> int:
+    """Random starting token_version for a new admin account.
+
+    A username that is deleted and created again must not accept the old
+    account's tokens, so versions never restart from a shared value.
+    """
+    return secrets.randbits(48)
+
+
+def split_stock(remaining: int) -> List[int]:
+    """Spread a stock level over STOCK_STRIPES counters as evenly as possible."""
+    base, extra = divmod(max(0, remaining), STOCK_STRIPES)
+    return [base + (1 if i < extra else 0) for i in range(STOCK_STRIPES)]
+
+
+class Storage(ABC):
+    """Repository interface over admins, users, prizes, draw_history and the stats counters."""
+
+    name = "base"
+    supports_watch = False  # whether watch_versions can push changes
+
+    @abstractmethod
+    async def init(self):
+        """Create schema and indexes; safe to run on every startup."""
+
+    @abstractmethod
+    async def verify_query_plans(self):
+        """Raise RuntimeError if any hot query would scan a whole collection/table."""
+
+    async def warm_up(self, connections: int):
+        """Open up to connections pooled connections ahead of traffic; a no-op for engines without a pool."""
+
+    @abstractmethod
+    async def close(self):
+        ...
+
+    # admins
+    @abstractmethod
+    async def get_admin(self, username: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def insert_admin(self, doc: dict) -> bool:
+        """Insert an admin, its token_version starting at first_token_version(); False if the username is taken."""
+
+    @abstractmethod
+    async def list_admins(self) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def delete_admin(self, username: str) -> bool:
+        """Delete a regular (non-master) admin; False if none matched."""
+
+    @abstractmethod
+    async def set_admin_password(
+        self, username: str, password_hash: str, expected_hash: Optional[str] = None, revoke_tokens: bool = False
+    ) -> bool:
+        """Store a new hash; revoke_tokens also bumps token_version, invalidating issued tokens."""
+
+    @abstractmethod
+    async def token_versions(self) -> Dict[str, int]:
+        """username -> token_version for every admin (0 if never bumped)."""
+
+    # prizes
+    @abstractmethod
+    async def list_campaigns(self) -> List[str]:
+        """Every registered campaign, including those whose prize pool is empty."""
+
+    @abstractmethod
+    async def list_prizes(self, campaign: str) -> List[dict]:
+        ...
+
+    @abstractmethod
+    async def replace_prizes(self, campaign: str, prizes: List[dict]):
+        ...
+
+    @abstractmethod
+    async def seed_campaigns(self, pools: Dict[str, List[dict]]) -> List[str]:
+        """Register the campaigns not yet known, giving those without prizes their pool; returns the campaigns registered."""
+
+    # prize stock
+    @abstractmethod
+    async def reset_stock(self, campaign: str, remaining: Dict[str, int], keep: Iterable[str] = ()):
+        """Replace the campaign's stock counters; labels left out (and not in keep) become unlimited."""
+
+    @abstractmethod
+    async def take_stock(self, campaign: str, label: str, count: int) -> int:
+        """Atomically take up to count units of a prize; returns how many were granted."""
+
+    @abstractmethod
+    async def release_stock(self, campaign: str, label: str, count: int):
+        """Add count units (negative to owe them) to the label's lowest stripe.
+
+        A stripe below zero is a debt left by a restock that cut more than was
+        left; releases land there first, so they repay it before any unit
+        becomes takeable again.
+        """
+
+    @abstractmethod
+    async def stock_remaining(self, campaign: str) -> Dict[str, int]:
+        """Remaining units per capped prize label."""
+
+    # users / redeem codes
+    @abstractmethod
+    async def existing_usernames(self, campaign: str, usernames: List[str]) -> Set[str]:
+        ...
+
+    @abstractmethod
+    async def insert_codes(self, campaign: str, docs: List[dict]) -> Tuple[List[dict], List[str]]:
+        """Insert code docs, skipping taken usernames.
+
+        Returns the inserted docs and the usernames whose redeem code collided.
+        """
+
+    @abstractmethod
+    async def claim_code(
+        self, campaign: str, username: str, redeem_code: str, used_at: str, prize_label: str,
+        idempotency_key: Optional[str] = None,
+    ) -> bool:
+        """Atomically mark an unused code as used; False if nothing was claimed.
+
+        The claim is flagged history_pending until flush_draws writes its
+        draw_history row, so a crash in between can be recovered. An
+        idempotency_key is stored with the claim and is unique per campaign;
+        a key already held by another code makes the claim fail.
+        """
+
+    @abstractmethod
+    async def find_code(self, campaign: str, username: str, redeem_code: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def find_claim(self, campaign: str, idempotency_key: str) -> Optional[dict]:
+        """The claim made under idempotency_key: username, redeem_code, prize_label and used_at."""
+
+    @abstractmethod
+    async def claim_batch(
+        self, campaign: str, pairs: Optional[List[Tuple[str, str]]], labels: List[str], used_at: str, batch_id: str
+    ) -> List[dict]:
+        """Claim up to len(labels) unused codes at once, giving each claim one of the labels.
+
+        With pairs, claims those (username, redeem_code) pairs; with None, any
+        unused codes. Claims are flagged history_pending like claim_code's.
+        Returns the claimed users with their prize_label.
+        """
+
+    @abstractmethod
+    async def page_codes(self, campaign: str, is_used: Optional[bool], limit: int, after: Cursor = None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def iter_codes(self, campaign: str, is_used: Optional[bool], batch_size: int) -> AsyncIterator[List[dict]]:
+        ...
+
+    # draw history: records carry their campaign, so one write batch may span several
+    @abstractmethod
+    async def flush_draws(self, records: List[dict]):
+        """Insert buffered spin records and clear their claims' history_pending flag.
+
+        Safe to retry and to race: a code is drawn once, so a row is keyed by
+        its claim (campaign, username), one already written is skipped, and
+        rollups count each row once.
+        """
+
+    @abstractmethod
+    async def pending_draws(self, before: str) -> List[dict]:
+        """Claims (campaign, username, prize_label, used_at) made before `before` still waiting for their draw_history row."""
+
+    @abstractmethod
+    async def page_history(self, campaign: str, limit: int, after: Cursor = None) -> List[dict]:
+        ...
+
+    @abstractmethod
+    def iter_history(self, campaign: str, batch_size: int, archived: bool = False) -> AsyncIterator[List[dict]]:
+        ...
+
+    @abstractmethod
+    async def archive_draws(self, campaign: str, before: str, batch_size: int) -> int:
+        """Move up to batch_size of the oldest rows drawn before `before` to the archive; returns the count."""
+
+    # draw rollups
+    @abstractmethod
+    async def rollups(self, campaign: str, period: str, since: Optional[str] = None) -> List[dict]:
+        """Rollup rows {start, label, count} for one period, oldest bucket first."""
+
+    @abstractmethod
+    async def prune_rollups(self, campaign: str, period: str, before: str):
+        ...
+
+    # stats counters
+    @abstractmethod
+    async def incr_code_stats(self, campaign: str, count: int):
+        ...
+
+    @abstractmethod
+    async def incr_draw_stats(self, campaign: str, counts: Dict[str, int]):
+        """Add draws per prize label to the used/draw totals and prize counters."""
+
+    @abstractmethod
+    async def read_stats(self, campaign: str) -> Optional[dict]:
+        """Counters as {total_codes, used_codes, total_draws, prize_counts}; None if never built."""
+
+    @abstractmethod
+    async def reconcile_stats(self, campaign: str) -> dict:
+        """Rebuild the campaign's counters from users and the daily rollups."""
+
+    # cross-worker change versions
+    @abstractmethod
+    async def bump_version(self, name: str) -> int:
+        """Increment a named version in the shared version document; returns the new value."""
+
+    @abstractmethod
+    async def read_versions(self) -> Dict[str, int]:
+        ...
+
+    def watch_versions(self) -> AsyncIterator[Dict[str, int]]:
+        """Yield the version document on every change.
+
+        Only engines with supports_watch implement this; callers of the
+        others poll read_versions instead.
+        """
+        raise NotImplementedError(f"{self.name} storage cannot push version changes")
+
+
+# --- MongoDB ---
+class MongoStorage(Storage):
+    name = "mongo"
+    supports_watch = True
+
+    # Declarative registry applied on every startup; create_indexes is a
+    # no-op for indexes that already exist with the same spec.
+    INDEXES = {
+        "admins": [
+            IndexModel([("username", ASCENDING)], unique=True),
+        ],
+        "prizes": [
+            IndexModel([("campaign", ASCENDING), ("position", ASCENDING)]),
+        ],
+        "users": [
+            IndexModel([("campaign", ASCENDING), ("username", ASCENDING)], unique=True),
+            IndexModel([("campaign", ASCENDING), ("redeem_code", ASCENDING)], unique=True),
+            IndexModel([("campaign", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("campaign", ASCENDING), ("is_used", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("history_pending", ASCENDING)], sparse=True),
+            IndexModel(
+                [("campaign", ASCENDING), ("idempotency_key", ASCENDING)], unique=True,
+                partialFilterExpression={"idempotency_key": {"$type": "string"}},
+            ),
+        ],
+        "draw_history": [
+            IndexModel([("campaign", ASCENDING), ("drawn_at", DESCENDING), ("_id", DESCENDING)]),
+        ],
+        "draw_history_archive": [
+            IndexModel([("campaign", ASCENDING), ("drawn_at", DESCENDING), ("_id", DESCENDING)]),
+        ],
+        "draw_rollups": [
+            IndexModel([("campaign", ASCENDING), ("period", ASCENDING), ("start", ASCENDING)]),
+        ],
+        "prize_stock": [
+            IndexModel([("campaign", ASCENDING), ("label", ASCENDING), ("remaining", ASCENDING)]),
+        ],
+        "stats": [
+            IndexModel([("campaign", ASCENDING)]),
+        ],
+    }
+
+    # Pre-campaign indexes; the unique ones would stop two campaigns sharing a username
+    RETIRED_INDEXES = {
+        "users": ["username_1", "redeem_code_1", "created_at_-1__id_-1", "is_used_1_created_at_-1__id_-1"],
+        "draw_history": ["drawn_at_-1__id_-1"],
+        "draw_history_archive": ["drawn_at_-1__id_-1"],
+        "draw_rollups": ["period_1_start_1"],
+        "prize_stock": ["label_1_remaining_1"],
+    }
+
+    # (collection, filter, sort) for every hot query below
+    HOT_QUERIES = [
+        ("admins", {"username": "u"}, None),
+        ("prizes", {"campaign": "c"}, [("position", ASCENDING)]),
+        ("users", {"campaign": "c", "username": "u", "redeem_code": "C", "is_used": False}, None),
+        ("users", {"campaign": "c", "username": {"$in": ["u"]}}, None),
+        ("users", {"campaign": "c"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+        ("users", {"campaign": "c", "is_used": True}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+        ("users", {"campaign": "c", "is_used": False}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+        ("users", {"history_pending": True, "used_at": {"$lt": "t"}}, None),
+        ("users", {"campaign": "c", "idempotency_key": "k"}, None),
+        ("draw_history", {"campaign": "c"}, [("drawn_at", DESCENDING), ("_id", DESCENDING)]),
+        ("draw_history", {"campaign": "c", "drawn_at": {"$lt": "t"}}, [("drawn_at", ASCENDING), ("_id", ASCENDING)]),
+        ("draw_rollups", {"campaign": "c", "period": "day", "start": {"$gte": "t"}}, [("start", ASCENDING)]),
+        ("prize_stock", {"campaign": "c", "label": "p", "remaining": {"$gt": 0}}, None),
+        ("stats", {"campaign": "c"}, None),
+    ]
+
+    VERSIONS_ID = "versions"
+    SCHEMA_ID = "schema"
+
+    def __init__(self, url: str, db_name: str, **client_options):
+        self.client = AsyncIOMotorClient(url, **client_options)
+        self.db = self.client[db_name]
+
+    async def init(self):
+        await self._adopt_legacy_rows()
+        for name, models in self.INDEXES.items():
+            await self.db[name].create_indexes(models)
+        for name, retired in self.RETIRED_INDEXES.items():
+            existing = {index["name"] async for index in self.db[name].list_indexes()}
+            for index in existing.intersection(retired):
+                await self.db[name].drop_index(index)
+                logger.info(f"Dropped retired index {name}.{index}")
+        logger.info(f"Ensured indexes on {', '.join(self.INDEXES)}")
+        if not await self.db.draw_rollups.find_one() and await self.db.draw_history.find_one():
+            await self._backfill_rollups()
+        if not await self.db.campaigns.find_one():
+            await self._backfill_campaigns()
+
+    async def _backfill_campaigns(self):
+        """One-off registration of campaigns that predate the registry, found by their prizes and codes."""
+        found = set(await self.db.prizes.distinct("campaign")) | set(await self.db.users.distinct("campaign"))
+        if found:
+            await self._register_campaigns(sorted(found))
+            logger.info(f"Registered existing campaigns: {', '.join(sorted(found))}")
+
+    async def _register_campaigns(self, campaigns: List[str]) -> List[str]:
+        now = datetime.now(timezone.utc).isoformat()
+        result = await self.db.campaigns.bulk_write([
+            UpdateOne({"_id": campaign}, {"$setOnInsert": {"created_at": now}}, upsert=True) for campaign in campaigns
+        ], ordered=False)
+        return [campaigns[i] for i in result.upserted_ids]
+
+    async def _adopt_legacy_rows(self):
+        """One-off move of rows written before campaigns into DEFAULT_CAMPAIGN.
+
+        Every step is idempotent, so workers starting together may all run it.
+        """
+        if await self.db.meta.find_one({"_id": self.SCHEMA_ID, "campaigns": True}):
+            return
+        legacy = {"campaign": {"$exists": False}}
+        for name in ("users", "draw_history", "draw_history_archive"):
+            await self.db[name].update_many(legacy, {"$set": {"campaign": DEFAULT_CAMPAIGN}})
+        prizes = await self.db.prizes.find(legacy, {"_id": 1}).to_list(None)
+        if prizes:
+            await self.db.prizes.bulk_write([
+                UpdateOne({"_id": p["_id"]}, {"$set": {"campaign": DEFAULT_CAMPAIGN, "position": i}})
+                for i, p in enumerate(prizes)
+            ])
+        # Counter documents are keyed by _id, which now leads with the campaign
+        for name in ("stats", "prize_stock", "draw_rollups"):
+            docs = await self.db[name].find(legacy).to_list(None)
+            if not docs:
+                continue
+            try:
+                await self.db[name].insert_many([
+                    {**d, "_id": f"{DEFAULT_CAMPAIGN}:{d['_id']}", "campaign": DEFAULT_CAMPAIGN} for d in docs
+                ], ordered=False)
+            except BulkWriteError as e:
+                if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                    raise
+            await self.db[name].delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+        await self.db.meta.update_one({"_id": self.SCHEMA_ID}, {"$set": {"campaigns": True}}, upsert=True)
+        logger.info(f"Adopted pre-campaign data into campaign {DEFAULT_CAMPAIGN!r}")
+
+    async def _backfill_rollups(self):
+        """One-off build of the rollups for history written before they existed."""
+        counts: Dict[Tuple[str, str, str, str], int] = {}
+        width, suffix = ROLLUP_PERIODS["hour"]
+        pipeline = [{"$group": {
+            "_id": {"campaign": "$campaign", "hour": {"$substr": ["$drawn_at", 0, width]}, "label": "$prize_label"},
+            "count": {"$sum": 1},
+        }}]
+        for collection in (self.db.draw_history, self.db.draw_history_archive):
+            async for row in collection.aggregate(pipeline):
+                campaign, hour, label = row["_id"]["campaign"], row["_id"]["hour"] + suffix, row["_id"]["label"]
+                for period, (w, sfx) in ROLLUP_PERIODS.items():
+                    key = (campaign, period, hour[:w] + sfx, label)
+                    counts[key] = counts.get(key, 0) + row["count"]
+        await self._incr_rollups(counts)
+        logger.info(f"Backfilled {len(counts)} draw rollups")
+
+    @classmethod
+    def plan_stages(cls, plan: dict) -> List[str]:
+        stages = [plan.get("stage", "")]
+        for key in ("inputStage", "queryPlan"):
+            if key in plan:
+                stages += cls.plan_stages(plan[key])
+        for child in plan.get("inputStages", []):
+            stages += cls.plan_stages(child)
+        return stages
+
+    async def verify_query_plans(self):
+        failures = []
+        for name, query, sort in self.HOT_QUERIES:
+            cursor = self.db[name].find(query).limit(1)
+            if sort:
+                cursor = cursor.sort(sort)
+            explained = await cursor.explain()
+            winning = explained.get("queryPlanner", {}).get("winningPlan", {})
+            if "COLLSCAN" in self.plan_stages(winning):
+                failures.append(f"{name} {query} sort={sort}")
+        if failures:
+            raise RuntimeError("Queries without index support: " + "; ".join(failures))
+        logger.info(f"Verified query plans for {len(self.HOT_QUERIES)} hot queries")
+
+    async def warm_up(self, connections):
+        # Concurrent commands each check out a connection, so the pool grows to meet them
+        await asyncio.gather(*(self.client.admin.command("ping") for _ in range(connections)))
+
+    async def close(self):
+        self.client.close()
+
+    # admins
+    async def get_admin(self, username):
+        return await self.db.admins.find_one({"username": username}, {"_id": 0})
+
+    async def insert_admin(self, doc):
+        try:
+            await self.db.admins.insert_one({"token_version": first_token_version(), **doc})
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def list_admins(self):
+        return await self.db.admins.find({}, {"_id": 0, "password_hash": 0}).to_list(100)
+
+    async def delete_admin(self, username):
+        result = await self.db.admins.delete_one({"username": username, "role": "admin"})
+        return result.deleted_count > 0
+
+    async def set_admin_password(self, username, password_hash, expected_hash=None, revoke_tokens=False):
+        query = {"username": username}
+        if expected_hash is not None:
+            query["password_hash"] = expected_hash
+        update = {"$set": {"password_hash": password_hash}}
+        if revoke_tokens:
+            update["$inc"] = {"token_version": 1}
+        result = await self.db.admins.update_one(query, update)
+        return result.matched_count > 0
+
+    async def token_versions(self):
+        admins = await self.db.admins.find({}, {"_id": 0, "username": 1, "token_version": 1}).to_list(None)
+        return {a["username"]: a.get("token_version", 0) for a in admins}
+
+    # campaigns: one {_id: campaign, created_at} document each
+    async def list_campaigns(self):
+        return sorted(await self.db.campaigns.distinct("_id"))
+
+    # prizes: one document per wheel segment, ordered by position within the campaign
+
+    async def list_prizes(self, campaign):
+        return await self.db.prizes.find(
+            {"campaign": campaign}, {"_id": 0, "campaign": 0, "position": 0}
+        ).sort("position", ASCENDING).to_list(100)
+
+    def _prize_docs(self, campaign, prizes):
+        return [
+            {**{k: v for k, v in p.items() if k != "_id"}, "campaign": campaign, "position": i}
+            for i, p in enumerate(prizes)
+        ]
+
+    async def replace_prizes(self, campaign, prizes):
+        await self.db.prizes.delete_many({"campaign": campaign})
+        if prizes:
+            await self.db.prizes.insert_many(self._prize_docs(campaign, prizes))
+
+    async def seed_campaigns(self, pools):
+        registered = set(await self.db.campaigns.distinct("_id", {"_id": {"$in": list(pools)}}))
+        new = [campaign for campaign in pools if campaign not in registered]
+        if not new:
+            return []
+        existing = set(await self.db.prizes.distinct("campaign", {"campaign": {"$in": new}}))
+        # Fixed ids make workers that start together seed a campaign only once
+        ops = [
+            UpdateOne({"_id": f"{campaign}:seed:{doc['position']}"}, {"$setOnInsert": doc}, upsert=True)
+            for campaign in new if campaign not in existing
+            for doc in self._prize_docs(campaign, pools[campaign])
+        ]
+        if ops:
+            await self.db.prizes.bulk_write(ops, ordered=False)
+        # Registered last, so a campaign never shows up before its pool
+        return sorted(await self._register_campaigns(new))
+
+    # prize stock: one {_id: "<campaign>:<label>#<stripe>", campaign, label, remaining} document per stripe
+    async def reset_stock(self, campaign, remaining, keep=()):
+        ops = [
+            UpdateOne(
+                {"_id": f"{campaign}:{label}#{i}"},
+                {"$set": {"campaign": campaign, "label": label, "stripe": i, "remaining": units}},
+                upsert=True,
+            )
+            for label, total in remaining.items()
+            for i, units in enumerate(split_stock(total))
+        ]
+        if ops:
+            await self.db.prize_stock.bulk_write(ops, ordered=False)
+        # Upsert first, then prune, so capped prizes never look empty mid-reset
+        await self.db.prize_stock.delete_many({
+            "campaign": campaign,
+            "$or": [{"label": {"$nin": [*remaining, *keep]}},
+                    {"label": {"$in": list(remaining)}, "stripe": {"$gte": STOCK_STRIPES}}],
+        })
+
+    async def _take_stripe(self, query: dict, units: int) -> bool:
+        taken = await self.db.prize_stock.find_one_and_update(
+            {**query, "remaining": {"$gte": units}}, {"$inc": {"remaining": -units}}, {"_id": 1}
+        )
+        return taken is not None
+
+    async def take_stock(self, campaign, label, count):
+        # Fast path for single spins: one conditional decrement on a random stripe
+        stripe_id = f"{campaign}:{label}#{random.randrange(STOCK_STRIPES)}"
+        if count == 1 and await self._take_stripe({"_id": stripe_id}, 1):
+            return 1
+        granted = 0
+        for _ in range(3):
+            stripes = await self.db.prize_stock.find(
+                {"campaign": campaign, "label": label, "remaining": {"$gt": 0}}, {"remaining": 1}
+            ).to_list(None)
+            if not stripes:
+                break
+            random.shuffle(stripes)
+            for stripe in stripes:
+                units = min(count - granted, stripe["remaining"])
+                if await self._take_stripe({"_id": stripe["_id"]}, units):
+                    granted += units
+                if granted == count:
+                    return granted
+        return granted
+
+    async def release_stock(self, campaign, label, count):
+        await self.db.prize_stock.find_one_and_update(
+            {"campaign": campaign, "label": label}, {"$inc": {"remaining": count}},
+            {"_id": 1}, sort=[("remaining", ASCENDING)],
+        )
+
+    async def stock_remaining(self, campaign):
+        pipeline = [
+            {"$match": {"campaign": campaign}},
+            {"$group": {"_id": "$label", "remaining": {"$sum": "$remaining"}}},
+        ]
+        rows = await self.db.prize_stock.aggregate(pipeline).to_list(None)
+        return {r["_id"]: r["remaining"] for r in rows}
+
+    # users / redeem codes
+    async def existing_usernames(self, campaign, usernames):
+        existing = await self.db.users.find(
+            {"campaign": campaign, "username": {"$in": usernames}}, {"_id": 0, "username": 1}
+        ).to_list(None)
+        return {u["username"] for u in existing}
+
+    async def insert_codes(self, campaign, docs):
+        docs = [{**d, "campaign": campaign} for d in docs]
+        failed, collided = set(), []
+        try:
+            await self.db.users.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get("writeErrors", []):
+                if err.get("code") != 11000:
+                    raise
+                failed.add(err["index"])
+                # Username races with a concurrent request are skipped like any duplicate
+                if "redeem_code" in err.get("keyPattern", {}) or "redeem_code" in err.get("errmsg", ""):
+                    collided.append(docs[err["index"]]["username"])
+        inserted = [
+            {k: v for k, v in d.items() if k != "_id"}
+            for i, d in enumerate(docs) if i not in failed
+        ]
+        return inserted, collided
+
+    async def claim_code(self, campaign, username, redeem_code, used_at, prize_label, idempotency_key=None):
+        update = {"is_used": True, "used_at": used_at, "prize_label": prize_label, "history_pending": True}
+        if idempotency_key is not None:
+            update["idempotency_key"] = idempotency_key
+        # Single conditional claim: only one concurrent request can flip is_used
+        try:
+            claimed = await self.db.users.find_one_and_update(
+                {"campaign": campaign, "username": username, "redeem_code": redeem_code, "is_used": False},
+                {"$set": update},
+                {"_id": 1},
+            )
+        except DuplicateKeyError:
+            return False
+        return claimed is not None
+
+    async def find_code(self, campaign, username, redeem_code):
+        return await self.db.users.find_one(
+            {"campaign": campaign, "username": username, "redeem_code": redeem_code}, {"_id": 0}
+        )
+
+    async def find_claim(self, campaign, idempotency_key):
+        return await self.db.users.find_one(
+            {"campaign": campaign, "idempotency_key": idempotency_key},
+            {"_id": 0, "username": 1, "redeem_code": 1, "prize_label": 1, "used_at": 1},
+        )
+
+    async def claim_batch(self, campaign, pairs, labels, used_at, batch_id):
+        query = {"campaign": campaign, "is_used": False}
+        if pairs is not None:
+            query["$or"] = [{"username": u, "redeem_code": c} for u, c in pairs]
+        candidates = await self.db.users.find(query, {"_id": 1}).limit(len(labels)).to_list(len(labels))
+        ids = [c["_id"] for c in candidates]
+        if not ids:
+            return []
+        # A concurrent spin may win some of these; batch_id tells us which ones we got
+        await self.db.users.bulk_write([
+            UpdateOne(
+                {"_id": oid, "is_used": False},
+                {"$set": {"is_used": True, "used_at": used_at, "batch_id": batch_id, "prize_label": label,
+                          "history_pending": True}},
+            )
+            for oid, label in zip(ids, labels)
+        ], ordered=False)
+        return await self.db.users.find(
+            {"_id": {"$in": ids}, "batch_id": batch_id}, {"_id": 0, "username": 1, "redeem_code": 1, "prize_label": 1}
+        ).to_list(None)
+
+    @staticmethod
+    def _object_id(value: str) -> ObjectId:
+        try:
+            return ObjectId(value)
+        except (InvalidId, TypeError):
+            raise ValueError(f"Invalid id: {value!r}")
+
+    async def _page(self, collection, query: dict, field: str, limit: int, after: Cursor, projection=None):
+        if after:
+            key, oid = after[0], self._object_id(after[1])
+            cond = {"$or": [{field: {"$lt": key}}, {field: key, "_id": {"$lt": oid}}]}
+            query = {"$and": [query, cond]} if query else cond
+        docs = await collection.find(query, projection).sort(
+            [(field, DESCENDING), ("_id", DESCENDING)]
+        ).limit(limit).to_list(limit)
+        for doc in docs:
+            doc["_id"] = str(doc["_id"])
+        return docs
+
+    async def _iter(self, collection, query: dict, field: str, batch_size: int, projection=None):
+        cursor = collection.find(query, {"_id": 0, **(projection or {})}).sort(
+            [(field, DESCENDING), ("_id", DESCENDING)]
+        ).batch_size(batch_size)
+        batch = []
+        async for doc in cursor:
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @staticmethod
+    def _codes_query(campaign: str, is_used: Optional[bool]) -> dict:
+        return {"campaign": campaign} if is_used is None else {"campaign": campaign, "is_used": is_used}
+
+    async def page_codes(self, campaign, is_used, limit, after=None):
+        return await self._page(self.db.users, self._codes_query(campaign, is_used), "created_at", limit, after)
+
+    def iter_codes(self, campaign, is_used, batch_size):
+        return self._iter(self.db.users, self._codes_query(campaign, is_used), "created_at", batch_size)
+
+    # draw history: a row's _id is derived from its claim, so rewriting it is a duplicate-key no-op
+    @staticmethod
+    def _draw_id(record: dict) -> ObjectId:
+        """drawn_at's seconds then a hash of (campaign, username), so ids still sort by time like ObjectIds."""
+        seconds = int(datetime.fromisoformat(record["drawn_at"]).timestamp())
+        digest = hashlib.blake2b(f"{record['campaign']}\0{record['username']}".encode(), digest_size=8).digest()
+        return ObjectId(seconds.to_bytes(4, "big") + digest)
+
+    DRAW_FIELDS = {"rollup_pending": 0}
+
+    async def _insert_draws(self, records) -> List[dict]:
+        """Insert rows not written yet and roll up any not counted yet; returns the ones inserted.
+
+        Rows land flagged rollup_pending and lose the flag once counted, so a
+        retry after a failed rollup counts the rows it missed and no others.
+        """
+        if not records:
+            return []
+        ids = [self._draw_id(r) for r in records]
+        try:
+            await self.db.draw_history.insert_many(
+                [{**r, "_id": _id, "rollup_pending": True} for r, _id in zip(records, ids)], ordered=False
+            )
+            inserted = pending = records
+            pending_ids = ids
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise  # what did land stays flagged for the caller's retry
+            failed = {err["index"] for err in errors}
+            inserted = [r for i, r in enumerate(records) if i not in failed]
+            pending = await self.db.draw_history.find(
+                {"_id": {"$in": ids}, "rollup_pending": True}, {"campaign": 1, "prize_label": 1, "drawn_at": 1}
+            ).to_list(None)
+            pending_ids = [d["_id"] for d in pending]
+        if pending:
+            await self._incr_rollups(rollup_counts(pending))
+            await self.db.draw_history.update_many(
+                {"_id": {"$in": pending_ids}}, {"$unset": {"rollup_pending": ""}}
+            )
+        return inserted
+
+    async def flush_draws(self, records):
+        await self._insert_draws(records)
+        by_campaign: Dict[str, List[str]] = {}
+        for r in records:
+            by_campaign.setdefault(r["campaign"], []).append(r["username"])
+        # The flag lives only on pending claims so its sparse index stays tiny
+        await self.db.users.bulk_write([
+            UpdateMany(
+                {"campaign": campaign, "username": {"$in": usernames}, "history_pending": True},
+                {"$unset": {"history_pending": ""}},
+            )
+            for campaign, usernames in by_campaign.items()
+        ], ordered=False)
+
+    async def pending_draws(self, before):
+        # Rows written just before a crash but never unflagged come back too; flush_draws skips them
+        return await self.db.users.find(
+            {"history_pending": True, "used_at": {"$lt": before}},
+            {"_id": 0, "campaign": 1, "username": 1, "prize_label": 1, "used_at": 1},
+        ).to_list(None)
+
+    async def page_history(self, campaign, limit, after=None):
+        return await self._page(self.db.draw_history, {"campaign": campaign}, "drawn_at", limit, after, self.DRAW_FIELDS)
+
+    def iter_history(self, campaign, batch_size, archived=False):
+        collection = self.db.draw_history_archive if archived else self.db.draw_history
+        return self._iter(collection, {"campaign": campaign}, "drawn_at", batch_size, self.DRAW_FIELDS)
+
+    async def archive_draws(self, campaign, before, batch_size):
+        docs = await self.db.draw_history.find({"campaign": campaign, "drawn_at": {"$lt": before}}).sort(
+            [("drawn_at", ASCENDING), ("_id", ASCENDING)]
+        ).limit(batch_size).to_list(batch_size)
+        if not docs:
+            return 0
+        # Copy then delete, keeping _id; rows left over from an interrupted run are already archived
+        try:
+            await self.db.draw_history_archive.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+        await self.db.draw_history.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+        return len(docs)
+
+    # draw rollups: one {_id: "<campaign>:<period>:<start>:<label>", ...} document per bucket
+    async def _incr_rollups(self, counts):
+        if counts:
+            await self.db.draw_rollups.bulk_write([
+                UpdateOne(
+                    {"_id": f"{campaign}:{period}:{start}:{label}"},
+                    {"$inc": {"count": n},
+                     "$setOnInsert": {"campaign": campaign, "period": period, "start": start, "label": label}},
+                    upsert=True,
+                )
+                for (campaign, period, start, label), n in counts.items()
+            ], ordered=False)
+
+    async def rollups(self, campaign, period, since=None):
+        query = {"campaign": campaign, "period": period}
+        if since:
+            query["start"] = {"$gte": since}
+        return await self.db.draw_rollups.find(
+            query, {"_id": 0, "start": 1, "label": 1, "count": 1}
+        ).sort("start", ASCENDING).to_list(None)
+
+    async def prune_rollups(self, campaign, period, before):
+        await self.db.draw_rollups.delete_many({"campaign": campaign, "period": period, "start": {"$lt": before}})
+
+    # stats counters: one "<campaign>:totals" document plus one "<campaign>:prize:<label>" document per prize
+    @staticmethod
+    def _totals_id(campaign: str) -> str:
+        return f"{campaign}:totals"
+
+    async def incr_code_stats(self, campaign, count):
+        await self.db.stats.update_one(
+            {"_id": self._totals_id(campaign)},
+            {"$inc": {"total_codes": count}, "$set": {"campaign": campaign}},
+            upsert=True,
+        )
+
+    async def incr_draw_stats(self, campaign, counts):
+        total = sum(counts.values())
+        await self.db.stats.bulk_write([
+            UpdateOne(
+                {"_id": self._totals_id(campaign)},
+                {"$inc": {"used_codes": total, "total_draws": total}, "$set": {"campaign": campaign}},
+                upsert=True,
+            ),
+            *(
+                UpdateOne(
+                    {"_id": f"{campaign}:prize:{label}"},
+                    {"$inc": {"count": n}, "$set": {"campaign": campaign, "label": label}},
+                    upsert=True,
+                )
+                for label, n in counts.items()
+            ),
+        ], ordered=False)
+
+    async def read_stats(self, campaign):
+        docs = await self.db.stats.find({"campaign": campaign}).to_list(None)
+        totals = next((d for d in docs if d["_id"] == self._totals_id(campaign)), None)
+        if totals is None:
+            return None
+        return {
+            "total_codes": totals.get("total_codes", 0),
+            "used_codes": totals.get("used_codes", 0),
+            "total_draws": totals.get("total_draws", 0),
+            "prize_counts": {d["label"]: d["count"] for d in docs if "label" in d},
+        }
+
+    async def reconcile_stats(self, campaign):
+        total_codes = await self.db.users.count_documents({"campaign": campaign})
+        used_codes = await self.db.users.count_documents({"campaign": campaign, "is_used": True})
+        pipeline = [
+            {"$match": {"campaign": campaign, "period": "day"}},
+            {"$group": {"_id": "$label", "count": {"$sum": "$count"}}},
+        ]
+        distribution = await self.db.draw_rollups.aggregate(pipeline).to_list(None)
+        total_draws = sum(d["count"] for d in distribution)
+
+        totals_id = self._totals_id(campaign)
+        ops = [UpdateOne(
+            {"_id": totals_id},
+            {"$set": {"campaign": campaign, "total_codes": total_codes, "used_codes": used_codes,
+                      "total_draws": total_draws}},
+            upsert=True,
+        )]
+        ops += [
+            UpdateOne(
+                {"_id": f"{campaign}:prize:{d['_id']}"},
+                {"$set": {"campaign": campaign, "label": d["_id"], "count": d["count"]}},
+                upsert=True,
+            )
+            for d in distribution
+        ]
+        await self.db.stats.bulk_write(ops, ordered=False)
+        await self.db.stats.delete_many({
+            "campaign": campaign,
+            "_id": {"$nin": [totals_id] + [f"{campaign}:prize:{d['_id']}" for d in distribution]},
+        })
+        return await self.read_stats(campaign)
+
+    # cross-worker change versions: a single small document in "meta"
+    async def bump_version(self, name):
+        doc = await self.db.meta.find_one_and_update(
+            {"_id": self.VERSIONS_ID}, {"$inc": {name: 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc[name]
+
+    async def read_versions(self):
+        doc = await self.db.meta.find_one({"_id": self.VERSIONS_ID}) or {}
+        return {k: v for k, v in doc.items() if k != "_id"}
+
+    async def watch_versions(self):
+        # Change streams need a replica set or sharded cluster; standalone servers raise here
+        pipeline = [{"$match": {"documentKey._id": self.VERSIONS_ID}}]
+        async with self.db.meta.watch(pipeline, full_document="updateLookup") as stream:
+            async for change in stream:
+                doc = change.get("fullDocument") or {}
+                yield {k: v for k, v in doc.items() if k != "_id"}
+
+
+# --- SQLite ---
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS admins (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL,
+    role TEXT NOT NULL,
+    created_at TEXT,
+    token_version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign TEXT NOT NULL,
+    username TEXT NOT NULL,
+    redeem_code TEXT NOT NULL,
+    is_used INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT NOT NULL,
+    used_at TEXT,
+    prize_label TEXT,
+    history_pending INTEGER NOT NULL DEFAULT 0,
+    idempotency_key TEXT,
+    UNIQUE (campaign, username),
+    UNIQUE (campaign, redeem_code)
+);
+CREATE INDEX IF NOT EXISTS users_created ON users (campaign, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS users_used_created ON users (campaign, is_used, created_at DESC, id DESC);
+CREATE TABLE IF NOT EXISTS campaigns (
+    campaign TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS prizes (
+    campaign TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (campaign, position)
+);
+CREATE TABLE IF NOT EXISTS draw_history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    campaign TEXT NOT NULL,
+    username TEXT NOT NULL,
+    prize_label TEXT NOT NULL,
+    prize_image_url TEXT NOT NULL DEFAULT '',
+    prize_color TEXT NOT NULL DEFAULT '',
+    drawn_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS draw_history_drawn ON draw_history (campaign, drawn_at DESC, id DESC);
+CREATE TABLE IF NOT EXISTS draw_history_archive (
+    id INTEGER PRIMARY KEY,
+    campaign TEXT NOT NULL,
+    username TEXT NOT NULL,
+    prize_label TEXT NOT NULL,
+    prize_image_url TEXT NOT NULL DEFAULT '',
+    prize_color TEXT NOT NULL DEFAULT '',
+    drawn_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS draw_history_archive_drawn ON draw_history_archive (campaign, drawn_at DESC, id DESC);
+CREATE TABLE IF NOT EXISTS draw_rollups (
+    campaign TEXT NOT NULL,
+    period TEXT NOT NULL,
+    start TEXT NOT NULL,
+    label TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (campaign, period, start, label)
+);
+CREATE TABLE IF NOT EXISTS prize_stock (
+    campaign TEXT NOT NULL,
+    label TEXT NOT NULL,
+    stripe INTEGER NOT NULL,
+    remaining INTEGER NOT NULL,
+    PRIMARY KEY (campaign, label, stripe)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS stats (
+    campaign TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (campaign, key)
+);
+"""
+
+# Columns added after the first release, for databases created before them
+SQLITE_ADDED_COLUMNS = [
+    ("users", "history_pending", "INTEGER NOT NULL DEFAULT 0"),
+    ("admins", "token_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "idempotency_key", "TEXT"),
+]
+SQLITE_POST_MIGRATION = """
+CREATE INDEX IF NOT EXISTS users_history_pending ON users (history_pending) WHERE history_pending = 1;
+CREATE UNIQUE INDEX IF NOT EXISTS users_idempotency_key ON users (campaign, idempotency_key)
+    WHERE idempotency_key IS NOT NULL;
+"""
+# Tables whose keys gained the campaign column; pre-campaign databases rebuild them once
+SQLITE_CAMPAIGN_TABLES = (
+    "users", "prizes", "draw_history", "draw_history_archive", "draw_rollups", "prize_stock", "stats",
+)
+
+USER_COLUMNS = ("campaign", "username", "redeem_code", "is_used", "created_at", "used_at", "prize_label")
+DRAW_COLUMNS = ("campaign", "username", "prize_label", "prize_image_url", "prize_color", "drawn_at")
+
+
+class SQLiteStorage(Storage):
+    """Embedded engine on the stdlib sqlite3 module.
+
+    The connection lives on a single dedicated thread, so every call is
+    serialized there and the event loop never blocks on disk I/O. Use
+    path ":memory:" for a throwaway in-memory database.
+    """
+
+    name = "sqlite"
+
+    # SQL for every hot query, checked with EXPLAIN QUERY PLAN
+    HOT_QUERIES = [
+        ("SELECT * FROM admins WHERE username = ?", ("u",)),
+        ("SELECT doc FROM prizes WHERE campaign = ? ORDER BY position", ("c",)),
+        ("SELECT id FROM users WHERE campaign = ? AND username = ? AND redeem_code = ? AND is_used = 0",
+         ("c", "u", "C")),
+        ("SELECT username FROM users WHERE campaign = ? AND username IN (?)", ("c", "u")),
+        ("SELECT * FROM users WHERE campaign = ? ORDER BY created_at DESC, id DESC LIMIT 1", ("c",)),
+        ("SELECT * FROM users WHERE campaign = ? AND is_used = ? ORDER BY created_at DESC, id DESC LIMIT 1",
+         ("c", 1)),
+        ("SELECT * FROM draw_history WHERE campaign = ? ORDER BY drawn_at DESC, id DESC LIMIT 1", ("c",)),
+        ("SELECT id FROM draw_history WHERE campaign = ? AND drawn_at < ? ORDER BY drawn_at, id LIMIT 1", ("c", "t")),
+        ("SELECT start, label, count FROM draw_rollups WHERE campaign = ? AND period = ? AND start >= ? "
+         "ORDER BY start", ("c", "day", "t")),
+        ("SELECT stripe, remaining FROM prize_stock WHERE campaign = ? AND label = ? AND remaining > 0", ("c", "p")),
+        ("SELECT key, value FROM stats WHERE campaign = ?", ("c",)),
+        ("SELECT campaign, username, prize_label, used_at FROM users WHERE history_pending = 1 AND used_at < ?",
+         ("t",)),
+        ("SELECT username, redeem_code, prize_label, used_at FROM users "
+         "WHERE campaign = ? AND idempotency_key = ?", ("c", "k")),
+    ]
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _tx(self, func, *args):
+        """Run func(conn, *args) inside an immediate transaction (on the sqlite thread)."""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _query(self, sql: str, params: Iterable = ()) -> List[sqlite3.Row]:
+        return self._conn.execute(sql, tuple(params)).fetchall()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        if self.path != ":memory:":
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        self._create_schema(conn)
+        for table, column, ddl in SQLITE_ADDED_COLUMNS:
+            if column not in {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+        conn.executescript(SQLITE_POST_MIGRATION)
+        self._add_draw_claim_index(conn)
+        if not conn.execute("SELECT 1 FROM draw_rollups LIMIT 1").fetchone():
+            self._backfill_rollups(conn)
+        if not conn.execute("SELECT 1 FROM campaigns LIMIT 1").fetchone():
+            self._backfill_campaigns(conn)
+        self._conn = conn
+
+    @staticmethod
+    def _create_schema(conn):
+        """Create the tables, rebuilding pre-campaign ones with their rows given to DEFAULT_CAMPAIGN.
+
+        Runs as one transaction, so an interrupted rebuild leaves the old tables in place.
+        """
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            legacy = []
+            for table in SQLITE_CAMPAIGN_TABLES:
+                columns = [r["name"] for r in conn.execute(f"PRAGMA table_info({table})")]
+                if columns and "campaign" not in columns:
+                    conn.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+                    # Indexes follow a renamed table but keep their names, which the new schema reuses
+                    indexes = conn.execute(
+                        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                        (f"legacy_{table}",),
+                    ).fetchall()
+                    for (index,) in indexes:
+                        conn.execute(f"DROP INDEX {index}")
+                    legacy.append((table, ", ".join(columns)))
+            for statement in SQLITE_SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            for table, columns in legacy:
+                conn.execute(
+                    f"INSERT INTO {table} (campaign, {columns}) SELECT ?, {columns} FROM legacy_{table}",
+                    (DEFAULT_CAMPAIGN,),
+                )
+                conn.execute(f"DROP TABLE legacy_{table}")
+                logger.info(f"Adopted pre-campaign {table} rows into campaign {DEFAULT_CAMPAIGN!r}")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @classmethod
+    def _add_draw_claim_index(cls, conn):
+        """Make draw_history unique per claim, dropping duplicate rows that retried or raced flushes wrote."""
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'draw_history_claim'").fetchone():
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = conn.execute(
+                "DELETE FROM draw_history WHERE id NOT IN "
+                "(SELECT MIN(id) FROM draw_history GROUP BY campaign, username)"
+            ).rowcount
+            conn.execute("CREATE UNIQUE INDEX draw_history_claim ON draw_history (campaign, username)")
+            if removed:
+                # The duplicates were counted too; rebuild rather than patch
+                conn.execute("DELETE FROM draw_rollups")
+                cls._backfill_rollups(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        if removed:
+            logger.warning(f"Removed {removed} duplicate draw_history rows and rebuilt the rollups")
+
+    @staticmethod
+    def _backfill_campaigns(conn):
+        """One-off registration of campaigns that predate the registry, found by their prizes and codes."""
+        found = conn.execute(
+            "INSERT OR IGNORE INTO campaigns (campaign, created_at) "
+            "SELECT campaign, ? FROM prizes UNION SELECT campaign, ? FROM users",
+            (datetime.now(timezone.utc).isoformat(),) * 2,
+        ).rowcount
+        if found:
+            logger.info(f"Registered {found} existing campaign(s)")
+
+    @staticmethod
+    def _backfill_rollups(conn):
+        """One-off build of the rollups for history written before they existed."""
+        for period, (width, suffix) in ROLLUP_PERIODS.items():
+            conn.execute(
+                "INSERT INTO draw_rollups (campaign, period, start, label, count) "
+                f"SELECT campaign, ?, substr(drawn_at, 1, {width}) || ?, prize_label, COUNT(*) FROM ("
+                "SELECT campaign, drawn_at, prize_label FROM draw_history "
+                "UNION ALL SELECT campaign, drawn_at, prize_label FROM draw_history_archive"
+                ") GROUP BY 1, 3, 4",
+                (period, suffix),
+            )
+
+    async def init(self):
+        if self._conn is None:
+            await self._run(self._open)
+        logger.info(f"Opened SQLite storage at {self.path}")
+
+    def _explain_all(self) -> List[str]:
+        failures = []
+        for sql, params in self.HOT_QUERIES:
+            details = [row["detail"] for row in self._query("EXPLAIN QUERY PLAN " + sql, params)]
+            for detail in details:
+                full_scan = detail.startswith("SCAN") and "USING" not in detail
+                if full_scan or "TEMP B-TREE" in detail:
+                    failures.append(f"{sql} -> {detail}")
+        return failures
+
+    async def verify_query_plans(self):
+        failures = await self._run(self._explain_all)
+        if failures:
+            raise RuntimeError("Queries without index support: " + "; ".join(failures))
+        logger.info(f"Verified query plans for {len(self.HOT_QUERIES)} hot queries")
+
+    async def close(self):
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def _user(row: sqlite3.Row, with_id: bool = False) -> dict:
+        doc = {k: row[k] for k in USER_COLUMNS if row[k] is not None}
+        doc["is_used"] = bool(doc["is_used"])
+        if with_id:
+            doc["_id"] = str(row["id"])
+        return doc
+
+    @staticmethod
+    def _draw(row: sqlite3.Row, with_id: bool = False) -> dict:
+        doc = {k: row[k] for k in DRAW_COLUMNS}
+        if with_id:
+            doc["_id"] = str(row["id"])
+        return doc
+
+    # admins
+    async def get_admin(self, username):
+        rows = await self._run(self._query, "SELECT * FROM admins WHERE username = ?", (username,))
+        return dict(rows[0]) if rows else None
+
+    async def insert_admin(self, doc):
+        def insert():
+            try:
+                self._conn.execute(
+                    "INSERT INTO admins (username, password_hash, role, created_at, token_version) VALUES (?, ?, ?, ?, ?)",
+                    (doc["username"], doc["password_hash"], doc["role"], doc.get("created_at"),
+                     doc.get("token_version", first_token_version())),
+                )
+            except sqlite3.IntegrityError:
+                return False
+            return True
+        return await self._run(insert)
+
+    async def list_admins(self):
+        rows = await self._run(self._query, "SELECT username, role, created_at FROM admins LIMIT 100")
+        return [dict(r) for r in rows]
+
+    async def delete_admin(self, username):
+        def delete():
+            return self._conn.execute(
+                "DELETE FROM admins WHERE username = ? AND role = 'admin'", (username,)
+            ).rowcount > 0
+        return await self._run(delete)
+
+    async def set_admin_password(self, username, password_hash, expected_hash=None, revoke_tokens=False):
+        def update():
+            bump = ", token_version = token_version + 1" if revoke_tokens else ""
+            sql, params = f"UPDATE admins SET password_hash = ?{bump} WHERE username = ?", [password_hash, username]
+            if expected_hash is not None:
+                sql += " AND password_hash = ?"
+                params.append(expected_hash)
+            return self._conn.execute(sql, params).rowcount > 0
+        return await self._run(update)
+
+    async def token_versions(self):
+        rows = await self._run(self._query, "SELECT username, token_version FROM admins")
+        return {r["username"]: r["token_version"] for r in rows}
+
+    # campaigns
+    async def list_campaigns(self):
+        rows = await self._run(self._query, "SELECT campaign FROM campaigns ORDER BY campaign")
+        return [r["campaign"] for r in rows]
+
+    # prizes
+
+    async def list_prizes(self, campaign):
+        rows = await self._run(
+            self._query, "SELECT doc FROM prizes WHERE campaign = ? ORDER BY position LIMIT 100", (campaign,)
+        )
+        return [json.loads(r["doc"]) for r in rows]
+
+    def _write_prizes(self, conn, campaign, prizes):
+        conn.execute("DELETE FROM prizes WHERE campaign = ?", (campaign,))
+        conn.executemany(
+            "INSERT INTO prizes (campaign, position, doc) VALUES (?, ?, ?)",
+            [(campaign, i, json.dumps({k: v for k, v in p.items() if k != "_id"})) for i, p in enumerate(prizes)],
+        )
+
+    async def replace_prizes(self, campaign, prizes):
+        await self._run(self._tx, self._write_prizes, campaign, prizes)
+
+    async def seed_campaigns(self, pools):
+        def seed(conn):
+            marks = ", ".join("?" * len(pools))
+            registered = {r["campaign"] for r in conn.execute(
+                f"SELECT campaign FROM campaigns WHERE campaign IN ({marks})", list(pools)
+            )}
+            new = [campaign for campaign in pools if campaign not in registered]
+            existing = {r["campaign"] for r in conn.execute(
+                f"SELECT DISTINCT campaign FROM prizes WHERE campaign IN ({marks})", list(pools)
+            )}
+            now = datetime.now(timezone.utc).isoformat()
+            conn.executemany("INSERT INTO campaigns (campaign, created_at) VALUES (?, ?)", [(c, now) for c in new])
+            conn.executemany(
+                "INSERT INTO prizes (campaign, position, doc) VALUES (?, ?, ?)",
+                [(campaign, i, json.dumps(p))
+                 for campaign in new if campaign not in existing for i, p in enumerate(pools[campaign])],
+            )
+            return sorted(new)
+        if not pools:
+            return []
+        return await self._run(self._tx, seed)
+
+    # prize stock: SQLite serializes writers anyway, but the stripes keep the
+    # stored layout identical to the Mongo engine
+    async def reset_stock(self, campaign, remaining, keep=()):
+        def reset(conn):
+            kept = list(keep)
+            conn.execute(
+                f"DELETE FROM prize_stock WHERE campaign = ? AND label NOT IN ({', '.join('?' * len(kept))})",
+                [campaign, *kept],
+            )
+            conn.executemany(
+                "INSERT INTO prize_stock (campaign, label, stripe, remaining) VALUES (?, ?, ?, ?)",
+                [(campaign, label, i, units)
+                 for label, total in remaining.items() for i, units in enumerate(split_stock(total))],
+            )
+        await self._run(self._tx, reset)
+
+    async def take_stock(self, campaign, label, count):
+        def take(conn):
+            granted = 0
+            rows = conn.execute(
+                "SELECT stripe, remaining FROM prize_stock WHERE campaign = ? AND label = ? AND remaining > 0",
+                (campaign, label),
+            ).fetchall()
+            for row in rows:
+                units = min(count - granted, row["remaining"])
+                conn.execute(
+                    "UPDATE prize_stock SET remaining = remaining - ? WHERE campaign = ? AND label = ? AND stripe = ?",
+                    (units, campaign, label, row["stripe"]),
+                )
+                granted += units
+                if granted == count:
+                    break
+            return granted
+        return await self._run(self._tx, take)
+
+    async def release_stock(self, campaign, label, count):
+        def release(conn):
+            conn.execute(
+                "UPDATE prize_stock SET remaining = remaining + ? WHERE campaign = ? AND label = ? AND stripe = "
+                "(SELECT stripe FROM prize_stock WHERE campaign = ? AND label = ? ORDER BY remaining LIMIT 1)",
+                (count, campaign, label, campaign, label),
+            )
+        await self._run(self._tx, release)
+
+    async def stock_remaining(self, campaign):
+        rows = await self._run(
+            self._query,
+            "SELECT label, SUM(remaining) AS remaining FROM prize_stock WHERE campaign = ? GROUP BY label",
+            (campaign,),
+        )
+        return {r["label"]: r["remaining"] for r in rows}
+
+    # users / redeem codes
+    async def existing_usernames(self, campaign, usernames):
+        def lookup():
+            found = set()
+            # Stay well under SQLite's bound-parameter limit
+            for i in range(0, len(usernames), 500):
+                chunk = usernames[i:i + 500]
+                rows = self._query(
+                    f"SELECT username FROM users WHERE campaign = ? AND username IN ({','.join('?' * len(chunk))})",
+                    [campaign, *chunk],
+                )
+                found.update(r["username"] for r in rows)
+            return found
+        return await self._run(lookup)
+
+    async def insert_codes(self, campaign, docs):
+        def insert(conn):
+            inserted, collided = [], []
+            for doc in docs:
+                try:
+                    conn.execute(
+                        "INSERT INTO users (campaign, username, redeem_code, is_used, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (campaign, doc["username"], doc["redeem_code"], int(doc.get("is_used", False)),
+                         doc["created_at"]),
+                    )
+                except sqlite3.IntegrityError as e:
+                    if "redeem_code" in str(e):
+                        collided.append(doc["username"])
+                    continue
+                inserted.append({**doc, "campaign": campaign})
+            return inserted, collided
+        return await self._run(self._tx, insert)
+
+    async def claim_code(self, campaign, username, redeem_code, used_at, prize_label, idempotency_key=None):
+        def claim():
+            try:
+                return self._conn.execute(
+                    "UPDATE users SET is_used = 1, used_at = ?, prize_label = ?, history_pending = 1, "
+                    "idempotency_key = ? WHERE campaign = ? AND username = ? AND redeem_code = ? AND is_used = 0",
+                    (used_at, prize_label, idempotency_key, campaign, username, redeem_code),
+                ).rowcount > 0
+            except sqlite3.IntegrityError:
+                return False
+        return await self._run(claim)
+
+    async def find_code(self, campaign, username, redeem_code):
+        rows = await self._run(
+            self._query, "SELECT * FROM users WHERE campaign = ? AND username = ? AND redeem_code = ?",
+            (campaign, username, redeem_code),
+        )
+        return self._user(rows[0]) if rows else None
+
+    async def find_claim(self, campaign, idempotency_key):
+        rows = await self._run(
+            self._query,
+            "SELECT username, redeem_code, prize_label, used_at FROM users WHERE campaign = ? AND idempotency_key = ?",
+            (campaign, idempotency_key),
+        )
+        return dict(rows[0]) if rows else None
+
+    async def claim_batch(self, campaign, pairs, labels, used_at, batch_id):
+        limit = len(labels)
+
+        def claim(conn):
+            if pairs is not None:
+                rows = []
+                for username, code in pairs[:limit]:
+                    rows += conn.execute(
+                        "SELECT id, username, redeem_code FROM users "
+                        "WHERE campaign = ? AND username = ? AND redeem_code = ? AND is_used = 0",
+                        (campaign, username, code),
+                    ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT id, username, redeem_code FROM users WHERE campaign = ? AND is_used = 0 LIMIT ?",
+                    (campaign, limit),
+                ).fetchall()
+            # The immediate transaction holds the write lock, so every candidate is ours
+            conn.executemany(
+                "UPDATE users SET is_used = 1, used_at = ?, prize_label = ?, history_pending = 1 WHERE id = ?",
+                [(used_at, label, r["id"]) for r, label in zip(rows, labels)],
+            )
+            return [{"username": r["username"], "redeem_code": r["redeem_code"], "prize_label": label}
+                    for r, label in zip(rows, labels)]
+        return await self._run(self._tx, claim)
+
+    def _page_sql(self, table: str, field: str, where: List[str], params: list, limit: int, after: Cursor):
+        if after:
+            key, row_id = after[0], int(after[1])
+            where = where + [f"({field} < ? OR ({field} = ? AND id < ?))"]
+            params = params + [key, key, row_id]
+        sql = f"SELECT * FROM {table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY {field} DESC, id DESC LIMIT ?"
+        return self._query(sql, params + [limit])
+
+    @staticmethod
+    def _codes_where(campaign: str, is_used: Optional[bool]):
+        if is_used is None:
+            return ["campaign = ?"], [campaign]
+        return ["campaign = ?", "is_used = ?"], [campaign, int(is_used)]
+
+    async def page_codes(self, campaign, is_used, limit, after=None):
+        where, params = self._codes_where(campaign, is_used)
+        rows = await self._run(self._page_sql, "users", "created_at", where, params, limit, after)
+        return [self._user(r, with_id=True) for r in rows]
+
+    async def _iter(self, table: str, field: str, where, params, convert, batch_size: int):
+        after = None
+        while True:
+            rows = await self._run(self._page_sql, table, field, where, params, batch_size, after)
+            if not rows:
+                return
+            yield [convert(r) for r in rows]
+            if len(rows) < batch_size:
+                return
+            after = (rows[-1][field], str(rows[-1]["id"]))
+
+    def iter_codes(self, campaign, is_used, batch_size):
+        where, params = self._codes_where(campaign, is_used)
+        return self._iter("users", "created_at", where, params, self._user, batch_size)
+
+    # draw history: unique per claim (campaign, username), so rewriting a row is ignored
+    @staticmethod
+    def _insert_draws(conn, records):
+        sql = (f"INSERT OR IGNORE INTO draw_history ({', '.join(DRAW_COLUMNS)}) "
+               f"VALUES ({', '.join('?' * len(DRAW_COLUMNS))})")
+        inserted = [r for r in records if conn.execute(sql, tuple(r.get(k, "") for k in DRAW_COLUMNS)).rowcount]
+        conn.executemany(
+            "INSERT INTO draw_rollups (campaign, period, start, label, count) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(campaign, period, start, label) DO UPDATE SET count = count + excluded.count",
+            [(*key, n) for key, n in rollup_counts(inserted).items()],
+        )
+
+    async def flush_draws(self, records):
+        # Rows and flags change in one transaction, so recovery never duplicates a draw
+        def flush(conn):
+            self._insert_draws(conn, records)
+            conn.executemany(
+                "UPDATE users SET history_pending = 0 WHERE campaign = ? AND username = ? AND history_pending = 1",
+                [(r["campaign"], r["username"]) for r in records],
+            )
+        await self._run(self._tx, flush)
+
+    async def pending_draws(self, before):
+        rows = await self._run(
+            self._query,
+            "SELECT campaign, username, prize_label, used_at FROM users WHERE history_pending = 1 AND used_at < ?",
+            (before,),
+        )
+        return [dict(r) for r in rows]
+
+    async def page_history(self, campaign, limit, after=None):
+        rows = await self._run(self._page_sql, "draw_history", "drawn_at", ["campaign = ?"], [campaign], limit, after)
+        return [self._draw(r, with_id=True) for r in rows]
+
+    def iter_history(self, campaign, batch_size, archived=False):
+        table = "draw_history_archive" if archived else "draw_history"
+        return self._iter(table, "drawn_at", ["campaign = ?"], [campaign], self._draw, batch_size)
+
+    async def archive_draws(self, campaign, before, batch_size):
+        def move(conn):
+            ids = [r["id"] for r in conn.execute(
+                "SELECT id FROM draw_history WHERE campaign = ? AND drawn_at < ? ORDER BY drawn_at, id LIMIT ?",
+                (campaign, before, batch_size),
+            )]
+            if not ids:
+                return 0
+            marks = ",".join("?" * len(ids))
+            columns = ", ".join(("id",) + DRAW_COLUMNS)
+            conn.execute(
+                f"INSERT OR IGNORE INTO draw_history_archive ({columns}) "
+                f"SELECT {columns} FROM draw_history WHERE id IN ({marks})", ids
+            )
+            conn.execute(f"DELETE FROM draw_history WHERE id IN ({marks})", ids)
+            return len(ids)
+        return await self._run(self._tx, move)
+
+    # draw rollups
+    async def rollups(self, campaign, period, since=None):
+        sql = ("SELECT start, label, count FROM draw_rollups "
+               "WHERE campaign = ? AND period = ? AND start >= ? ORDER BY start")
+        rows = await self._run(self._query, sql, (campaign, period, since or ""))
+        return [dict(r) for r in rows]
+
+    async def prune_rollups(self, campaign, period, before):
+        def prune(conn):
+            conn.execute(
+                "DELETE FROM draw_rollups WHERE campaign = ? AND period = ? AND start < ?", (campaign, period, before)
+            )
+        await self._run(self._tx, prune)
+
+    # stats counters: totals plus one "prize:<label>" key per prize, per campaign
+    @staticmethod
+    def _incr(conn, campaign, items):
+        conn.executemany(
+            "INSERT INTO stats (campaign, key, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(campaign, key) DO UPDATE SET value = value + excluded.value",
+            [(campaign, key, value) for key, value in items],
+        )
+
+    async def incr_code_stats(self, campaign, count):
+        await self._run(self._tx, self._incr, campaign, [("total_codes", count)])
+
+    async def incr_draw_stats(self, campaign, counts):
+        total = sum(counts.values())
+        items = [("used_codes", total), ("total_draws", total)]
+        items += [(f"prize:{label}", n) for label, n in counts.items()]
+        await self._run(self._tx, self._incr, campaign, items)
+
+    async def read_stats(self, campaign):
+        rows = await self._run(self._query, "SELECT key, value FROM stats WHERE campaign = ?", (campaign,))
+        values = {r["key"]: r["value"] for r in rows}
+        if "total_codes" not in values:
+            return None
+        return {
+            "total_codes": values.get("total_codes", 0),
+            "used_codes": values.get("used_codes", 0),
+            "total_draws": values.get("total_draws", 0),
+            "prize_counts": {k[len("prize:"):]: v for k, v in values.items() if k.startswith("prize:")},
+        }
+
+    async def reconcile_stats(self, campaign):
+        def rebuild(conn):
+            total_codes, used_codes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(is_used), 0) FROM users WHERE campaign = ?", (campaign,)
+            ).fetchone()
+            distribution = conn.execute(
+                "SELECT label, SUM(count) FROM draw_rollups WHERE campaign = ? AND period = 'day' GROUP BY label",
+                (campaign,),
+            ).fetchall()
+            total_draws = sum(count for _, count in distribution)
+            conn.execute("DELETE FROM stats WHERE campaign = ?", (campaign,))
+            conn.executemany("INSERT INTO stats (campaign, key, value) VALUES (?, ?, ?)", [
+                (campaign, "total_codes", total_codes), (campaign, "used_codes", used_codes),
+                (campaign, "total_draws", total_draws),
+                *((campaign, f"prize:{label}", count) for label, count in distribution),
+            ])
+        await self._run(self._tx, rebuild)
+        return await self.read_stats(campaign)
+
+    # cross-worker change versions: workers sharing a database file poll these
+    async def bump_version(self, name):
+        def bump(conn):
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, 1) ON CONFLICT(key) DO UPDATE SET value = value + 1",
+                (name,),
+            )
+            return conn.execute("SELECT value FROM meta WHERE key = ?", (name,)).fetchone()[0]
+        return await self._run(self._tx, bump)
+
+    async def read_versions(self):
+        rows = await self._run(self._query, "SELECT key, value FROM meta")
+        return {r["key"]: r["value"] for r in rows}
+
+
+def create_storage(**mongo_options) -> Storage:
+    """Build the engine selected by STORAGE_ENGINE (default: mongo)."""
+    engine = os.environ.get("STORAGE_ENGINE", "mongo").lower()
+    if engine == "memory":
+        return SQLiteStorage(":memory:")
+    if engine == "sqlite":
+        return SQLiteStorage(os.environ.get("SQLITE_PATH", "lucky_wheel.db"))
+    if engine != "mongo":
+        raise ValueError(f"Unknown STORAGE_ENGINE: {engine}")
+    mongo_url = os.environ.get("MONGO_URL")
+    if not mongo_url:
+        raise ValueError("MONGO_URL environment variable is required")
+    return MongoStorage(mongo_url, os.environ.get("DB_NAME", "naga1001"), **mongo_options)
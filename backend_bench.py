@@ -0,0 +1,320 @@
+"""Load-testing harness for the Lucky Wheel backend.
+
+Starts backend/server.py on a local port (against MONGO_URL, or the embedded
+in-memory storage engine with --in-memory), drives a traffic mix at a fixed
+concurrency and reports throughput plus p50/p95/p99 latency per route.
+Results are written to test_reports/benchmarks/ so runs can be compared
+across commits. Rate limiting is switched off in the spawned server unless
+RATE_LIMIT_ENABLED is set explicitly.
+
+    python backend_bench.py --mix public --concurrency 64 --duration 30
+    python backend_bench.py --in-memory --mix login-storm
+    python backend_bench.py --url http://localhost:8001 --mix admin
+    python backend_bench.py --in-memory --mix retry-storm --retries 20
+
+The retry-storm mix sends every spin --retries times with one Idempotency-Key
+and reports the writes it caused: draws recorded, replays served and, on
+Mongo, write commands. Writes should track codes spun, not requests sent.
+
+The login-storm mix runs spins in a pool of their own (--spin-concurrency),
+first alone as a baseline and then beside --concurrency workers logging in,
+and reports spin p99 for both runs: the gap is what the login burst costs.
+
+Requires httpx and uvicorn.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import httpx
+
+ROOT_DIR = Path(__file__).parent
+BACKEND_DIR = ROOT_DIR / "backend"
+REPORT_DIR = ROOT_DIR / "test_reports" / "benchmarks"
+
+MASTER_USER = os.environ.get("MASTER_ADMIN_USER", "master")
+MASTER_PASS = os.environ.get("MASTER_ADMIN_PASS", "dragonmaster2024!")
+
+# route name -> relative weight
+MIXES = {
+    "public": {"spin": 20, "history": 40, "prizes": 40},
+    "admin": {"stats": 30, "codes": 30, "admin_prizes": 20, "generate": 10, "history": 10},
+    "login-storm": {"spin": 1, "login": 1},  # fixed-size pools per route, see main_async
+    "full": {"spin": 15, "history": 35, "prizes": 35, "stats": 5, "codes": 5, "login": 5},
+    "retry-storm": {"spin_retry": 100},
+}
+
+MONGO_WRITE_COMMANDS = {"insert", "update", "delete", "findAndModify"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, in_memory: bool) -> subprocess.Popen:
+    env = dict(os.environ)
+    # Every simulated client shares one address, so the per-IP limits would dominate
+    env.setdefault("RATE_LIMIT_ENABLED", "false")
+    if in_memory:
+        env["STORAGE_ENGINE"] = "memory"
+    elif env.get("STORAGE_ENGINE", "mongo") == "mongo" and not env.get("MONGO_URL"):
+        sys.exit("MONGO_URL is required unless --in-memory or STORAGE_ENGINE=sqlite is used")
+    cmd = [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env)
+
+
+async def wait_ready(client: httpx.AsyncClient, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/readyz")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not become ready")
+
+
+def percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def metric_totals(text: str) -> dict:
+    """Sum the Prometheus samples this harness cares about."""
+    totals = {"replays": {}, "mongo_writes": 0}
+    for line in text.splitlines():
+        if line.startswith("lucky_wheel_spin_replays_total{"):
+            source = line.split('source="', 1)[1].split('"', 1)[0]
+            totals["replays"][source] = int(float(line.rsplit(" ", 1)[1]))
+        elif line.startswith("lucky_wheel_mongo_command_duration_seconds_count{"):
+            command = line.split('command="', 1)[1].split('"', 1)[0]
+            if command in MONGO_WRITE_COMMANDS:
+                totals["mongo_writes"] += int(float(line.rsplit(" ", 1)[1]))
+    return totals
+
+
+class Bench:
+    def __init__(self, client: httpx.AsyncClient, mix: dict, spin_codes: int, retries: int = 1):
+        self.client = client
+        self.routes = list(mix)
+        self.weights = list(mix.values())
+        self.spin_codes = spin_codes
+        self.retries = retries
+        self.retry_code = None
+        self.retry_left = 0
+        self.codes_spun = 0
+        self.token = None
+        self.codes = []
+        self.samples = {route: [] for route in mix}
+        self.statuses = {route: {} for route in mix}
+
+    async def setup(self):
+        res = await self.client.post("/api/admin/login", json={"username": MASTER_USER, "password": MASTER_PASS})
+        res.raise_for_status()
+        self.token = res.json()["token"]
+        if "spin" in self.routes or "spin_retry" in self.routes:
+            stamp = datetime.now().strftime("%H%M%S%f")
+            usernames = [f"bench_{stamp}_{i}" for i in range(self.spin_codes)]
+            res = await self.client.post(
+                "/api/admin/generate-codes", json={"usernames": usernames}, headers=self.auth, timeout=600
+            )
+            res.raise_for_status()
+            self.codes = res.json()["codes"]
+            random.shuffle(self.codes)
+
+    @property
+    def auth(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def next_code(self) -> dict:
+        self.codes_spun += 1
+        return self.codes.pop() if self.codes else {"username": "bench_missing", "redeem_code": "NOPE0000"}
+
+    def request(self, route: str):
+        if route == "spin":
+            return self.client.post("/api/spin", json=self.next_code())
+        if route == "spin_retry":
+            # Consecutive requests share a code, so its retries overlap across workers
+            if not self.retry_left:
+                self.retry_code, self.retry_left = self.next_code(), self.retries
+            self.retry_left -= 1
+            key = f"bench-{self.retry_code['username']}"
+            return self.client.post("/api/spin", json=self.retry_code, headers={"Idempotency-Key": key})
+        if route == "history":
+            return self.client.get("/api/history")
+        if route == "prizes":
+            return self.client.get("/api/prizes")
+        if route == "login":
+            return self.client.post("/api/admin/login", json={"username": MASTER_USER, "password": MASTER_PASS})
+        if route == "stats":
+            return self.client.get("/api/admin/stats", headers=self.auth)
+        if route == "codes":
+            return self.client.get("/api/admin/codes", params={"limit": 100}, headers=self.auth)
+        if route == "admin_prizes":
+            return self.client.get("/api/admin/prizes", headers=self.auth)
+        if route == "generate":
+            name = f"bench_gen_{random.getrandbits(64):x}"
+            return self.client.post("/api/admin/generate-codes", json={"usernames": [name]}, headers=self.auth)
+        raise ValueError(route)
+
+    def reset(self):
+        self.samples = {route: [] for route in self.routes}
+        self.statuses = {route: {} for route in self.routes}
+
+    async def worker(self, deadline: float, routes=None, weights=None):
+        routes, weights = routes or self.routes, weights or self.weights
+        while time.monotonic() < deadline:
+            route = random.choices(routes, weights=weights, k=1)[0]
+            started = time.perf_counter()
+            try:
+                status = (await self.request(route)).status_code
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            self.samples[route].append(time.perf_counter() - started)
+            self.statuses[route][str(status)] = self.statuses[route].get(str(status), 0) + 1
+
+    async def write_volume(self) -> dict:
+        stats = await self.client.get("/api/admin/stats", headers=self.auth)
+        stats.raise_for_status()
+        metrics = await self.client.get("/metrics")
+        metrics.raise_for_status()
+        return {"draws": stats.json()["total_draws"], **metric_totals(metrics.text)}
+
+    async def run(self, concurrency: int, duration: float) -> float:
+        started = time.monotonic()
+        await asyncio.gather(*[self.worker(started + duration) for _ in range(concurrency)])
+        return time.monotonic() - started
+
+    async def run_pools(self, pools: dict, duration: float) -> float:
+        """Run a fixed number of workers per route ({route: concurrency}) side by side."""
+        started = time.monotonic()
+        await asyncio.gather(*[
+            self.worker(started + duration, [route], [1]) for route, workers in pools.items() for _ in range(workers)
+        ])
+        return time.monotonic() - started
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route, samples in self.samples.items():
+            samples.sort()
+            routes[route] = {
+                "requests": len(samples),
+                "throughput_rps": round(len(samples) / elapsed, 1),
+                "p50_ms": round(percentile(samples, 50) * 1000, 2),
+                "p95_ms": round(percentile(samples, 95) * 1000, 2),
+                "p99_ms": round(percentile(samples, 99) * 1000, 2),
+                "statuses": self.statuses[route],
+            }
+        return routes
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def main_async(args) -> dict:
+    proc = None
+    base_url = args.url
+    if not base_url:
+        port = free_port()
+        proc = start_server(port, args.in_memory)
+        base_url = f"http://127.0.0.1:{port}"
+    connections = args.concurrency + (args.spin_concurrency if args.mix == "login-storm" else 0)
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    baseline = None
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=30, limits=limits) as client:
+            await wait_ready(client)
+            bench = Bench(client, MIXES[args.mix], args.spin_codes, args.retries)
+            await bench.setup()
+            before = await bench.write_volume()
+            if args.mix == "login-storm":
+                # Spins keep the same pool in both runs, so a change in their latency is the logins' doing
+                elapsed = await bench.run_pools({"spin": args.spin_concurrency}, args.duration)
+                baseline = {"spin": bench.report(elapsed)["spin"]}
+                bench.reset()
+                elapsed = await bench.run_pools({"spin": args.spin_concurrency, "login": args.concurrency}, args.duration)
+            else:
+                elapsed = await bench.run(args.concurrency, args.duration)
+            after = await bench.write_volume()
+            routes = bench.report(elapsed)
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait(timeout=10)
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "mix": args.mix,
+        "concurrency": args.concurrency,
+        "duration_s": round(elapsed, 2),
+        "backend": "external" if args.url else ("memory" if args.in_memory else os.environ.get("STORAGE_ENGINE", "mongo")),
+        "total_rps": round(sum(r["requests"] for r in routes.values()) / elapsed, 1),
+        "routes": routes,
+        **({"baseline": baseline} if baseline else {}),
+        "writes": {
+            "codes_spun": bench.codes_spun,
+            "draws": after["draws"] - before["draws"],
+            "replays": {k: v - before["replays"].get(k, 0) for k, v in after["replays"].items()},
+            "mongo_write_commands": after["mongo_writes"] - before["mongo_writes"],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mix", choices=sorted(MIXES), default="public")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--spin-concurrency", type=int, default=8, help="spin workers in the login-storm mix")
+    parser.add_argument("--spin-codes", type=int, default=5000, help="codes generated up front for spins")
+    parser.add_argument("--retries", type=int, default=10, help="requests per code in the retry-storm mix")
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--in-memory", action="store_true", help="run server.py on the in-memory storage engine")
+    parser.add_argument("--output", help="results file (default: test_reports/benchmarks/<commit>_<mix>_<time>.json)")
+    args = parser.parse_args()
+
+    result = asyncio.run(main_async(args))
+
+    print(f"\n📊 {result['mix']} mix @ {result['concurrency']} concurrent, {result['duration_s']}s, "
+          f"{result['total_rps']} req/s total")
+    print(f"{'route':<14}{'reqs':>8}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}  statuses")
+    for route, r in result["routes"].items():
+        print(f"{route:<14}{r['requests']:>8}{r['throughput_rps']:>10}{r['p50_ms']:>9}ms"
+              f"{r['p95_ms']:>8}ms{r['p99_ms']:>8}ms  {r['statuses']}")
+    if "baseline" in result:
+        print(f"spin p99: {result['baseline']['spin']['p99_ms']}ms alone, "
+              f"{result['routes']['spin']['p99_ms']}ms during the login storm "
+              f"({args.spin_concurrency} spin workers, {args.concurrency} login workers)")
+    writes = result["writes"]
+    print(f"writes: {writes['draws']} draws for {writes['codes_spun']} codes spun, "
+          f"replays {writes['replays']}, {writes['mongo_write_commands']} Mongo write commands")
+
+    output = Path(args.output) if args.output else REPORT_DIR / (
+        f"{result['commit']}_{result['mix']}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    print(f"\nSaved results to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""Multi-worker consistency check for the Lucky Wheel backend.
+
+Starts several copies of backend/server.py on their own ports against one
+shared database (a temporary SQLite file, or MONGO_URL with --mongo), as
+separate uvicorn workers would run behind a load balancer. It then proves
+that changes made through one worker reach every other one within a
+bounded delay:
+
+  * a prize pool update via PUT /api/admin/prizes shows up in every
+    worker's cached /api/prizes;
+  * a spin on one worker shows up in another worker's cached /api/history;
+  * deleting an admin on one worker revokes their token on every worker;
+  * a campaign created on one worker is served by every worker.
+
+    python backend_multiworker_test.py --workers 3 --max-delay 3
+    MONGO_URL=mongodb://localhost:27017/?replicaSet=rs0 python backend_multiworker_test.py --mongo
+
+Requires httpx and uvicorn.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from backend_bench import BACKEND_DIR, MASTER_PASS, MASTER_USER, free_port, wait_ready
+
+
+def start_worker(port: int, env: dict) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, env=env)
+
+
+async def wait_for(client: httpx.AsyncClient, path: str, predicate, timeout: float, headers=None) -> float:
+    """Poll a path until predicate(response) holds; returns the delay in seconds, or raises on timeout."""
+    started = time.monotonic()
+    while True:
+        res = await client.get(path, headers=headers)
+        if predicate(res):
+            return time.monotonic() - started
+        if time.monotonic() - started > timeout:
+            raise TimeoutError(f"{client.base_url}{path} not updated within {timeout}s")
+        await asyncio.sleep(0.05)
+
+
+async def run_checks(urls, max_delay: float) -> dict:
+    clients = [httpx.AsyncClient(base_url=url, timeout=30) for url in urls]
+    try:
+        for client in clients:
+            await wait_ready(client)
+        res = await clients[0].post("/api/admin/login", json={"username": MASTER_USER, "password": MASTER_PASS})
+        res.raise_for_status()
+        auth = {"Authorization": f"Bearer {res.json()['token']}"}
+
+        # Warm every worker's caches first so stale copies would actually be served
+        for client in clients:
+            (await client.get("/api/prizes")).raise_for_status()
+            (await client.get("/api/history")).raise_for_status()
+
+        stamp = datetime.now().strftime("%H%M%S%f")
+        prizes = (await clients[0].get("/api/admin/prizes", headers=auth)).json()["prizes"]
+        label = f"Multiworker {stamp}"
+        prizes[0]["label"] = label
+        (await clients[0].put("/api/admin/prizes", json={"prizes": prizes}, headers=auth)).raise_for_status()
+        prize_delays = await asyncio.gather(*[
+            wait_for(c, "/api/prizes", lambda res: any(p["label"] == label for p in res.json()["prizes"]), max_delay)
+            for c in clients
+        ])
+
+        username = f"multiworker_{stamp}"
+        res = await clients[-1].post("/api/admin/generate-codes", json={"usernames": [username]}, headers=auth)
+        res.raise_for_status()
+        code = res.json()["codes"][0]
+        (await clients[-1].post("/api/spin", json=code)).raise_for_status()
+        history_delays = await asyncio.gather(*[
+            wait_for(c, "/api/history", lambda res: any(d["username"] == username for d in res.json()["history"]),
+                     max_delay)
+            for c in clients
+        ])
+
+        admin = {"username": f"mw_admin_{stamp}", "password": "multiworker"}
+        (await clients[0].post("/api/admin/create-admin", json=admin, headers=auth)).raise_for_status()
+        res = await clients[-1].post("/api/admin/login", json=admin)
+        res.raise_for_status()
+        admin_auth = {"Authorization": f"Bearer {res.json()['token']}"}
+        for client in clients:
+            # Also warms each worker's principal cache with the token
+            await wait_for(client, "/api/admin/prizes", lambda res: res.status_code == 200, max_delay, admin_auth)
+        (await clients[0].delete(f"/api/admin/admins/{admin['username']}", headers=auth)).raise_for_status()
+        revoke_delays = await asyncio.gather(*[
+            wait_for(c, "/api/admin/prizes", lambda res: res.status_code == 401, max_delay, admin_auth)
+            for c in clients
+        ])
+
+        campaign = f"mw-{stamp}"
+        res = await clients[-1].post("/api/admin/campaigns", json={"campaign": campaign}, headers=auth)
+        res.raise_for_status()
+        campaign_delays = await asyncio.gather(*[
+            wait_for(c, f"/api/prizes?campaign={campaign}", lambda res: res.status_code == 200, max_delay)
+            for c in clients
+        ])
+        return {"prizes": prize_delays, "history": history_delays, "revocation": revoke_delays,
+                "campaign": campaign_delays}
+    finally:
+        for client in clients:
+            await client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--max-delay", type=float, default=3.0, help="seconds a change may take to reach every worker")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="VERSION_POLL_INTERVAL for the workers")
+    parser.add_argument("--mongo", action="store_true", help="share MONGO_URL instead of a temporary SQLite file")
+    args = parser.parse_args()
+
+    # Not WEB_CONCURRENCY: uvicorn would read it and fork that many workers per port
+    env = dict(os.environ, MULTI_WORKER="true", VERSION_POLL_INTERVAL=str(args.poll_interval),
+               RATE_LIMIT_ENABLED="false")
+    tmpdir = None
+    if args.mongo:
+        if not env.get("MONGO_URL"):
+            sys.exit("MONGO_URL is required with --mongo")
+        env["STORAGE_ENGINE"] = "mongo"
+    else:
+        tmpdir = tempfile.TemporaryDirectory()
+        env["STORAGE_ENGINE"] = "sqlite"
+        env["SQLITE_PATH"] = str(Path(tmpdir.name) / "multiworker.db")
+
+    ports = [free_port() for _ in range(args.workers)]
+    procs = []
+    try:
+        # The first worker seeds the database before the rest start
+        procs.append(start_worker(ports[0], env))
+        asyncio.run(wait_ready_url(f"http://127.0.0.1:{ports[0]}"))
+        procs += [start_worker(port, env) for port in ports[1:]]
+        result = asyncio.run(run_checks([f"http://127.0.0.1:{p}" for p in ports], args.max_delay))
+    except TimeoutError as e:
+        print(f"❌ {e}")
+        return 1
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if tmpdir:
+            tmpdir.cleanup()
+
+    for check, delays in result.items():
+        print(f"✅ {check} change reached {len(delays)} workers, slowest after {max(delays) * 1000:.0f}ms "
+              f"(limit {args.max_delay * 1000:.0f}ms)")
+    return 0
+
+
+async def wait_ready_url(url: str):
+    async with httpx.AsyncClient(base_url=url, timeout=30) as client:
+        await wait_ready(client)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import requests
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
 
@@ -133,7 +134,8 @@ class LuckyWheelAPITester:
 
     def test_generate_codes(self):
         """Test code generation"""
-        test_usernames = [f"test_user_{datetime.now().strftime('%H%M%S')}", "test_user_2"]
+        stamp = datetime.now().strftime('%H%M%S')
+        test_usernames = [f"test_user_{stamp}", f"test_user_{stamp}_2", f"test_user_{stamp}_3"]
         success, response = self.run_test(
             "Generate Codes",
             "POST",
@@ -160,6 +162,83 @@ class LuckyWheelAPITester:
             return True
         return False
 
+    def total_draws(self):
+        res = requests.get(
+            f"{self.base_url}/admin/stats", headers={"Authorization": f"Bearer {self.token}"}, timeout=30
+        )
+        res.raise_for_status()
+        return res.json()["total_draws"]
+
+    def test_concurrent_spin_single_winner(self, username, redeem_code, attempts=200):
+        """Fire many parallel spins at one code; exactly one prize may be won.
+
+        Duplicates that overlap the winning spin share its response, the rest
+        are rejected as used (400) or rate limited (429). Identical responses
+        alone don't prove a single claim, so the recorded draws must grow by
+        exactly one.
+        """
+        self.tests_run += 1
+        name = "Concurrent Spin - Single Winner"
+        print(f"\n🔍 Testing {name} ({attempts} parallel requests)...")
+        url = f"{self.base_url}/spin"
+        payload = {"username": username, "redeem_code": redeem_code}
+
+        def spin(_):
+            try:
+                res = requests.post(url, json=payload, timeout=30)
+                return res.status_code, res.text if res.status_code == 200 else None
+            except Exception:
+                return None, None
+
+        try:
+            draws_before = self.total_draws()
+            with ThreadPoolExecutor(max_workers=min(attempts, 64)) as pool:
+                results = list(pool.map(spin, range(attempts)))
+            new_draws = self.total_draws() - draws_before
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            self.results[name] = {"status": "ERROR", "error": str(e)}
+            return False
+        wins = [body for status, body in results if status == 200]
+        rejected = sum(1 for status, _ in results if status in (400, 429))
+        if wins and len(set(wins)) == 1 and len(wins) + rejected == attempts and new_draws == 1:
+            self.tests_passed += 1
+            print(f"✅ Passed - 1 draw recorded ({len(wins)} coalesced responses), {rejected} rejected")
+            self.results[name] = {"status": "PASSED", "response_code": 200}
+            return True
+        print(f"❌ Failed - {new_draws} draws recorded, {len(set(wins))} distinct wins, {rejected} rejected, "
+              f"{attempts - len(wins) - rejected} errors")
+        self.results[name] = {"status": "FAILED", "response_code": len(set(wins))}
+        return False
+
+    def test_idempotent_spin_retry(self, username, redeem_code, retries=5):
+        """Retries with the same Idempotency-Key replay the first prize instead of failing as used."""
+        self.tests_run += 1
+        name = "Spin Retry - Idempotency Key"
+        print(f"\n🔍 Testing {name} ({retries} retries)...")
+        headers = {"Idempotency-Key": f"test-{username}"}
+        payload = {"username": username, "redeem_code": redeem_code}
+        try:
+            responses = [
+                requests.post(f"{self.base_url}/spin", json=payload, headers=headers, timeout=30)
+                for _ in range(retries + 1)
+            ]
+        except Exception as e:
+            print(f"❌ Failed - Error: {str(e)}")
+            self.results[name] = {"status": "ERROR", "error": str(e)}
+            return False
+        statuses = [res.status_code for res in responses]
+        prizes = {json.dumps(res.json().get("prize"), sort_keys=True) for res in responses if res.status_code == 200}
+        replayed = sum(1 for res in responses[1:] if res.headers.get("Idempotent-Replayed") == "true")
+        if statuses == [200] * len(responses) and len(prizes) == 1 and replayed == retries:
+            self.tests_passed += 1
+            print(f"✅ Passed - {retries} retries replayed the original prize")
+            self.results[name] = {"status": "PASSED", "response_code": 200}
+            return True
+        print(f"❌ Failed - statuses {statuses}, {len(prizes)} distinct prizes, {replayed} replayed")
+        self.results[name] = {"status": "FAILED", "response_code": statuses[-1]}
+        return False
+
     def test_get_prizes(self):
         """Test getting prizes"""
         success, response = self.run_test(
@@ -221,6 +300,13 @@ def main():
         if generated_codes and len(generated_codes) > 0:
             code_data = generated_codes[0]
             tester.test_spin_wheel(code_data['username'], code_data['redeem_code'])
+        # Before the concurrent burst, which spends this client's spin rate limit
+        if generated_codes and len(generated_codes) > 2:
+            code_data = generated_codes[2]
+            tester.test_idempotent_spin_retry(code_data['username'], code_data['redeem_code'])
+        if generated_codes and len(generated_codes) > 1:
+            code_data = generated_codes[1]
+            tester.test_concurrent_spin_single_winner(code_data['username'], code_data['redeem_code'])
     
     # Test public endpoints (don't require auth)
     tester.test_get_prizes()
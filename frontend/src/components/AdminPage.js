@@ -10,6 +10,8 @@ import {
 } from "lucide-react";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+// Codes, prizes and stats belong to one campaign, picked with ?campaign= in the page URL
+const CAMPAIGN = new URLSearchParams(window.location.search).get("campaign") || "default";
 
 function AdminLogin({ onLogin }) {
   const [username, setUsername] = useState("");
@@ -109,7 +111,7 @@ function CodesTab({ token }) {
   const fetchCodes = useCallback(async () => {
     try {
       const params = filter !== "all" ? `?status=${filter}` : "";
-      const res = await axios.get(`${API}/admin/codes${params}`, { headers });
+      const res = await axios.get(`${API}/admin/codes${params}`, { headers, params: { campaign: CAMPAIGN } });
       setCodes(res.data.codes || []);
     } catch (err) {
       toast.error("Failed to fetch codes");
@@ -126,7 +128,7 @@ function CodesTab({ token }) {
     }
     setGenerating(true);
     try {
-      const res = await axios.post(`${API}/admin/generate-codes`, { usernames }, { headers });
+      const res = await axios.post(`${API}/admin/generate-codes`, { usernames }, { headers, params: { campaign: CAMPAIGN } });
       toast.success(res.data.message);
       setUsernamesText("");
       fetchCodes();
@@ -263,7 +265,7 @@ function PrizesTab({ token }) {
 
   const fetchPrizes = useCallback(async () => {
     try {
-      const res = await axios.get(`${API}/admin/prizes`, { headers });
+      const res = await axios.get(`${API}/admin/prizes`, { headers, params: { campaign: CAMPAIGN } });
       setPrizes(res.data.prizes || []);
     } catch (err) {
       toast.error("Failed to fetch prizes");
@@ -296,7 +298,7 @@ function PrizesTab({ token }) {
   const savePrizes = async () => {
     setSaving(true);
     try {
-      await axios.put(`${API}/admin/prizes`, { prizes }, { headers });
+      await axios.put(`${API}/admin/prizes`, { prizes }, { headers, params: { campaign: CAMPAIGN } });
       toast.success("Prize pool updated!");
       fetchPrizes();
     } catch (err) {
@@ -463,6 +465,27 @@ function PrizesTab({ token }) {
                   </span>
                 </div>
               </div>
+
+              {/* Row 4: Stock limit */}
+              <div className="flex items-center gap-3 mt-3" data-testid={`prize-stock-row-${i}`}>
+                <span className="text-xs font-bold text-[#D4A030]/50 uppercase tracking-wider font-['Cinzel'] w-20 shrink-0">
+                  Stock
+                </span>
+                <input
+                  type="number"
+                  min="0"
+                  value={prize.stock ?? ""}
+                  onChange={(e) => updatePrize(i, "stock", e.target.value === "" ? null : Math.max(0, parseInt(e.target.value) || 0))}
+                  className="dragon-input w-24 text-center text-sm py-1"
+                  placeholder="Unlimited"
+                  data-testid={`prize-stock-input-${i}`}
+                />
+                {prize.stock != null && prize.remaining != null && (
+                  <span className="text-xs text-[#D4A030]/60" data-testid={`prize-stock-remaining-${i}`}>
+                    {prize.remaining} left
+                  </span>
+                )}
+              </div>
             </motion.div>
           ))}
         </div>
@@ -478,7 +501,7 @@ function StatsTab({ token }) {
 
   const fetchStats = useCallback(async () => {
     try {
-      const res = await axios.get(`${API}/admin/stats`, { headers });
+      const res = await axios.get(`${API}/admin/stats`, { headers, params: { campaign: CAMPAIGN } });
       setStats(res.data);
     } catch (err) {
       toast.error("Failed to fetch stats");
@@ -707,7 +730,7 @@ function AdminsTab({ token }) {
 }
 
 
-function SettingsTab({ token }) {
+function SettingsTab({ token, onTokenChange }) {
   const [currentPassword, setCurrentPassword] = useState("");
   const [newPassword, setNewPassword] = useState("");
   const [confirmPassword, setConfirmPassword] = useState("");
@@ -730,10 +753,13 @@ function SettingsTab({ token }) {
     }
     setChanging(true);
     try {
-      await axios.post(`${API}/admin/change-password`, {
+      const res = await axios.post(`${API}/admin/change-password`, {
         current_password: currentPassword,
         new_password: newPassword
       }, { headers });
+      // Changing the password revokes existing sessions, this one included
+      localStorage.setItem("admin_token", res.data.token);
+      onTokenChange(res.data.token);
       toast.success("Password changed successfully!");
       setCurrentPassword("");
       setNewPassword("");
@@ -919,7 +945,7 @@ export default function AdminPage() {
             <TabsContent value="prizes"><PrizesTab token={token} /></TabsContent>
             <TabsContent value="stats"><StatsTab token={token} /></TabsContent>
             {isMaster && <TabsContent value="admins"><AdminsTab token={token} /></TabsContent>}
-            <TabsContent value="settings"><SettingsTab token={token} /></TabsContent>
+            <TabsContent value="settings"><SettingsTab token={token} onTokenChange={setToken} /></TabsContent>
           </Tabs>
         </div>
       </main>
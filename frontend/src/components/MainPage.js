@@ -10,6 +10,12 @@ import WinModal from "@/components/WinModal";
 import DragonSVG from "@/components/DragonSVG";
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+// Each branded wheel is its own campaign, picked with ?campaign= in the page URL
+const CAMPAIGN = new URLSearchParams(window.location.search).get("campaign") || "default";
+
+// One key per code: resubmitting the same code (after a timeout, say) gets the original prize back
+const newSpinKey = () =>
+  window.crypto?.randomUUID?.() || `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
 
 const LOGO_GIF = "https://customer-assets.emergentagent.com/job_fortune-wheel-hub/artifacts/0p68npsx_gif%20naga1001.gif";
 
@@ -20,10 +26,12 @@ export default function MainPage() {
   const [showWin, setShowWin] = useState(false);
   const [wonPrize, setWonPrize] = useState(null);
   const wheelRef = useRef(null);
+  const liveHistoryRef = useRef(false);
+  const spinKeysRef = useRef({});
 
   const fetchPrizes = useCallback(async () => {
     try {
-      const res = await axios.get(`${API}/prizes`);
+      const res = await axios.get(`${API}/prizes`, { params: { campaign: CAMPAIGN } });
       setPrizes(res.data.prizes || []);
     } catch (err) {
       console.error("Failed to fetch prizes:", err);
@@ -32,7 +40,7 @@ export default function MainPage() {
 
   const fetchHistory = useCallback(async () => {
     try {
-      const res = await axios.get(`${API}/history`);
+      const res = await axios.get(`${API}/history`, { params: { campaign: CAMPAIGN } });
       setHistory(res.data.history || []);
     } catch (err) {
       console.error("Failed to fetch history:", err);
@@ -41,13 +49,41 @@ export default function MainPage() {
 
   useEffect(() => {
     fetchPrizes();
-    fetchHistory();
+    if (typeof EventSource === "undefined") {
+      fetchHistory();
+      return;
+    }
+    // Live feed: a replay of recent draws on (re)connect, then each new draw
+    const source = new EventSource(`${API}/history/stream?campaign=${encodeURIComponent(CAMPAIGN)}`);
+    source.addEventListener("replay", (e) => {
+      liveHistoryRef.current = true;
+      setHistory(JSON.parse(e.data));
+    });
+    source.addEventListener("draw", (e) => {
+      const draw = JSON.parse(e.data);
+      setHistory((prev) => [draw, ...prev].slice(0, 50));
+    });
+    source.onerror = () => {
+      // Draws missed while the feed is down come back with the replay on reconnect;
+      // until then show the latest history instead of a stale list
+      liveHistoryRef.current = false;
+      fetchHistory();
+    };
+    return () => source.close();
   }, [fetchPrizes, fetchHistory]);
 
   const handleSpin = async (username, redeemCode) => {
     if (spinning) return;
+    const codeKey = `${username}\n${redeemCode}`;
+    const idempotencyKey = (spinKeysRef.current[codeKey] ||= newSpinKey());
+    const request = () => axios.post(
+      `${API}/spin`,
+      { username, redeem_code: redeemCode, campaign: CAMPAIGN },
+      { headers: { "Idempotency-Key": idempotencyKey } },
+    );
     try {
-      const res = await axios.post(`${API}/spin`, { username, redeem_code: redeemCode });
+      // A dropped connection may have lost the response, not the spin; retrying replays it
+      const res = await request().catch(err => (err.response ? Promise.reject(err) : request()));
       const prize = res.data.prize;
       const prizeIndex = prizes.findIndex(p => p.label === prize.label);
       const idx = prizeIndex >= 0 ? prizeIndex : 0;
@@ -65,7 +101,7 @@ export default function MainPage() {
   const handleSpinEnd = () => {
     if (wonPrize) {
       setShowWin(true);
-      fetchHistory();
+      if (!liveHistoryRef.current) fetchHistory();
     }
   };
 
@@ -0,0 +1,99 @@
+"""Shared fixtures: the backend on the in-memory engine, driven in-process over httpx.
+
+One app instance serves the whole session, so tests that touch the prize pool
+or the stats work in a campaign of their own (the ``campaign`` fixture).
+"""
+import os
+import sys
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+
+os.environ.update({
+    "STORAGE_ENGINE": "memory",
+    "JWT_SECRET": "test-secret-at-least-thirty-two-bytes",
+    "RATE_LIMIT_ENABLED": "false",
+    "PASSWORD_SCRYPT_N": "1024",  # logins are part of most tests; keep the KDF cheap
+    "STATS_RECONCILE_INTERVAL": "0",
+    "ARCHIVE_INTERVAL": "0",
+    "HISTORY_RECOVERY_INTERVAL": "0",
+})
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+MASTER_USER = "master"
+MASTER_PASS = "dragonmaster2024!"
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def app():
+    import server
+
+    async with server.app.router.lifespan_context(server.app):
+        yield server.app
+
+
+@pytest.fixture
+async def client(app):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as c:
+        yield c
+
+
+@pytest.fixture
+def login(client):
+    async def login_(username: str, password: str) -> dict:
+        r = await client.post("/api/admin/login", json={"username": username, "password": password})
+        assert r.status_code == 200, r.text
+        return {"Authorization": f"Bearer {r.json()['token']}"}
+    return login_
+
+
+@pytest.fixture
+async def admin(login):
+    """Auth headers of the master admin."""
+    return await login(MASTER_USER, MASTER_PASS)
+
+
+@pytest.fixture
+async def campaign(client, admin):
+    """A fresh campaign seeded with the default prize pool."""
+    campaign_id = f"t-{uuid.uuid4().hex[:12]}"
+    r = await client.post("/api/admin/campaigns", json={"campaign": campaign_id}, headers=admin)
+    assert r.status_code == 200, r.text
+    return campaign_id
+
+
+@pytest.fixture
+def make_codes(client, admin):
+    async def make(campaign_id: str, count: int) -> list:
+        usernames = [f"u-{uuid.uuid4().hex[:10]}" for _ in range(count)]
+        r = await client.post(
+            "/api/admin/generate-codes", params={"campaign": campaign_id},
+            json={"usernames": usernames}, headers=admin,
+        )
+        assert r.status_code == 200, r.text
+        return [{"username": c["username"], "redeem_code": c["redeem_code"]} for c in r.json()["codes"]]
+    return make
+
+
+@pytest.fixture
+def set_prizes(client, admin):
+    async def set_(campaign_id: str, prizes: list):
+        r = await client.put("/api/admin/prizes", params={"campaign": campaign_id}, json={"prizes": prizes}, headers=admin)
+        assert r.status_code == 200, r.text
+    return set_
+
+
+@pytest.fixture
+def total_draws(client, admin):
+    async def total(campaign_id: str) -> int:
+        r = await client.get("/api/admin/stats", params={"campaign": campaign_id}, headers=admin)
+        assert r.status_code == 200, r.text
+        return r.json()["total_draws"]
+    return total
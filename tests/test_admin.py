@@ -0,0 +1,86 @@
+"""Admin auth and listing: token revocation, keyset cursors and campaigns."""
+import uuid
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def regular_admin(client, admin):
+    username, password = f"a-{uuid.uuid4().hex[:10]}", "secret-pass"
+    r = await client.post("/api/admin/create-admin", json={"username": username, "password": password}, headers=admin)
+    assert r.status_code == 200, r.text
+    return username, password
+
+
+async def test_deleting_an_admin_revokes_their_token(client, admin, login, regular_admin):
+    username, password = regular_admin
+    headers = await login(username, password)
+    assert (await client.get("/api/admin/stats", headers=headers)).status_code == 200
+
+    assert (await client.delete(f"/api/admin/admins/{username}", headers=admin)).status_code == 200
+    assert (await client.get("/api/admin/stats", headers=headers)).status_code == 401
+
+
+async def test_changing_password_revokes_earlier_tokens(client, login, regular_admin):
+    username, password = regular_admin
+    old = await login(username, password)
+    other = await login(username, password)
+
+    r = await client.post(
+        "/api/admin/change-password", json={"current_password": password, "new_password": "new-secret"}, headers=old
+    )
+    assert r.status_code == 200
+    new = {"Authorization": f"Bearer {r.json()['token']}"}
+    assert (await client.get("/api/admin/stats", headers=old)).status_code == 401
+    assert (await client.get("/api/admin/stats", headers=other)).status_code == 401
+    assert (await client.get("/api/admin/stats", headers=new)).status_code == 200
+    assert (await client.post("/api/admin/login", json={"username": username, "password": password})).status_code == 401
+    await login(username, "new-secret")
+
+
+async def test_regular_admin_cannot_manage_admins(client, login, regular_admin):
+    headers = await login(*regular_admin)
+    assert (await client.get("/api/admin/admins", headers=headers)).status_code == 403
+
+
+async def test_codes_page_with_cursor(client, admin, campaign, make_codes):
+    codes = await make_codes(campaign, 5)
+    seen, cursor = [], None
+    while True:
+        params = {"campaign": campaign, "limit": 2, **({"cursor": cursor} if cursor else {})}
+        body = (await client.get("/api/admin/codes", params=params, headers=admin)).json()
+        seen.extend(c["username"] for c in body["codes"])
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    assert sorted(seen) == sorted(c["username"] for c in codes)
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "WyJhIl0", "WyJ0IiwgIngiXQ"])  # junk, ["a"], ["t", "x"]
+async def test_codes_page_rejects_invalid_cursor(client, admin, campaign, cursor):
+    r = await client.get("/api/admin/codes", params={"campaign": campaign, "cursor": cursor}, headers=admin)
+    assert r.status_code == 400
+    assert r.json()["detail"] == "Invalid cursor"
+
+
+async def test_emptied_campaign_stays_listed(client, admin, campaign, set_prizes):
+    await set_prizes(campaign, [])
+    assert campaign in (await client.get("/api/admin/campaigns", headers=admin)).json()["campaigns"]
+    r = await client.post("/api/admin/campaigns", json={"campaign": campaign}, headers=admin)
+    assert r.status_code == 400
+
+
+async def test_unknown_campaign_is_404(client):
+    assert (await client.get("/api/prizes", params={"campaign": "no-such-campaign"})).status_code == 404
+
+
+async def test_recreated_admin_does_not_accept_old_tokens(client, admin, login, regular_admin):
+    username, password = regular_admin
+    old = await login(username, password)
+    assert (await client.delete(f"/api/admin/admins/{username}", headers=admin)).status_code == 200
+    r = await client.post("/api/admin/create-admin", json={"username": username, "password": "other-pass"}, headers=admin)
+    assert r.status_code == 200
+    assert (await client.get("/api/admin/stats", headers=old)).status_code == 401
+    assert (await client.get("/api/admin/stats", headers=await login(username, "other-pass"))).status_code == 200
@@ -0,0 +1,58 @@
+"""Admin batch draws: per-entry results and stock safety when the client goes away."""
+import asyncio
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def batch_draw(client, admin, campaign_id, entries):
+    r = await client.post(
+        "/api/admin/batch-draw", params={"campaign": campaign_id}, json={"entries": entries}, headers=admin
+    )
+    assert r.status_code == 200, r.text
+    return [json.loads(line) for line in r.text.splitlines()]
+
+
+async def test_batch_draw_reports_each_entry_it_could_not_draw(client, admin, campaign, make_codes):
+    used, fresh = await make_codes(campaign, 2)
+    assert (await client.post("/api/spin", json={**used, "campaign": campaign})).status_code == 200
+    lines = await batch_draw(client, admin, campaign, [
+        fresh, used, {"username": fresh["username"] + "x", "redeem_code": "WRONG"},
+    ])
+    *entries, summary = lines
+    assert {e["username"]: e.get("status", "drawn") for e in entries} == {
+        fresh["username"]: "drawn", used["username"]: "used", fresh["username"] + "x": "invalid",
+    }
+    assert summary["drawn"] == 1 and summary["skipped"] == 2
+
+
+async def test_disconnect_mid_chunk_does_not_strand_reserved_stock(
+    client, admin, campaign, make_codes, set_prizes, monkeypatch
+):
+    await set_prizes(campaign, [{"label": "Capped", "color": "#000", "probability": 1, "stock": 5}])
+    codes = await make_codes(campaign, 3)
+    claiming, resume = asyncio.Event(), asyncio.Event()
+    claim_batch = server.storage.claim_batch
+
+    async def slow_claim_batch(*args):
+        claiming.set()
+        await resume.wait()
+        return await claim_batch(*args)
+
+    monkeypatch.setattr(server.storage, "claim_batch", slow_claim_batch)
+    entries = [codes[0], {"username": codes[1]["username"], "redeem_code": "WRONG"}]
+    req = server.BatchDrawRequest(entries=entries)
+    response = await server.batch_draw(req, server.campaigns[campaign], admin=None)
+    consumer = asyncio.ensure_future(response.body_iterator.__anext__())
+    await claiming.wait()
+    consumer.cancel()  # what the server does when the client disconnects
+    resume.set()
+    with pytest.raises(asyncio.CancelledError):
+        await consumer
+    await asyncio.sleep(0.05)
+    # One unit went to the valid code; the one reserved for the wrong code came back
+    assert await server.storage.stock_remaining(campaign) == {"Capped": 4}
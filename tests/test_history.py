@@ -0,0 +1,38 @@
+"""Draw history write-behind."""
+import asyncio
+
+import pytest
+
+import server
+from server import HistoryWriter
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def stalled_flush(app, monkeypatch):
+    async def failing_flush(records):
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(server.storage, "flush_draws", failing_flush)
+
+
+async def test_close_gives_up_on_a_drain_that_cannot_finish(stalled_flush):
+    writer = HistoryWriter(batch_size=10, flush_interval=0.01, max_pending=5)
+    writer.start()
+    await writer.submit({"campaign": "c", "username": "u"})
+    await asyncio.wait_for(writer.close(0.2), 1)
+    assert writer.task.cancelled()
+
+
+async def test_full_backlog_only_holds_up_its_own_campaign(stalled_flush):
+    writer = HistoryWriter(batch_size=10, flush_interval=0.01, max_pending=2)
+    writer.start()
+    for i in range(2):
+        await writer.submit({"campaign": "hot", "username": f"u{i}"})
+    blocked = asyncio.ensure_future(writer.submit({"campaign": "hot", "username": "u2"}))
+    await asyncio.wait_for(writer.submit({"campaign": "cold", "username": "u0"}), 1)
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+    blocked.cancel()
+    await writer.close(0.1)
@@ -0,0 +1,99 @@
+"""MongoStorage specifics, run against a real server: set MONGO_URL to enable.
+
+Each test gets a throwaway database, dropped afterwards.
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from storage import DEFAULT_CAMPAIGN, STOCK_STRIPES, MongoStorage
+
+MONGO_URL = os.environ.get("MONGO_URL")
+
+pytestmark = [pytest.mark.anyio, pytest.mark.skipif(not MONGO_URL, reason="MONGO_URL is not set")]
+
+CAMPAIGN = "c"
+NOW = "2026-01-01T00:00:00+00:00"
+
+
+@pytest.fixture
+async def engine():
+    """A MongoStorage on an empty database, not initialized yet."""
+    engine = MongoStorage(MONGO_URL, f"lucky_wheel_test_{uuid.uuid4().hex[:12]}")
+    yield engine
+    await engine.client.drop_database(engine.db.name)
+    await engine.close()
+
+
+@pytest.fixture
+async def store(engine):
+    await engine.init()
+    return engine
+
+
+def draw(username: str, drawn_at: str = NOW, campaign: str = CAMPAIGN) -> dict:
+    return {"campaign": campaign, "username": username, "prize_label": "A",
+            "prize_image_url": "", "prize_color": "#000", "drawn_at": drawn_at}
+
+
+def test_draw_ids_key_the_claim_and_sort_by_time():
+    early, late = draw("u1"), draw("u0", drawn_at="2026-01-01T00:00:01+00:00")
+    assert MongoStorage._draw_id(early) == MongoStorage._draw_id(dict(early, prize_label="B"))
+    assert MongoStorage._draw_id(early) < MongoStorage._draw_id(late)
+    assert MongoStorage._draw_id(early) != MongoStorage._draw_id(draw("u1", campaign="other"))
+
+
+async def test_striped_stock_never_oversells(store):
+    await store.reset_stock(CAMPAIGN, {"A": 10})
+    assert await store.db.prize_stock.count_documents({"campaign": CAMPAIGN, "label": "A"}) == STOCK_STRIPES
+    granted = await asyncio.gather(*(store.take_stock(CAMPAIGN, "A", 3) for _ in range(10)))
+    assert sum(granted) == 10
+    assert await store.stock_remaining(CAMPAIGN) == {"A": 0}
+    await store.release_stock(CAMPAIGN, "A", 2)
+    assert await store.take_stock(CAMPAIGN, "A", 5) == 2
+
+
+async def test_claim_batch_returns_only_the_codes_it_won(store):
+    codes = [{"username": f"user{i}", "redeem_code": f"CODE{i:04d}", "is_used": False, "created_at": NOW}
+             for i in range(3)]
+    await store.insert_codes(CAMPAIGN, codes)
+    assert await store.claim_code(CAMPAIGN, "user0", "CODE0000", NOW, "A")  # a spin got there first
+    pairs = [(c["username"], c["redeem_code"]) for c in codes]
+    claimed = await store.claim_batch(CAMPAIGN, pairs, ["A", "B", "C"], NOW, "batch-1")
+    assert sorted(u["username"] for u in claimed) == ["user1", "user2"]
+    assert await store.claim_batch(CAMPAIGN, pairs, ["A", "B", "C"], NOW, "batch-2") == []
+    assert await store.db.users.count_documents({"campaign": CAMPAIGN, "batch_id": "batch-1"}) == 2
+
+
+async def test_rollups_count_rows_missed_by_a_failed_flush(store, monkeypatch):
+    incr_rollups = store._incr_rollups
+    calls = []
+
+    async def flaky_incr_rollups(counts):
+        calls.append(counts)
+        if len(calls) == 1:
+            raise RuntimeError("rollup write failed")
+        await incr_rollups(counts)
+
+    monkeypatch.setattr(store, "_incr_rollups", flaky_incr_rollups)
+    records = [draw(f"user{i}") for i in range(3)]
+    with pytest.raises(RuntimeError):
+        await store.flush_draws(records[:2])
+    await store.flush_draws(records)
+    await store.flush_draws(records)
+    assert [r["count"] for r in await store.rollups(CAMPAIGN, "day")] == [3]
+
+
+async def test_init_adopts_rows_written_before_campaigns(engine):
+    await engine.db.users.insert_one({"username": "old", "redeem_code": "OLD00000", "is_used": False, "created_at": NOW})
+    await engine.db.prizes.insert_many([{"label": "X", "color": "#000"}, {"label": "Y", "color": "#111"}])
+    await engine.db.stats.insert_one({"_id": "draws", "total_draws": 4})
+    await engine.init()
+    await engine.init()  # later startups leave adopted rows alone
+
+    assert (await engine.find_code(DEFAULT_CAMPAIGN, "old", "OLD00000"))["username"] == "old"
+    assert [p["label"] for p in await engine.list_prizes(DEFAULT_CAMPAIGN)] == ["X", "Y"]
+    assert await engine.db.stats.find_one({"_id": f"{DEFAULT_CAMPAIGN}:draws", "campaign": DEFAULT_CAMPAIGN})
+    assert await engine.db.users.count_documents({"campaign": {"$exists": False}}) == 0
@@ -0,0 +1,79 @@
+"""Prize pool sampling and the fairness statistics, without the app."""
+import math
+import random
+
+import numpy as np
+import pytest
+
+from server import PrizePool, chi_square_sf, outcome_report
+
+PRIZES = [
+    {"label": "A", "color": "#000", "probability": 50},
+    {"label": "B", "color": "#111", "probability": 30},
+    {"label": "C", "color": "#222", "probability": 15},
+    {"label": "D", "color": "#333", "probability": 5},
+    {"label": "Off", "color": "#444", "probability": 0},
+]
+
+
+def alias_shares(pool: PrizePool) -> dict:
+    """Exact probability of each eligible prize implied by the alias table."""
+    n = len(pool.eligible)
+    shares = [0.0] * n
+    for i, (prob, alias) in enumerate(zip(pool._prob, pool._alias)):
+        shares[i] += prob / n
+        shares[alias] += (1.0 - prob) / n
+    return {p["label"]: share for p, share in zip(pool.eligible, shares)}
+
+
+def test_alias_table_matches_configured_weights():
+    shares = alias_shares(PrizePool(PRIZES))
+    assert shares == pytest.approx({"A": 0.5, "B": 0.3, "C": 0.15, "D": 0.05})
+
+
+def test_exhausted_prizes_are_dropped_and_the_rest_renormalized():
+    pool = PrizePool(PRIZES, exhausted=frozenset({"A"}))
+    assert [p["label"] for p in pool.eligible] == ["B", "C", "D"]
+    assert alias_shares(pool) == pytest.approx({"B": 0.6, "C": 0.3, "D": 0.1})
+    rng = random.Random(7)
+    assert {pool.draw(rng)["label"] for _ in range(2000)} == {"B", "C", "D"}
+
+
+def test_draw_indices_follow_the_weights():
+    pool = PrizePool(PRIZES)
+    counts = np.bincount(pool.draw_indices(200_000, np.random.default_rng(1)), minlength=len(pool.eligible))
+    assert counts / counts.sum() == pytest.approx([0.5, 0.3, 0.15, 0.05], abs=0.005)
+
+
+def test_empty_pool_has_nothing_eligible():
+    assert PrizePool([]).eligible == []
+    assert PrizePool(PRIZES, exhausted=frozenset({"A", "B", "C", "D"})).eligible == []
+
+
+@pytest.mark.parametrize("statistic, df, expected", [
+    (3.841458820694124, 1, 0.05),
+    (6.634896601021214, 1, 0.01),
+    (5.991464547107979, 2, 0.05),
+    (18.307038053275146, 10, 0.05),
+    (124.3421134287, 100, 0.05),
+    (10.0, 2, math.exp(-5.0)),  # df=2: exp(-x/2)
+    (10.0, 4, 6.0 * math.exp(-5.0)),  # df=4: exp(-x/2) * (1 + x/2)
+    (0.5, 3, 0.9188914561811952),
+    (0.0, 5, 1.0),
+])
+def test_chi_square_sf_known_values(statistic, df, expected):
+    assert chi_square_sf(statistic, df) == pytest.approx(expected, rel=1e-6)
+
+
+def test_outcome_report_flags_a_skewed_distribution():
+    prizes = PRIZES[:4]
+    fair = outcome_report(prizes, [5000, 3000, 1500, 500])
+    assert fair["total"] == 10000
+    assert fair["chi_square"]["p_value"] == pytest.approx(1.0)
+    assert fair["chi_square"]["consistent"]
+    assert all(row["within_ci"] for row in fair["prizes"])
+
+    skewed = outcome_report(prizes, [5600, 2600, 1300, 500])
+    assert skewed["chi_square"]["p_value"] < 0.001
+    assert not skewed["chi_square"]["consistent"]
+    assert not skewed["prizes"][0]["within_ci"]
@@ -0,0 +1,59 @@
+"""Per-IP and per-user token buckets and the client address they key on."""
+import pytest
+from starlette.requests import Request
+
+import server
+from server import TokenBucketLimiter, client_ip
+
+
+def request_from(peer: str, forwarded: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded.encode())] if forwarded is not None else []
+    return Request({"type": "http", "headers": headers, "client": (peer, 1234)})
+
+
+@pytest.mark.parametrize("hops, forwarded, expected", [
+    (1, "203.0.113.7", "203.0.113.7"),
+    (1, "6.6.6.6, 203.0.113.7", "203.0.113.7"),  # the left entry is client-supplied
+    (2, "6.6.6.6, 203.0.113.7, 10.0.0.2", "203.0.113.7"),
+    (2, "203.0.113.7", "10.0.0.1"),  # fewer entries than proxies: not from the proxies
+    (1, None, "10.0.0.1"),
+    (0, "6.6.6.6", "10.0.0.1"),
+])
+def test_client_ip_uses_the_entry_added_by_the_outermost_proxy(monkeypatch, hops, forwarded, expected):
+    monkeypatch.setattr(server, "RATE_LIMIT_PROXY_HOPS", hops)
+    assert client_ip(request_from("10.0.0.1", forwarded)) == expected
+
+
+def test_token_bucket_allows_a_burst_then_refills(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+    limiter = TokenBucketLimiter(rate=2.0, burst=3, max_keys=10)
+    assert [limiter.acquire("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    assert limiter.acquire("b") == 0.0
+    now[0] += 0.5
+    assert limiter.acquire("a") == 0.0
+
+
+def test_token_bucket_keeps_at_most_max_keys():
+    limiter = TokenBucketLimiter(rate=1.0, burst=1, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.acquire(key)
+    assert list(limiter.buckets) == ["b", "c"]
+
+
+@pytest.mark.anyio
+async def test_forged_forwarded_for_does_not_escape_the_spin_limit(client, campaign, monkeypatch):
+    monkeypatch.setattr(server, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(server, "RATE_LIMIT_PROXY_HOPS", 1)
+    monkeypatch.setattr(server, "spin_ip_limiter", TokenBucketLimiter(0.001, 2, 100))
+    monkeypatch.setattr(server, "spin_user_limiter", TokenBucketLimiter(1000.0, 1000, 100))
+
+    async def spin(forwarded: str) -> int:
+        body = {"username": "nobody", "redeem_code": "NOPE", "campaign": campaign}
+        return (await client.post("/api/spin", json=body, headers={"X-Forwarded-For": forwarded})).status_code
+
+    statuses = [await spin(f"198.51.100.{i}, 203.0.113.7") for i in range(3)]
+    assert statuses == [400, 400, 429]
+    # Another client behind the same ingress has a bucket of its own
+    assert await spin("203.0.113.8") == 400
@@ -0,0 +1,179 @@
+"""Spins through the HTTP API: one winner per code, stock caps and idempotent retries."""
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def spin(client, code, campaign_id, key=None):
+    headers = {"Idempotency-Key": key} if key else {}
+    return client.post("/api/spin", json={**code, "campaign": campaign_id}, headers=headers)
+
+
+async def test_spin_awards_a_prize_once(client, campaign, make_codes, total_draws):
+    [code] = await make_codes(campaign, 1)
+    r = await spin(client, code, campaign)
+    assert r.status_code == 200
+    assert r.json()["prize"]["label"]
+
+    r = await spin(client, code, campaign)
+    assert r.status_code == 400
+    assert r.json()["detail"] == "This redeem code has already been used"
+    assert await total_draws(campaign) == 1
+
+
+async def test_unknown_code_is_rejected_before_taking_stock(client, campaign, make_codes, set_prizes, admin):
+    await set_prizes(campaign, [{"label": "Capped", "color": "#000", "probability": 1, "stock": 1}])
+    [code] = await make_codes(campaign, 1)
+    r = await spin(client, {**code, "redeem_code": "WRONG"}, campaign)
+    assert r.status_code == 400
+    prizes = (await client.get("/api/admin/prizes", params={"campaign": campaign}, headers=admin)).json()["prizes"]
+    assert prizes[0]["remaining"] == 1
+
+
+async def test_uncapped_draws_claim_without_reading_the_code_first(
+    client, campaign, make_codes, set_prizes, monkeypatch
+):
+    reads = []
+    find_code = server.storage.find_code
+
+    async def counting_find_code(*args):
+        reads.append(args)
+        return await find_code(*args)
+
+    monkeypatch.setattr(server.storage, "find_code", counting_find_code)
+    await set_prizes(campaign, [{"label": "Free", "color": "#000", "probability": 1}])
+    [code] = await make_codes(campaign, 1)
+    assert (await spin(client, code, campaign)).status_code == 200
+    assert reads == []
+
+    await set_prizes(campaign, [{"label": "Capped", "color": "#000", "probability": 1, "stock": 5}])
+    [code] = await make_codes(campaign, 1)
+    assert (await spin(client, code, campaign)).status_code == 200
+    assert len(reads) == 1
+
+
+async def test_used_code_does_not_take_capped_stock(client, campaign, make_codes, set_prizes, admin):
+    await set_prizes(campaign, [{"label": "Capped", "color": "#000", "probability": 1, "stock": 3}])
+    [code] = await make_codes(campaign, 1)
+    assert (await spin(client, code, campaign)).status_code == 200
+    for _ in range(3):
+        assert (await spin(client, code, campaign)).status_code == 400
+    prizes = (await client.get("/api/admin/prizes", params={"campaign": campaign}, headers=admin)).json()["prizes"]
+    assert prizes[0]["remaining"] == 2
+
+
+async def test_concurrent_spins_of_one_code_have_a_single_winner(client, campaign, make_codes, total_draws):
+    [code] = await make_codes(campaign, 1)
+    responses = await asyncio.gather(*(spin(client, code, campaign) for _ in range(50)))
+    won = [r.json() for r in responses if r.status_code == 200]
+    assert won, [r.text for r in responses]
+    # Duplicates that coalesced onto the winning request share its result
+    assert all(body == won[0] for body in won)
+    assert all(r.status_code in (200, 400) for r in responses)
+    assert await total_draws(campaign) == 1
+
+
+async def test_stock_cap_is_never_exceeded(client, campaign, make_codes, set_prizes, total_draws, admin):
+    await set_prizes(campaign, [
+        {"label": "Rare", "color": "#000", "probability": 99, "stock": 2},
+        {"label": "Common", "color": "#111", "probability": 1},
+    ])
+    codes = await make_codes(campaign, 20)
+    responses = await asyncio.gather(*(spin(client, code, campaign) for code in codes))
+    labels = [r.json()["prize"]["label"] for r in responses]
+    assert labels.count("Rare") == 2
+    assert labels.count("Common") == 18
+    assert await total_draws(campaign) == 20
+
+    prizes = (await client.get("/api/admin/prizes", params={"campaign": campaign}, headers=admin)).json()["prizes"]
+    assert {p["label"]: p.get("remaining") for p in prizes} == {"Rare": 0, "Common": None}
+    assert server.campaigns[campaign].pool.exhausted == {"Rare"}
+
+
+async def test_saving_prizes_keeps_units_held_by_in_flight_spins(client, campaign, set_prizes, admin):
+    capped = {"label": "Capped", "color": "#000", "probability": 1, "stock": 5}
+    await set_prizes(campaign, [capped])
+
+    async def remaining():
+        prizes = (await client.get("/api/admin/prizes", params={"campaign": campaign}, headers=admin)).json()
+        return prizes["prizes"][0]["remaining"]
+
+    # Two spins have reserved a unit each but not claimed yet
+    assert await server.storage.take_stock(campaign, "Capped", 2) == 2
+    await set_prizes(campaign, [capped])
+    assert await remaining() == 3
+    await set_prizes(campaign, [{**capped, "stock": 7}])
+    assert await remaining() == 5
+
+    # Cutting below what is reserved leaves a debt the failed spins repay
+    await set_prizes(campaign, [{**capped, "stock": 1}])
+    assert await remaining() == 0
+    assert server.campaigns[campaign].pool.exhausted == {"Capped"}
+    await server.storage.release_stock(campaign, "Capped", 1)
+    await server.storage.release_stock(campaign, "Capped", 1)
+    assert await server.storage.take_stock(campaign, "Capped", 5) == 1
+
+
+async def test_spin_fails_once_every_prize_is_out_of_stock(client, campaign, make_codes, set_prizes):
+    await set_prizes(campaign, [{"label": "Only", "color": "#000", "probability": 1, "stock": 1}])
+    first, second = await make_codes(campaign, 2)
+    assert (await spin(client, first, campaign)).status_code == 200
+    r = await spin(client, second, campaign)
+    assert r.status_code == 409
+    # The rejected spin leaves the code usable once stock is added
+    await set_prizes(campaign, [{"label": "Only", "color": "#000", "probability": 1, "stock": 2}])
+    assert (await spin(client, second, campaign)).status_code == 200
+
+
+async def test_idempotent_retry_replays_the_original_result(client, campaign, make_codes, total_draws):
+    [code] = await make_codes(campaign, 1)
+    first = await spin(client, code, campaign, key="retry-1")
+    assert first.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+
+    retry = await spin(client, code, campaign, key="retry-1")
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+
+    # Another worker (or this one after eviction) answers from the stored claim
+    server.spin_replays.entries.clear()
+    retry = await spin(client, code, campaign, key="retry-1")
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json()["prize"]["label"] == first.json()["prize"]["label"]
+    assert await total_draws(campaign) == 1
+
+
+async def test_idempotency_key_cannot_be_reused_for_another_code(client, campaign, make_codes):
+    first, second = await make_codes(campaign, 2)
+    assert (await spin(client, first, campaign, key="shared")).status_code == 200
+    r = await spin(client, second, campaign, key="shared")
+    assert r.status_code == 422
+
+    server.spin_replays.entries.clear()
+    r = await spin(client, second, campaign, key="shared")
+    assert r.status_code == 422
+    assert (await spin(client, second, campaign)).status_code == 200
+
+
+async def test_first_attempt_with_a_key_skips_the_claim_lookup(client, campaign, make_codes, monkeypatch):
+    lookups = []
+    find_claim = server.storage.find_claim
+
+    async def counting_find_claim(campaign_id, key):
+        lookups.append(key)
+        return await find_claim(campaign_id, key)
+
+    monkeypatch.setattr(server.storage, "find_claim", counting_find_claim)
+    [code] = await make_codes(campaign, 1)
+    assert (await spin(client, code, campaign, key="first-try")).status_code == 200
+    assert lookups == []
+
+    server.spin_replays.entries.clear()
+    retry = await spin(client, code, campaign, key="first-try")
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert lookups == ["first-try"]
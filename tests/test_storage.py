@@ -0,0 +1,151 @@
+"""Storage contract, checked against the embedded engine."""
+import asyncio
+
+import pytest
+
+from storage import SQLiteStorage
+
+pytestmark = pytest.mark.anyio
+
+CAMPAIGN = "c"
+NOW = "2026-01-01T00:00:00+00:00"
+
+
+@pytest.fixture
+async def store():
+    engine = SQLiteStorage(":memory:")
+    await engine.init()
+    yield engine
+    await engine.close()
+
+
+def code_docs(count: int, created_at=lambda i: f"2026-01-01T00:00:{i:02d}+00:00"):
+    return [
+        {"username": f"user{i}", "redeem_code": f"CODE{i:04d}", "is_used": False, "created_at": created_at(i)}
+        for i in range(count)
+    ]
+
+
+async def test_insert_codes_skips_taken_usernames_and_reports_collisions(store):
+    inserted, collided = await store.insert_codes(CAMPAIGN, code_docs(3))
+    assert [d["username"] for d in inserted] == ["user0", "user1", "user2"]
+    assert collided == []
+
+    again = [
+        {"username": "user0", "redeem_code": "FRESH001", "is_used": False, "created_at": NOW},
+        {"username": "user9", "redeem_code": "CODE0001", "is_used": False, "created_at": NOW},
+    ]
+    inserted, collided = await store.insert_codes(CAMPAIGN, again)
+    assert inserted == []
+    assert collided == ["user9"]
+    # Another campaign has its own namespace
+    inserted, _ = await store.insert_codes("other", code_docs(1))
+    assert len(inserted) == 1
+
+
+async def test_claim_code_succeeds_once(store):
+    await store.insert_codes(CAMPAIGN, code_docs(1))
+    assert not await store.claim_code(CAMPAIGN, "user0", "WRONG", NOW, "A")
+    assert await store.claim_code(CAMPAIGN, "user0", "CODE0000", NOW, "A")
+    assert not await store.claim_code(CAMPAIGN, "user0", "CODE0000", NOW, "B")
+
+    code = await store.find_code(CAMPAIGN, "user0", "CODE0000")
+    assert code["is_used"] and code["prize_label"] == "A" and code["used_at"] == NOW
+    assert await store.pending_draws("9999") == [
+        {"campaign": CAMPAIGN, "username": "user0", "prize_label": "A", "used_at": NOW}
+    ]
+
+
+async def test_concurrent_claims_have_one_winner(store):
+    await store.insert_codes(CAMPAIGN, code_docs(1))
+    results = await asyncio.gather(*(
+        store.claim_code(CAMPAIGN, "user0", "CODE0000", NOW, f"P{i}") for i in range(20)
+    ))
+    assert results.count(True) == 1
+
+
+async def test_idempotency_key_is_unique_per_campaign(store):
+    await store.insert_codes(CAMPAIGN, code_docs(2))
+    assert await store.claim_code(CAMPAIGN, "user0", "CODE0000", NOW, "A", idempotency_key="k1")
+    assert not await store.claim_code(CAMPAIGN, "user1", "CODE0001", NOW, "A", idempotency_key="k1")
+    assert (await store.find_claim(CAMPAIGN, "k1"))["username"] == "user0"
+    assert await store.find_claim(CAMPAIGN, "k2") is None
+
+
+async def test_page_codes_walks_every_row_once_newest_first(store):
+    # Ties on created_at are broken by id
+    await store.insert_codes(CAMPAIGN, code_docs(7, created_at=lambda i: f"2026-01-01T00:00:{i // 2:02d}+00:00"))
+    seen, after = [], None
+    while True:
+        page = await store.page_codes(CAMPAIGN, None, 3, after)
+        seen.extend(page)
+        if len(page) < 3:
+            break
+        after = (page[-1]["created_at"], page[-1]["_id"])
+    assert sorted(d["username"] for d in seen) == [f"user{i}" for i in range(7)]
+    keys = [(d["created_at"], int(d["_id"])) for d in seen]
+    assert keys == sorted(keys, reverse=True)
+
+    await store.claim_code(CAMPAIGN, "user3", "CODE0003", NOW, "A")
+    assert [d["username"] for d in await store.page_codes(CAMPAIGN, True, 10)] == ["user3"]
+    assert len(await store.page_codes(CAMPAIGN, False, 10)) == 6
+
+
+async def test_page_codes_rejects_invalid_cursor(store):
+    with pytest.raises(ValueError):
+        await store.page_codes(CAMPAIGN, None, 3, (NOW, "not-an-id"))
+
+
+async def test_stock_take_and_release(store):
+    await store.reset_stock(CAMPAIGN, {"A": 5, "B": 0})
+    assert await store.take_stock(CAMPAIGN, "A", 3) == 3
+    assert await store.take_stock(CAMPAIGN, "A", 5) == 2
+    assert await store.take_stock(CAMPAIGN, "A", 1) == 0
+    assert await store.take_stock(CAMPAIGN, "B", 1) == 0
+    await store.release_stock(CAMPAIGN, "A", 2)
+    assert await store.stock_remaining(CAMPAIGN) == {"A": 2, "B": 0}
+    assert await store.take_stock(CAMPAIGN, "A", 10) == 2
+
+
+async def test_stock_debt_is_repaid_before_units_are_takeable(store):
+    await store.reset_stock(CAMPAIGN, {"A": 2, "B": 3})
+    assert await store.take_stock(CAMPAIGN, "A", 2) == 2
+    await store.release_stock(CAMPAIGN, "A", -2)
+    assert (await store.stock_remaining(CAMPAIGN))["A"] == -2
+    await store.release_stock(CAMPAIGN, "A", 3)
+    assert await store.take_stock(CAMPAIGN, "A", 5) == 1
+
+    # keep leaves a label's counters alone; unlisted labels lose theirs
+    await store.reset_stock(CAMPAIGN, {"C": 4}, keep=["B"])
+    assert await store.stock_remaining(CAMPAIGN) == {"B": 3, "C": 4}
+
+
+async def test_concurrent_stock_takes_never_oversell(store):
+    await store.reset_stock(CAMPAIGN, {"A": 10})
+    granted = await asyncio.gather(*(store.take_stock(CAMPAIGN, "A", 3) for _ in range(10)))
+    assert sum(granted) == 10
+    assert await store.stock_remaining(CAMPAIGN) == {"A": 0}
+
+
+async def test_flush_draws_writes_each_claim_once(store):
+    await store.insert_codes(CAMPAIGN, code_docs(2))
+    records = []
+    for i in range(2):
+        await store.claim_code(CAMPAIGN, f"user{i}", f"CODE{i:04d}", NOW, "A")
+        records.append({
+            "campaign": CAMPAIGN, "username": f"user{i}", "prize_label": "A",
+            "prize_image_url": "", "prize_color": "#000", "drawn_at": NOW,
+        })
+    await store.flush_draws(records)
+    await store.flush_draws(records)
+    assert len(await store.page_history(CAMPAIGN, 10)) == 2
+    assert await store.pending_draws("9999") == []
+    assert (await store.reconcile_stats(CAMPAIGN))["total_draws"] == 2
+
+
+async def test_campaigns_outlive_an_empty_prize_pool(store):
+    assert await store.seed_campaigns({"a": [{"label": "X"}], "b": [{"label": "Y"}]}) == ["a", "b"]
+    assert await store.seed_campaigns({"a": [{"label": "Z"}]}) == []
+    await store.replace_prizes("a", [])
+    assert await store.list_campaigns() == ["a", "b"]
+    assert await store.list_prizes("b") == [{"label": "Y"}]